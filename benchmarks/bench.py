@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Times the parser, matcher, applier and slicer on generated C files and
+patches (see generate.py), each on its own, and optionally compares the
+results with a saved baseline.
+
+    benchmarks/bench.py --output results.json
+    benchmarks/bench.py --baseline results.json
+
+Exits with 1 if a benchmark got more than --tolerance slower than the
+baseline, or if importing apply.py takes longer than IMPORT_BUDGET.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+import scripts.overlay as overlay
+import scripts.source_file as source_file
+from scripts.enums import natureOfChange, precheckStatus
+from scripts.patch_apply.patchParser import PatchFile
+from benchmarks import generate
+
+# Importing apply.py, before any patch has failed, should take no longer
+# than this (in seconds); the matcher and the slicer are only imported
+# once they are needed.
+IMPORT_BUDGET = 0.1
+# A benchmark has regressed once its median is this much slower than the
+# baseline's.
+DEFAULT_TOLERANCE = 0.25
+FILE_NAME = "bench.c"
+PATCH_NAME = "bench.patch"
+
+
+class Skip(Exception):
+    """
+    Raised by a benchmark that can't run here, with the reason.
+    """
+
+
+def write_case(lines, patch):
+    with open(FILE_NAME, "w") as fileObj:
+        fileObj.writelines(lines)
+    with open(PATCH_NAME, "w") as fileObj:
+        fileObj.write(patch)
+    reset()
+
+
+def reset():
+    """
+    Forgets everything read so far, so every run starts cold.
+    """
+    overlay.rollback()
+    source_file.clear()
+
+
+def parsed():
+    patch_file = PatchFile(PATCH_NAME)
+    patch_file.getPatch()
+    return patch_file.patches[0]
+
+
+def preimage(patch):
+    return [
+        line for kind, line in patch.getLines()[1:] if kind != natureOfChange.ADDED
+    ]
+
+
+def bench_parse(params):
+    lines, patch = generate.patch_file(params["hunks"] * 20, params["hunks"])
+    write_case(lines, patch)
+    return None, lambda: PatchFile(PATCH_NAME).getPatch()
+
+
+def bench_can_apply(params):
+    write_case(*generate.case(params["lines"], params["hunk"], params["drift"], params["changed"]))
+    patch = {}
+
+    def before():
+        reset()
+        patch["hunk"] = parsed()
+
+    def run():
+        status = patch["hunk"].canApply(FILE_NAME)
+        if params["changed"] == 0 and status != precheckStatus.CAN_APPLY:
+            raise Skip("the generated hunk did not apply")
+
+    return before, run
+
+
+def bench_apply(params):
+    write_case(*generate.case(params["lines"], params["hunk"], params["drift"]))
+    patch = {}
+
+    def before():
+        reset()
+        patch["hunk"] = parsed()
+
+    def run():
+        # Apply() rolls the overlay back itself on a dry run.
+        if not patch["hunk"].Apply(FILE_NAME, dry_run=True):
+            raise Skip("the generated hunk did not apply")
+
+    return before, run
+
+
+def bench_fuzzy_search(params):
+    import scripts.patch_match.test_match as tm
+
+    write_case(*generate.case(params["lines"], params["hunk"], params["drift"], params["changed"]))
+    patch = parsed()
+    search_lines = preimage(patch)
+
+    def run():
+        return tm.fuzzy_search(search_lines, FILE_NAME, patch._newStart, tm.Retry(5, 50))
+
+    return reset, run
+
+
+def bench_find_diffs(params):
+    import scripts.patch_match.test_match as tm
+
+    write_case(*generate.case(params["lines"], params["hunk"], params["drift"], params["changed"]))
+    patch = parsed()
+
+    def run():
+        return tm.find_diffs(patch, FILE_NAME, tm.Retry(5, 50))
+
+    return reset, run
+
+
+def bench_context_changes(params):
+    import scripts.patch_context.context_changes as cc
+
+    write_case(*generate.case(params["lines"], params["hunk"], params["drift"], params["changed"]))
+    patch = parsed()
+    return reset, lambda: cc.context_changes(patch)
+
+
+def bench_slice_parse(params):
+    import scripts.patch_context.slice_and_parse as slicer
+
+    if shutil.which("srcml") is None:
+        raise Skip("srcml is not installed")
+    if not os.access(slicer.src_slice_path, os.X_OK):
+        raise Skip("srcslice is not built for this platform")
+
+    write_case(generate.c_file(params["lines"]), "")
+    # Without the cache, so the tools are really run every time.
+    return None, lambda: slicer.SliceParser(FILE_NAME, cache=None).slice_parse()
+
+
+def bench_import(params):
+    # Run in a new interpreter each time, so nothing is imported already.
+    code = "import scripts.patch_apply.apply"
+
+    def run():
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+    def baseline():
+        subprocess.run([sys.executable, "-c", "pass"], cwd=ROOT, check=True)
+
+    return None, run, baseline
+
+
+# (name, parameters, quick) for every benchmark.  Only the quick ones are
+# run with --quick.
+BENCHMARKS = [
+    ("parse", {"hunks": 10}, True),
+    ("parse", {"hunks": 1000}, False),
+    ("can_apply", {"lines": 1000, "hunk": 3, "drift": 10, "changed": 0}, True),
+    ("can_apply", {"lines": 50000, "hunk": 30, "drift": 100, "changed": 0}, False),
+    ("can_apply", {"lines": 200000, "hunk": 300, "drift": 1000, "changed": 0}, False),
+    ("can_apply", {"lines": 50000, "hunk": 30, "drift": 100, "changed": 2}, False),
+    ("apply", {"lines": 1000, "hunk": 3, "drift": 10}, True),
+    ("apply", {"lines": 50000, "hunk": 30, "drift": 100}, False),
+    ("apply", {"lines": 200000, "hunk": 300, "drift": 1000}, False),
+    ("fuzzy_search", {"lines": 1000, "hunk": 30, "drift": 10, "changed": 2}, True),
+    ("fuzzy_search", {"lines": 50000, "hunk": 30, "drift": 100, "changed": 5}, False),
+    ("fuzzy_search", {"lines": 200000, "hunk": 300, "drift": 1000, "changed": 20}, False),
+    ("find_diffs", {"lines": 1000, "hunk": 3, "drift": 10, "changed": 1}, True),
+    ("find_diffs", {"lines": 50000, "hunk": 30, "drift": 100, "changed": 5}, False),
+    ("find_diffs", {"lines": 50000, "hunk": 300, "drift": 100, "changed": 20}, False),
+    ("context_changes", {"lines": 1000, "hunk": 30, "drift": 10, "changed": 2}, True),
+    ("context_changes", {"lines": 50000, "hunk": 300, "drift": 100, "changed": 20}, False),
+    ("slice_parse", {"lines": 1000}, True),
+    ("slice_parse", {"lines": 50000}, False),
+    ("import", {}, True),
+]
+
+FUNCTIONS = {
+    "parse": bench_parse,
+    "can_apply": bench_can_apply,
+    "apply": bench_apply,
+    "fuzzy_search": bench_fuzzy_search,
+    "find_diffs": bench_find_diffs,
+    "context_changes": bench_context_changes,
+    "slice_parse": bench_slice_parse,
+    "import": bench_import,
+}
+
+
+def key(name, params):
+    """
+    Returns the name the results of a benchmark are stored under, such as
+    "find_diffs[hunk=30,lines=50000]".
+    """
+    if not params:
+        return name
+    return "%s[%s]" % (name, ",".join("%s=%s" % item for item in sorted(params.items())))
+
+
+def measure(before, run, repeat):
+    """
+    Returns how long run() took each of repeat times, in seconds, with
+    before() (if any) run untimed ahead of each.  run() is run once more
+    first, untimed, so lexers and the like are loaded before timing.
+    """
+    times = []
+    for i in range(repeat + 1):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times[1:]
+
+
+def run_benchmarks(quick=False, repeat=5, selected=None):
+    """
+    Runs the benchmarks (only the quick ones if quick is True, and only
+    those whose key contains selected, if given) in a temporary
+    directory, and returns the results by key.
+    """
+    results = {}
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp(prefix="applyplus-bench-")
+    # The slices are cached on disk by contents, which would make every
+    # run after the first a cache hit.
+    slice_cache = os.environ.get("APPLYPLUS_SLICE_CACHE")
+    os.environ["APPLYPLUS_SLICE_CACHE"] = "0"
+    try:
+        os.chdir(tmp)
+        for name, params, is_quick in BENCHMARKS:
+            name_key = key(name, params)
+            if (quick and not is_quick) or (selected and selected not in name_key):
+                continue
+
+            try:
+                functions = FUNCTIONS[name](params)
+                times = measure(functions[0], functions[1], repeat)
+                if len(functions) > 2:
+                    # Take off the time it takes to start python at all.
+                    start = min(measure(None, functions[2], repeat))
+                    times = [max(t - start, 0.0) for t in times]
+            except Skip as e:
+                results[name_key] = {"params": params, "skipped": str(e)}
+                continue
+            finally:
+                reset()
+
+            results[name_key] = {
+                "params": params,
+                "min": min(times),
+                "median": statistics.median(times),
+                "runs": times,
+            }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+        if slice_cache is None:
+            del os.environ["APPLYPLUS_SLICE_CACHE"]
+        else:
+            os.environ["APPLYPLUS_SLICE_CACHE"] = slice_cache
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a list of (key, baseline median, median) for every benchmark
+    that is more than tolerance slower than in baseline.
+    """
+    regressions = []
+    for name_key, result in results.items():
+        before = baseline.get(name_key)
+        if not before or "median" not in before or "median" not in result:
+            continue
+        if result["median"] > before["median"] * (1 + tolerance):
+            regressions.append((name_key, before["median"], result["median"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the patch parser, matcher, applier and slicer")
+    parser.add_argument("--quick", action="store_true", help="Only run the small benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="Times to run each benchmark")
+    parser.add_argument("--filter", help="Only run the benchmarks with this in their name")
+    parser.add_argument("--output", help="File to save the results to, as JSON")
+    parser.add_argument("--baseline", help="Results saved with --output to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help="How much slower than the baseline counts as a regression (default %s)" % DEFAULT_TOLERANCE,
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, max(args.repeat, 1), args.filter)
+    for name_key, result in results.items():
+        if "skipped" in result:
+            print( "%-60s skipped: %s" % (name_key, result["skipped"]) )
+        else:
+            print( "%-60s %10.2fms" % (name_key, result["median"] * 1000) )
+
+    if args.output:
+        with open(args.output, "w") as fileObj:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "benchmarks": results,
+            }, fileObj, indent=2)
+
+    failed = False
+    imported = results.get("import")
+    if imported and "median" in imported and imported["median"] > IMPORT_BUDGET:
+        print( "Importing apply.py took %.0fms, more than the %.0fms allowed" % (
+            imported["median"] * 1000, IMPORT_BUDGET * 1000) )
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as fileObj:
+            baseline = json.load(fileObj)["benchmarks"]
+        for name_key, before, after in compare(results, baseline, args.tolerance):
+            print( "%s regressed: %.2fms -> %.2fms" % (name_key, before * 1000, after * 1000) )
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import random
+
+
+NAMES = [
+    "buffer", "length", "offset", "device", "packet", "header", "status",
+    "count", "index", "flags", "state", "entry", "queue", "table", "value",
+    "limit", "config", "context", "result", "handle",
+]
+
+
+def c_file(count, seed=0):
+    """
+    Returns count lines (each ending with a newline) of C that look like
+    driver code: functions of a couple of dozen lines with statements,
+    conditions and comments.  The same count and seed always give the
+    same file.
+    """
+    rand = random.Random(seed)
+    lines = ["#include <stdio.h>\n", "#include <stdlib.h>\n", "\n"]
+    function = 0
+    while len(lines) < count:
+        function += 1
+        name = "%s_%s_%d" % (rand.choice(NAMES), rand.choice(NAMES), function)
+        lines.append("/* %s: handles the %s of the %s. */\n" % (name, rand.choice(NAMES), rand.choice(NAMES)))
+        lines.append("static int %s(struct %s *%s, int %s)\n" % (name, rand.choice(NAMES), rand.choice(NAMES), rand.choice(NAMES)))
+        lines.append("{\n")
+        for statement in range(rand.randint(8, 30)):
+            a, b, c = rand.choice(NAMES), rand.choice(NAMES), rand.choice(NAMES)
+            kind = rand.random()
+            if kind < 0.15:
+                lines.append("\tif (%s->%s > %d) {\n" % (a, b, rand.randint(0, 4096)))
+                lines.append("\t\t%s = %s_%s(%s, %d);\n" % (c, a, b, c, rand.randint(0, 64)))
+                lines.append("\t}\n")
+            elif kind < 0.2:
+                lines.append("\t/* Update the %s of the %s. */\n" % (b, a))
+            elif kind < 0.25:
+                lines.append("\n")
+            else:
+                lines.append("\t%s->%s = %s + %d;\n" % (a, b, c, rand.randint(0, 4096)))
+        lines.append("\treturn %s;\n" % rand.choice(NAMES))
+        lines.append("}\n")
+        lines.append("\n")
+    return lines[:count]
+
+
+def is_changed(i, length, context=3):
+    """
+    Returns whether line i of a hunk of length lines is changed by the
+    hunk: the first and last context lines (fewer for short hunks) are
+    left alone, and every other line in between is changed.
+    """
+    context = max(min(context, (length - 1) // 2), 0)
+    return context <= i < length - context and not (i - context) % 2
+
+
+def hunk(lines, start, length, name="bench.c"):
+    """
+    Returns a unified diff hunk (with its file header) for length lines of
+    lines starting at start (counting from 0), changing the lines that
+    is_changed() says.
+    """
+    old = []
+    new = []
+    body = []
+    for i, line in enumerate(lines[start:start + length]):
+        if not is_changed(i, length):
+            body.append(" " + line)
+            old.append(line)
+            new.append(line)
+        else:
+            body.append("-" + line)
+            body.append("+" + line.replace(";", "; /* changed */", 1).replace("\n", "") + "\n")
+            old.append(line)
+            new.append(body[-1][1:])
+
+    header = "--- a/%s\n+++ b/%s\n@@ -%d,%d +%d,%d @@\n" % (
+        name, name, start + 1, len(old), start + 1, len(new)
+    )
+    return header + "".join(body)
+
+
+def case(count, length, drift=0, changed=0, seed=0, name="bench.c"):
+    """
+    Returns (file lines, patch text) for a file of count lines and a
+    patch with one hunk of length lines made against it, in the middle
+    of the file.  The file returned has drifted from the one the patch
+    was made against: drift lines have been added above the hunk, and
+    changed of the hunk's context lines have been edited.
+    """
+    original = c_file(count, seed)
+    start = max(min(count // 2, count - length), 0)
+    patch = hunk(original, start, length, name)
+
+    lines = list(original)
+    rand = random.Random(seed + 1)
+    context = [
+        i for i in range(start, min(start + length, count)) if not is_changed(i - start, length)
+    ]
+    for i in rand.sample(context, min(changed, len(context))):
+        lines[i] = lines[i].replace("\n", " /* drifted */\n")
+    inserted = [
+        "\t%s = %d; /* added above the hunk */\n" % (rand.choice(NAMES), i) for i in range(drift)
+    ]
+    lines[start:start] = inserted
+    return lines, patch
+
+
+def patch_file(count, hunks, length=10, seed=0, name="bench.c"):
+    """
+    Returns (file lines, patch text) for a file of count lines and a
+    patch with hunks hunks of length lines spread evenly over it.
+    """
+    lines = c_file(count, seed)
+    step = max(count // hunks, length)
+    text = "--- a/%s\n+++ b/%s\n" % (name, name)
+    for start in range(0, min(hunks * step, count - length), step):
+        text += hunk(lines, start, length, name).split("\n", 2)[2]
+    return lines, text
@@ -0,0 +1,115 @@
+import os
+import json
+import tempfile
+
+
+def cache_dir(*parts):
+    """
+    Returns (and creates if needed) the directory used for the persistent
+    caches.  By default this is ~/.cache/applyplus, but it can be moved
+    with the APPLYPLUS_CACHE_DIR environment variable.
+    """
+    base = os.environ.get("APPLYPLUS_CACHE_DIR")
+    if not base:
+        base = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "applyplus",
+        )
+
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class DiskCache:
+    """
+    A small on-disk key/value store.  Each entry is a JSON file named
+    after its key.  The total size of the directory is kept under
+    max_bytes by removing the least recently used entries; the
+    modification time of an entry is bumped every time it is read.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        Returns the stored value, or None if the key is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as fileObj:
+                value = json.load(fileObj)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value, evict=True):
+        """
+        Stores value under key.  Unless evict is False, the least recently
+        used entries are then removed if the cache has grown too large
+        (see evict()).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to a temporary file and rename it so that concurrent
+        # readers never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fileObj:
+                json.dump(value, fileObj)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if evict:
+            self.evict()
+
+    def evict(self, keep=()):
+        """
+        Removes the least recently used entries until the cache fits in
+        max_bytes.  The entries for the keys in keep are never removed,
+        even if that leaves the cache larger than max_bytes.
+        """
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if name[:-len(".json")] not in keep:
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -38,4 +38,12 @@ class natureOfChange(Enum):
 class precheckStatus(Enum):
     CAN_APPLY = 1
     ALREADY_APPLIED = -1
-    NO_MATCH_FOUND = 0
\ No newline at end of file
+    NO_MATCH_FOUND = 0
+
+
+class applyStatus(Enum):
+    APPLIED = 1
+    DOES_NOT_APPLY = 0
+    FILE_NOT_FOUND = -1
+    ALREADY_EXISTS = -2
+    NOT_TRIED = -3
@@ -0,0 +1,25 @@
+import subprocess
+
+import scripts.trace as trace
+
+
+def run(args, cwd):
+    """
+    Runs git with args in cwd and returns what it wrote to stdout (bytes),
+    or None if git couldn't be started or failed.
+    """
+    try:
+        with trace.span("git " + args[0], "process"):
+            result = subprocess.run(["git"] + args, cwd=cwd, capture_output=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def split(output):
+    """
+    Splits the output of a git command run with -z into its fields.
+    """
+    return [name.decode("utf-8", "surrogateescape") for name in output.split(b"\0") if name]
@@ -0,0 +1,188 @@
+import os
+import difflib
+
+import scripts.source_file as source_file
+from scripts.patch_apply.edit_buffer import EditBuffer
+
+
+class Overlay:
+    """
+    An in-memory layer over the working tree.  Everything that reads or
+    changes source files while a patch is examined goes through the
+    overlay, so the changes made by the hunks of a patch can be seen by
+    the hunks after them without anything being written to disk.
+
+    Files are copied into the overlay (as an EditBuffer) the first time
+    they are changed.  commit() writes every change out at once and
+    rollback() throws them away without touching the disk.
+    """
+
+    def __init__(self):
+        # Changed files, by absolute path.
+        self.buffers = {}
+        # Files removed in the overlay that still exist on disk.
+        self.removed = set()
+        # Files commit() wrote or removed, by absolute path, until the
+        # caller clears it.
+        self.written = set()
+
+    def _key(self, path):
+        return os.path.abspath(path)
+
+    def exists(self, path):
+        path = self._key(path)
+        if path in self.removed:
+            return False
+        return path in self.buffers or os.path.exists(path)
+
+    def isfile(self, path):
+        path = self._key(path)
+        if path in self.removed:
+            return False
+        return path in self.buffers or os.path.isfile(path)
+
+    def isModified(self, path):
+        path = self._key(path)
+        return path in self.buffers or path in self.removed
+
+    def modified(self):
+        """
+        Returns the paths of the changed files, in the order they were
+        first changed.
+        """
+        return list(self.buffers.keys()) + sorted(self.removed)
+
+    def read(self, path):
+        """
+        Returns the SourceFile for path as it is in the overlay.
+        """
+        path = self._key(path)
+        if path in self.removed:
+            raise FileNotFoundError(path)
+        if path in self.buffers:
+            return self.buffers[path].current
+        return source_file.get(path)
+
+    def edit(self, path):
+        """
+        Returns the EditBuffer used to change path, copying the file into
+        the overlay if this is the first change to it.
+        """
+        path = self._key(path)
+        if path in self.removed:
+            raise FileNotFoundError(path)
+        if path not in self.buffers:
+            self.buffers[path] = EditBuffer(source_file.get(path))
+        return self.buffers[path]
+
+    def create(self, path, lines):
+        """
+        Creates path with the given lines.
+        """
+        path = self._key(path)
+        self.removed.discard(path)
+        buffer = EditBuffer(source_file.SourceFile(path, []))
+        buffer.created = True
+        buffer.replace(0, 0, lines)
+        self.buffers[path] = buffer
+
+    def remove(self, path):
+        path = self._key(path)
+        buffer = self.buffers.pop(path, None)
+        if buffer is None or not buffer.created:
+            self.removed.add(path)
+
+    def diff(self):
+        """
+        Returns a unified diff of the changes in the overlay.
+        """
+        output = []
+        for path in self.modified():
+            old_path = new_path = os.path.relpath(path)
+            if path in self.removed:
+                old = source_file.get(path).lines
+                new = []
+                new_path = "/dev/null"
+            else:
+                buffer = self.buffers[path]
+                old = [] if buffer.created else source_file.get(path).lines
+                new = buffer.lines()
+                if buffer.created:
+                    old_path = "/dev/null"
+            output.extend(
+                difflib.unified_diff(
+                    old, new,
+                    fromfile=old_path if old_path == "/dev/null" else "a/" + old_path,
+                    tofile=new_path if new_path == "/dev/null" else "b/" + new_path,
+                )
+            )
+        return "".join(output)
+
+    def commit(self, path=None):
+        """
+        Writes the changes in the overlay (or only the changes to path) to
+        disk.
+        """
+        if path is not None:
+            paths = [self._key(path)]
+        else:
+            paths = self.modified()
+
+        for path in paths:
+            if path in self.removed:
+                os.remove(path)
+                source_file.invalidate(path)
+                self.removed.discard(path)
+                self.written.add(path)
+            elif path in self.buffers:
+                self.buffers.pop(path).write()
+                self.written.add(path)
+
+    def rollback(self, path=None):
+        """
+        Throws away the changes in the overlay (or only the changes to
+        path).
+        """
+        if path is None:
+            self.buffers.clear()
+            self.removed.clear()
+        else:
+            path = self._key(path)
+            self.buffers.pop(path, None)
+            self.removed.discard(path)
+
+
+# The overlay used by the run.
+_current = Overlay()
+
+
+def current():
+    return _current
+
+
+def exists(path):
+    return _current.exists(path)
+
+
+def isfile(path):
+    return _current.isfile(path)
+
+
+def isModified(path):
+    return _current.isModified(path)
+
+
+def read(path):
+    return _current.read(path)
+
+
+def edit(path):
+    return _current.edit(path)
+
+
+def commit(path=None):
+    _current.commit(path)
+
+
+def rollback(path=None):
+    _current.rollback(path)
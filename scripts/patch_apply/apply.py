@@ -4,45 +4,32 @@ import argparse
 import sys
 import os
 import copy
+import contextlib
 import time
 import re
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
 import scripts.patch_apply.patchParser as parse
-
-# import check_file_exists_elsewhere as fileCheck
-import scripts.patch_match.test_match as tm
-import scripts.patch_context.context_changes as cc
-import scripts.patch_apply.check_file_exists_elsewhere as check_exist
-from scripts.enums import MatchStatus, natureOfChange, CONTEXT_DECISION, precheckStatus
+from scripts.patch_apply.patchParser import findGitPrefix
+
+# Most patches apply as they are, so the modules that are only needed to
+# work out what to do with a patch that doesn't (context_changes and
+# test_match with pygments, diff_match_patch and Levenshtein, the slicer,
+# check_file_exists_elsewhere and parallel) are imported where they are
+# used instead of here.
+import scripts.patch_apply.file_index as file_index
+import scripts.patch_apply.content_index as content_index
+import scripts.patch_apply.report as report_module
+import scripts.source_file as source_file
+import scripts.overlay as overlay
+import scripts.trace as trace
+from scripts.enums import MatchStatus, natureOfChange, CONTEXT_DECISION, precheckStatus, applyStatus
 
 def indent(text, amount, ch = ' '):
     padding = amount * ch
     return ''.join(padding + line for line in text.splitlines(True))
 
-def findGitPrefix(path):
-    prefix=''
-    resolved=False
-
-    while True:
-        if path == os.path.dirname(path) and not resolved:
-            path = os.path.realpath(path)
-            resolved = True
-
-        if os.path.isdir(path):
-            if os.path.isdir(os.path.join(path, ".git")):
-                if os.path.isfile(os.path.join(path, ".git", "config")):
-                    return prefix
-
-        if path == os.path.dirname(path):
-            break
-
-        if resolved:
-            prefix=os.path.join(prefix, os.path.basename(path))
-        path=os.path.dirname(path)
-    return ''
-
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -65,6 +52,56 @@ def get_args():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Number of worker processes.  Subpatches that don't apply with git apply are analysed in parallel, and when given a directory of patches (with --dry-run) the patches are examined in parallel, each worker in its own git worktree.  Outside of a git repository the workers share the current directory, and the patches aren't kept apart.",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--batch",
+        help="Don't ask any questions.  Subpatches are applied (auto-apply) or not (never-apply, report-only, which also implies --dry-run) without asking, and a JSON record for every subpatch is written to stdout, one per line.  Everything else is written to stderr.",
+        choices=report_module.POLICIES,
+    )
+
+    parser.add_argument(
+        "--git-apply",
+        help="Always run git apply, instead of first trying to apply the patch without it.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--cross-check",
+        help="Also run git apply --check when a patch is applied without git apply, and go with git apply if they disagree.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--show-diff",
+        help="Print the changes made to the subpatches that didn't apply with git apply.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="Write how long each stage took to this file, in the Chrome trace event format (see chrome://tracing or https://ui.perfetto.dev).",
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--stats",
+        help="Print how long each stage took in total to stderr once done.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--series",
+        help="The path is a series of patches: an mbox (as written by git format-patch --stdout) or a directory of git format-patch files.  The patches are applied one after the other, in the order of the series.",
+        action="store_true",
+    )
+
     parser.add_argument(
         "pathToPatch", help="Path to the patch that needs to be applied."
     )
@@ -106,6 +143,7 @@ def match_found_helper(
     fileName,
     successful_subpatches,
     context_decision_msg,
+    report=None,
 ):
     added_line_count = 0
     removed_line_count = 0
@@ -144,6 +182,9 @@ def match_found_helper(
         and len(diff_obj.additional_lines) == 0
     ):
         already_applied_subpatches.append(subpatch_name)
+        if report is not None:
+            report.matched(subpatch_name, fileName, "already_applied", percentages,
+                           diff_obj.match_start_line, context_decision_msg)
 
     # No lines between the context lines other than parts of the patch (currently only case where we can apply patches)
     elif len(diff_obj.additional_lines) == 0:
@@ -154,8 +195,13 @@ def match_found_helper(
                     percentages,
                     subpatch_name,
                     diff_obj.match_start_line,
+                    context_decision_msg,
+                    patch
                 )
             )
+            if report is not None:
+                report.matched(subpatch_name, fileName, "matched_not_applied", percentages,
+                               diff_obj.match_start_line, context_decision_msg)
 
         # We try to apply the patch, context changes are not important
         # The case below is only for cases where the context is the only thing that is changed or a line has been completely added or removed with no similar lines
@@ -210,6 +256,11 @@ def match_found_helper(
             patch._lines = new_patch_lines
             if patch.canApply(fileName) == precheckStatus.CAN_APPLY: # TODO: is it safe here?
                 successful_subpatches.append([patch, subpatch_name])
+                if report is not None:
+                    # The record is written once it is known whether the
+                    # subpatch was applied.
+                    report.matched(subpatch_name, fileName, None, percentages,
+                                   diff_obj.match_start_line, context_decision_msg)
             else:
                 # print("Issue with current assumption in terms of what patches can be applied")
                 failed_subpatches_with_matched_code.append(
@@ -221,6 +272,9 @@ def match_found_helper(
                         patch
                     )
                 )
+                if report is not None:
+                    report.matched(subpatch_name, fileName, "matched_not_applied", percentages,
+                                   diff_obj.match_start_line, context_decision_msg)
 
     else:
         failed_subpatches_with_matched_code.append(
@@ -232,13 +286,70 @@ def match_found_helper(
                 patch,
             )
         )
+        if report is not None:
+            report.matched(subpatch_name, fileName, "matched_not_applied", percentages,
+                           diff_obj.match_start_line, context_decision_msg)
+
+
+def analyse_hunks(hunks, slices=None):
+    """
+    Works out what to do with each of the (patch, fileName) pairs in
+    hunks, none of which applied with git apply.  Nothing is changed on
+    disk or in the overlay, so hunks can be analysed in any order or in
+    parallel (see parallel.analyse_all).
+
+    Generator that yields (patch, status, context_change_obj) in the
+    same order as hunks, as soon as each hunk has been analysed.  status
+    is the precheckStatus returned by canApply, and context_change_obj is
+    None unless the patch can't be applied as is.  The patch is returned
+    since canApply may change its lines.
+    """
+    import scripts.patch_context.context_changes as cc
+
+    for patch, fileName in hunks:
+        with trace.span("hunk", hunk=":".join([fileName, str(patch._oldStart)])) as span:
+            # Try applying the subpatch as normal
+            status = patch.canApply(fileName)
+            context_change_obj = None
+            if status != precheckStatus.CAN_APPLY and status != precheckStatus.ALREADY_APPLIED:
+                context_change_obj = cc.context_changes(patch, slices=slices)
+            span.set(status=getattr(status, "name", status))
+        yield patch, status, context_change_obj
 
 
 def apply(pathToPatch, **kwargs):
+    # Files read while examining a previous patch may have been changed by
+    # git since.  In a series, only the files of the patch before can have
+    # been (see apply_series()).
+    if kwargs.get('series_files') is None:
+        source_file.clear()
+    else:
+        for fileName in kwargs['series_files']:
+            source_file.invalidate(fileName)
+    file_index.invalidate()
+    content_index.invalidate()
+    overlay.rollback()
+
+    # In batch mode nothing is asked, and what happens to every hunk is
+    # written to kwargs['records'] as it is decided.
+    batch = kwargs.get('batch')
+    report = report_module.Report(kwargs.get('records'), kwargs.get('patch_name') or pathToPatch)
+    if batch == report_module.REPORT_ONLY:
+        kwargs['dry_run'] = True
+
     patch_file = parse.PatchFile(pathToPatch)
-    patch_file.runPatch(reverse=kwargs['reverse'], dry_run=kwargs['dry_run'])
+    patch_file.runPatch(
+        reverse=kwargs['reverse'],
+        dry_run=kwargs['dry_run'],
+        fast=not kwargs.get('git_apply', False),
+        cross_check=kwargs.get('cross_check', False),
+    )
     if patch_file.runSuccess == True:
         print("Successfully applied")
+        if report.stream is not None:
+            for patch in patch_file.iterPatches():
+                fileName = patch.getFileName()
+                report.hunk(":".join([fileName, str(patch._oldStart)]), fileName, "applied_by_git_apply")
         return 0
     else:                                                                                       # Git apply failed to apply
         error_message = patch_file.runResult
@@ -253,33 +364,59 @@ def apply(pathToPatch, **kwargs):
         file_not_found = set()
         does_not_apply = set()
 
-        for line in error_message_lines:
-            split_line = [s.strip() for s in line.split(":")]
-            if line[0:2] == "  ":
-                pass
-            elif split_line[0] == "error":
-                if split_line[1].startswith("corrupt patch"):
-                    line_num = re.findall(r'\d+', split_line[1])
-                    print("The patch is corrupted at line %s." % line_num[0])
-                    return 1
-                elif split_line[1].startswith("git diff header lacks filename information"):
-                    print("The patch is corrupted at line %s." % line_num[0])
-                    return 1
-                elif split_line[1].startswith("cannot apply binary patch"):
-                    print("Binary patch detected.")
-                    return 1
-                elif split_line[2] == "patch does not apply":
-                    does_not_apply.add(split_line[1])
-                elif split_line[2] == "already exists":
-                    already_exists.add(split_line[1])
-                elif split_line[2] == "No such file or directory":
-                    file_not_found.add(split_line[1])
-                elif split_line[2] == 'skipped':
-                    # GIT does not translate the file name in this case.
-                    filename = os.path.join( findGitPrefix(split_line[1]), split_line[1] )
-                    does_not_apply.add(filename)
-
-        patch_file.getPatch()
+        if patch_file.outcome is not None:
+            # The patch was run without git apply, so there is no need to
+            # pick its output apart.
+            statuses = {
+                applyStatus.DOES_NOT_APPLY: does_not_apply,
+                applyStatus.FILE_NOT_FOUND: file_not_found,
+                applyStatus.ALREADY_EXISTS: already_exists,
+            }
+            for file in patch_file.outcome.files:
+                if file.status in statuses:
+                    statuses[file.status].add(
+                        os.path.join( findGitPrefix(file.fileName), file.fileName )
+                    )
+        else:
+            for line in error_message_lines:
+                split_line = [s.strip() for s in line.split(":")]
+                if line[0:2] == "  ":
+                    pass
+                elif split_line[0] == "error":
+                    if split_line[1].startswith("corrupt patch"):
+                        line_num = re.findall(r'\d+', split_line[1])
+                        print("The patch is corrupted at line %s." % line_num[0])
+                        report.patch("corrupt_patch", line=int(line_num[0]))
+                        return 1
+                    elif split_line[1].startswith("git diff header lacks filename information"):
+                        print("The patch is corrupted at line %s." % line_num[0])
+                        return 1
+                    elif split_line[1].startswith("cannot apply binary patch"):
+                        print("Binary patch detected.")
+                        report.patch("binary_patch")
+                        return 1
+                    elif split_line[2] == "patch does not apply":
+                        does_not_apply.add(split_line[1])
+                    elif split_line[2] == "already exists":
+                        already_exists.add(split_line[1])
+                    elif split_line[2] == "No such file or directory":
+                        file_not_found.add(split_line[1])
+                    elif split_line[2] == 'skipped':
+                        # GIT does not translate the file name in this case.
+                        filename = os.path.join( findGitPrefix(split_line[1]), split_line[1] )
+                        does_not_apply.add(filename)
+
+        # Only the hunks of the files git couldn't apply are parsed; for the
+        # others the hunk headers are enough to report them.
+        def failed(fileName):
+            gitFileName = os.path.join( findGitPrefix(fileName), fileName )
+            return gitFileName in does_not_apply or gitFileName in file_not_found
+
+        patches = patch_file.hunksFor(failed)
+
+        import scripts.patch_context.slice_and_parse as slicer
+        import scripts.patch_apply.check_file_exists_elsewhere as check_exist
+        import scripts.patch_apply.parallel as parallel
 
         # TODO: Handle file that already exists
 
@@ -293,17 +430,40 @@ def apply(pathToPatch, **kwargs):
         no_match_patches = []
         applied_by_git_apply = []
         # not_tried_subpatches = []
-        if not kwargs['dry_run']:
+        if not kwargs['dry_run'] and not batch:
             see_patches = input(
                 "We have found {} subpatches in the patch file. Would you like to see them? [Y/n] ".format(
-                    len(patch_file.patches)
+                    len(patches)
                 )
             )
             see_patches = see_patches.upper() == "Y"
+            if see_patches:
+                patches = patch_file.hunksFor(lambda fileName: True)
         else:
             see_patches = False
 
-        for patch in patch_file.patches:
+        # Every file that fails to apply may need to be sliced, so queue
+        # them up to be converted by srcml together.
+        slices = slicer.SliceBatch()
+        for patch in patches:
+            fileName = patch.getFileName()
+            if patch_file.hunkStatus.get(patch) == applyStatus.APPLIED:
+                continue
+            if os.path.join( findGitPrefix(fileName), fileName ) in does_not_apply:
+                slices.add( os.path.join( os.getcwd(), fileName ) )
+
+        # The subpatches that need to be examined, as (patch, fileName,
+        # subpatch_name).  They are analysed together once the ones that
+        # need the user have been dealt with.  Hunks that git (or
+        # fast_apply) found apply cleanly on their own don't need to be
+        # analysed.
+        to_analyse = []
+        clean = set()
+        # Where the files that weren't found were found instead, by the
+        # name git gave them.
+        moved = {}
+
+        for patch in patches:
             fileName = patch.getFileName()
 
             # GIT has the behaviour where it prepends elements to the
@@ -320,13 +480,29 @@ def apply(pathToPatch, **kwargs):
 
             subpatch_name = ":".join([fileName, str(patch._oldStart)])
 
-            if gitFileName in file_not_found:
-                correct_loc = check_exist.checkFileExistsElsewhere(patch)
+            if gitFileName in file_not_found or gitFileName in moved:
+                # The file is only looked for once, for its first hunk.
+                correct_loc = moved.get(gitFileName)
+                candidates = []
+                if correct_loc is None:
+                    interactive = not batch and sys.stdout.isatty()
+                    correct_loc = check_exist.checkFileExistsElsewhere(
+                        patch, interactive=interactive
+                    )
+                    if not interactive:
+                        # Only listed, for the user to pick from.
+                        candidates, correct_loc = correct_loc, None
                 if correct_loc != None:
+                    report.hunk(subpatch_name, fileName, "file_moved", moved_to=correct_loc)
                     does_not_apply.add(correct_loc)
-                    file_not_found.remove(fileName)
+                    moved[gitFileName] = correct_loc
+                    file_not_found.discard(gitFileName)
                     fileName = correct_loc
-                    patch._fileName = "/" + correct_loc
+                    patch._fileName = correct_loc
+                    subpatch_name = ":".join([fileName, str(patch._oldStart)])
+                    to_analyse.append((patch, fileName, subpatch_name))
+                else:
+                    report.hunk(subpatch_name, fileName, "file_not_found", candidates=candidates)
             elif gitFileName in does_not_apply:
                 # [1:] is used to remove the leading slash
 
@@ -341,37 +517,57 @@ def apply(pathToPatch, **kwargs):
                 #     not_tried_subpatches.append(subpatch_name)
                 #     continue
 
-                # Try applying the subpatch as normal
-                subpatch_run_status = patch.canApply(fileName)
-                
-                if subpatch_run_status == precheckStatus.CAN_APPLY:
-                    successful_subpatches.append([patch, subpatch_name])
-                elif subpatch_run_status == precheckStatus.ALREADY_APPLIED:
-                    already_applied_subpatches.append(subpatch_name)
-                else:
-                    context_change_obj = cc.context_changes(patch)
-                    diff_obj = context_change_obj.diff_obj
-                    context_decision = context_change_obj.status
-                    context_decision_msg = context_change_obj.messages
-
-                    if diff_obj and diff_obj.match_status == MatchStatus.MATCH_FOUND:
-                        match_found_helper(
-                            patch,
-                            diff_obj,
-                            already_applied_subpatches,
-                            failed_subpatches_with_matched_code,
-                            subpatch_name,
-                            context_decision,
-                            fileName,
-                            successful_subpatches,
-                            context_decision_msg,
-                        )
-
-                    else:
-                        subpatches_without_matched_code.append(subpatch_name)
-                        no_match_patches.append(patch)
+                to_analyse.append((patch, fileName, subpatch_name))
+                if patch_file.hunkStatus.get(patch) == applyStatus.APPLIED:
+                    clean.add(patch)
             elif gitFileName not in already_exists:
                 applied_by_git_apply.append(subpatch_name)
+                report.hunk(subpatch_name, fileName, "applied_by_git_apply")
+            else:
+                report.hunk(subpatch_name, fileName, "already_exists")
+
+        hunks = [(patch, fileName) for patch, fileName, _ in to_analyse if patch not in clean]
+        if kwargs.get('jobs', 1) > 1 and len(hunks) > 1:
+            analysed = parallel.analyse_all(hunks, kwargs['jobs'])
+        else:
+            analysed = analyse_hunks(hunks, slices)
+
+        for patch, fileName, subpatch_name in to_analyse:
+            if patch in clean:
+                subpatch_run_status = precheckStatus.CAN_APPLY
+                context_change_obj = None
+            else:
+                patch, subpatch_run_status, context_change_obj = next(analysed)
+
+            if subpatch_run_status == precheckStatus.CAN_APPLY:
+                successful_subpatches.append([patch, subpatch_name])
+            elif subpatch_run_status == precheckStatus.ALREADY_APPLIED:
+                already_applied_subpatches.append(subpatch_name)
+                report.hunk(subpatch_name, fileName, "already_applied")
+            else:
+                diff_obj = context_change_obj.diff_obj
+                context_decision = context_change_obj.status
+                context_decision_msg = context_change_obj.messages
+
+                if diff_obj and diff_obj.match_status == MatchStatus.MATCH_FOUND:
+                    match_found_helper(
+                        patch,
+                        diff_obj,
+                        already_applied_subpatches,
+                        failed_subpatches_with_matched_code,
+                        subpatch_name,
+                        context_decision,
+                        fileName,
+                        successful_subpatches,
+                        context_decision_msg,
+                        report,
+                    )
+
+                else:
+                    subpatches_without_matched_code.append(subpatch_name)
+                    no_match_patches.append(patch)
+                    report.hunk(subpatch_name, fileName, "no_match",
+                                context_message=context_decision_msg)
 
         if len(successful_subpatches) > 0:
             print( "-" * 70 )
@@ -380,7 +576,9 @@ def apply(pathToPatch, **kwargs):
                     len(successful_subpatches)
                 )
             )
-            if not kwargs['dry_run']:
+            if batch:
+                start_apply = batch != report_module.NEVER_APPLY
+            elif not kwargs['dry_run']:
                 start_apply = input(
                     "Would you like to see these patches and try applying them? [Y/n] "
                 )
@@ -388,6 +586,10 @@ def apply(pathToPatch, **kwargs):
             else:
                 start_apply = True
 
+            if not start_apply:
+                for patch in successful_subpatches:
+                    report.hunk(patch[1], patch[0].getFileName(), "not_applied")
+
             if start_apply:
                 for patch in successful_subpatches:
                     if kwargs['verbose'] >= 1:
@@ -395,7 +597,7 @@ def apply(pathToPatch, **kwargs):
                         print(patch[1])
                         print(patch[0])
 
-                    if not kwargs['dry_run']:
+                    if not kwargs['dry_run'] and not batch:
                         apply_subpatch_input = input(
                             "The above subpatch can be applied successfully. Would you like to apply? [Y/n] "
                         )
@@ -407,14 +609,28 @@ def apply(pathToPatch, **kwargs):
                     if apply_subpatch_input:
                         fileName = patch[0]._fileName
                         patchObj = patch[0]
-                        success = patchObj.Apply(fileName, dry_run=kwargs['dry_run'])
+                        success = patchObj.Apply(fileName, dry_run=kwargs['dry_run'], buffered=True)
                     if success:
                         if kwargs['dry_run']:
                             print( "%s would have been successfully applied (dry run)." % patch[1] )
+                            report.hunk(patch[1], patch[0].getFileName(), "would_apply")
                         else:
                             print( "%s successfully applied!" % patch[1] )
+                            report.hunk(patch[1], patch[0].getFileName(), "applied")
                     else:
                         print("%s Ignored" % patch[1] )
+                        report.hunk(patch[1], patch[0].getFileName(),
+                                    "apply_failed" if apply_subpatch_input else "not_applied")
+
+                if kwargs.get('show_diff'):
+                    print(overlay.current().diff(), end="")
+
+                # Every file is written once, with all of its hunks, or
+                # not at all on a dry run.
+                if kwargs['dry_run']:
+                    overlay.rollback()
+                else:
+                    overlay.commit()
 
         if len(failed_subpatches_with_matched_code) > 0:
             # failed_subpatches_with_matched_code.sort()
@@ -472,26 +688,111 @@ def apply(pathToPatch, **kwargs):
         return 1
 
 
+def apply_series( **kwargs ):
+    """
+    Applies the patches of the series at kwargs['pathToPatch'] (see
+    series.iter_series()) one after the other, in order, so each patch is
+    examined with the ones before it applied (unless it's a dry run).
+    Everything read for a patch is kept for the next one, except for the
+    files the patch changed: the ones named in its headers, and the ones
+    written to in their place (a file found elsewhere, see
+    checkFileExistsElsewhere()).
+    """
+    import scripts.patch_apply.series as series
+
+    arguments = copy.copy(kwargs)
+    arguments['series_files'] = None
+    for message in series.iter_series(kwargs['pathToPatch']):
+        arguments['pathToPatch'] = message.path
+        arguments['patch_name'] = message.name
+        print( "=" * 70 )
+        print( "Examining patch %d: %s\n" % (message.number, message.subject) )
+        overlay.current().written.clear()
+        with trace.span("patch", path=message.name):
+            apply( **arguments )
+        print( "\n" )
+
+        try:
+            arguments['series_files'] = (series.changed_files(message.path)
+                                         | set(overlay.current().written))
+        except (AssertionError, AttributeError, IndexError, ValueError):
+            arguments['series_files'] = None
+
+
 def main( **kwargs ):
+    if (kwargs.get('trace') or kwargs.get('stats')) and trace.current() is None:
+        tracer = trace.enable()
+        try:
+            return main( **kwargs )
+        finally:
+            trace.disable()
+            if kwargs.get('trace'):
+                tracer.write(kwargs['trace'])
+            if kwargs.get('stats'):
+                sys.stderr.write(tracer.format_stats())
+
+    if kwargs.get('batch') and kwargs.get('records') is None:
+        if kwargs['batch'] == report_module.REPORT_ONLY:
+            kwargs['dry_run'] = True
+
+        # The records are the only thing written to stdout.
+        records = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            return main( **dict(kwargs, records=records) )
+
     # If it's a directory full of patches, we are going to run through each file in the directory.
     if not os.path.exists(kwargs['pathToPatch']):
         print( "Invalid path or filename: %s" % kwargs['pathToPatch'] )
         return 1
 
+    if kwargs.get('series'):
+        return apply_series( **kwargs )
+
     if os.path.isdir(kwargs['pathToPatch']):
-        arguments = copy.copy(kwargs)
-        for file in os.listdir(kwargs['pathToPatch']):
+        patches = []
+        for file in sorted(os.listdir(kwargs['pathToPatch'])):
             filename = os.fsdecode(file)
             if filename.endswith("~"):
                 continue
+            patches.append(os.path.join(kwargs['pathToPatch'], filename))
 
-            arguments['pathToPatch']=os.path.join(kwargs['pathToPatch'], filename)
+        jobs = kwargs.get('jobs', 1)
+        if jobs > 1:
+            if not kwargs['dry_run']:
+                print( "--jobs can only be used with --dry-run" )
+                return 1
+
+            import scripts.patch_apply.parallel as parallel
+
+            # Each worker examines its patches in its own worktree, and the
+            # output is printed in the same order as without --jobs.
+            arguments = copy.copy(kwargs)
+            del arguments['pathToPatch']
+            arguments.pop('records', None)
+            outputs = parallel.examine_all(
+                [os.path.abspath(p) for p in patches], jobs, arguments
+            )
+            for pathToPatch, (output, records) in zip(patches, outputs):
+                print( "=" * 70 )
+                print( "Examining patch: %s\n" % pathToPatch )
+                print( output, end="" )
+                print( "\n" )
+                if kwargs.get('records') is not None:
+                    kwargs['records'].write(records)
+                    kwargs['records'].flush()
+            return
+
+        arguments = copy.copy(kwargs)
+        for pathToPatch in patches:
+            arguments['pathToPatch']=pathToPatch
             print( "=" * 70 )
             print( "Examining patch: %s\n" % arguments['pathToPatch'] )
-            apply( **arguments )
+            with trace.span("patch", path=pathToPatch):
+                apply( **arguments )
             print( "\n" )
     elif os.path.isfile:
-        apply( **kwargs )
+        with trace.span("patch", path=kwargs['pathToPatch']):
+            apply( **kwargs )
     else:
         print( "Not a regular file: %s" % args.pathToPatch )
         return 1
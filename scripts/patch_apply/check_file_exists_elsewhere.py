@@ -3,38 +3,61 @@ import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 import scripts.patch_apply.patchParser as parse
+import scripts.patch_apply.file_index as file_index
+import scripts.patch_apply.content_index as content_index
+import scripts.trace as trace
 from scripts.enums import SliceFields
 
 
-def checkFileExistsElsewhere(patch):
+@trace.traced("checkFileExistsElsewhere")
+def checkFileExistsElsewhere(patch, interactive=None):
     """
     A small percentage of patches fail because the file has changed locations within the repo.
     If the file were in its original location, the patch would have applied without issues.
     
-    To try to avoid this error, this method goes through all the directories
-    from current dirrectory and checks to see if this file exists.
+    To try to avoid this error, this method looks up the file name in the
+    index of the files in the repository (see file_index) and lists the
+    files with the same name below the current directory, the ones whose
+    path looks most like the original path first.  If no file has the same
+    name, the file may have been renamed as well, and the files holding
+    the lines the hunk expects to find are looked up in the index of the
+    contents of the files (see content_index) instead, the files with
+    the same extension as the missing one first.  Patches are never
+    suggested.
 
     If it does, it warns the user that the file has moved.
     NOTE: This method assumes the patch has failed and we are looking for solutions
+
+    The user is only asked which of the files to use if interactive is
+    True, which by default it is when stdout is a terminal, and the file
+    picked (or None) is returned.  Otherwise the files are listed, and
+    returned as a list for the caller to report.
     """
 
     toFind = patch.getFileName().split("/")[-1]
-    currentdir = os.getcwd()
-    matched_file_locations = []
-    for subdir, dirs, files in os.walk(currentdir):
-        for file in files:
-            if file == toFind:
-                matched_file_locations.append(
-                    os.path.relpath(os.path.join(subdir, file))
-                )
-
+    matched_file_locations = file_index.get().find(patch.getFileName())
+    description = "with the same filename as"
     if len(matched_file_locations) == 0:
+        matched_file_locations = [
+            location for location, containment in
+            content_index.get().search(
+                content_index.preimage(patch), extension=os.path.splitext(toFind)[1]
+            )
+        ]
+        description = "with contents like"
+
+    if interactive is None:
+        interactive = sys.stdout.isatty()
+
+    if not interactive and len(matched_file_locations) == 0:
+        return []
+    elif len(matched_file_locations) == 0:
         return None
-    elif sys.stdout.isatty():
+    elif interactive:
         print("-" * 70)
         print(
-            "Here are the locations of files with the same filename as the following missing file: {}".format(
-                toFind
+            "Here are the locations of files {} the following missing file: {}".format(
+                description, toFind
             )
         )
         for i in range(len(matched_file_locations)):
@@ -57,6 +80,7 @@ def checkFileExistsElsewhere(patch):
         print(f"Possible files to apply the patch for {toFind} to:")
         for i in matched_file_locations:
             print(f"  {i}")
+        return matched_file_locations
 
 # Testing
 # patch_file = parse.PatchFile("../vulnerableforks/patches/CVE-2014-8172.patch")
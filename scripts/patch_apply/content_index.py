@@ -0,0 +1,359 @@
+import os
+import re
+import zlib
+import random
+import hashlib
+
+import scripts.git as git
+import scripts.trace as trace
+from scripts.cache import DiskCache, cache_dir
+from scripts.enums import natureOfChange
+
+
+CONTENT_INDEX_MAX_BYTES = 256 * 1024 * 1024
+# Files larger than this, and files with NUL bytes in them, aren't indexed.
+MAX_FILE_BYTES = 1024 * 1024
+# Patches (and what is left behind applying them) hold the lines of the
+# files they change, so they would be found in place of the files.
+PATCH_EXTENSIONS = (".patch", ".diff", ".rej", ".orig")
+
+# Each file is cut into windows of WINDOW lines, starting every STRIDE
+# lines, about the size of the lines a hunk expects to find.  A window is
+# summarised by BANDS * ROWS MinHash values, and every group of ROWS of
+# them (a band) is a key the window is found under.  Two windows that
+# have about half their lines in common share a key more often than not.
+WINDOW = 8
+STRIDE = 4
+BANDS = 6
+ROWS = 2
+
+# Candidates are checked against the file itself, and only kept if at
+# least this much of the lines looked for are in the file.
+MIN_CONTAINMENT = 0.5
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(0)
+_PERMUTATIONS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+    for i in range(BANDS * ROWS)
+]
+
+
+def normalise(line):
+    """
+    Returns the line with all of its white space removed, or None if it
+    is too short to say anything about which file it is from (a lone
+    brace, a blank line, ...).
+    """
+    line = "".join(line.split())
+    if len(re.sub(r"\W", "", line)) < 3:
+        return None
+    return line
+
+
+def _hash(line):
+    return zlib.crc32(line.encode("utf-8", "surrogateescape"))
+
+
+def _keys(hashes):
+    """
+    Returns the LSH keys of one window, given the hashes of its lines.
+    """
+    signature = [
+        min((a * value + b) % _PRIME for value in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+    return [
+        zlib.crc32(repr((band, signature[band * ROWS:(band + 1) * ROWS])).encode())
+        for band in range(BANDS)
+    ]
+
+
+def keys(lines):
+    """
+    Returns the set of LSH keys of the windows of lines.
+    """
+    hashes = [_hash(line) for line in lines]
+    if not hashes:
+        return set()
+
+    found = set()
+    for start in range(0, max(len(hashes) - WINDOW, 0) + 1, STRIDE):
+        found.update(_keys(set(hashes[start:start + WINDOW])))
+    # The last lines, if the windows stopped short of them.
+    if len(hashes) > WINDOW and (len(hashes) - WINDOW) % STRIDE:
+        found.update(_keys(set(hashes[-WINDOW:])))
+    return found
+
+
+def preimage(patch):
+    """
+    The lines a hunk expects to find in the file (its context and
+    removed lines), normalised.
+    """
+    lines = []
+    for kind, text in patch.getLines()[1:]:
+        if kind != natureOfChange.ADDED:
+            line = normalise(text)
+            if line is not None:
+                lines.append(line)
+    return lines
+
+
+def _read(path):
+    """
+    Returns the normalised lines of the file, or None if it isn't a text
+    file worth indexing.
+    """
+    try:
+        if os.path.getsize(path) > MAX_FILE_BYTES:
+            return None
+        with open(path, "rb") as fileObj:
+            data = fileObj.read()
+    except OSError:
+        return None
+    trace.count("bytes read", len(data))
+    if b"\0" in data:
+        return None
+
+    lines = []
+    for line in data.decode("utf-8", "surrogateescape").splitlines():
+        line = normalise(line)
+        if line is not None:
+            lines.append(line)
+    return lines
+
+
+class ContentIndex:
+    """
+    A locality-sensitive hashing (MinHash) index of the contents of the
+    files in the repository, for finding the file a hunk was meant for
+    when the file has been moved and renamed.
+
+    Every file is known by a stamp: the blob id git has for it, or the
+    size and modification time of files that differ from what git has
+    (and of every file outside of a git repository).  The keys of the
+    files are stored on disk a directory at a time (a shard), under a key
+    made from the names and stamps of the files in the directory, so a
+    directory is the same shard in every clone of the repository.  Which
+    shard each directory had the last time is stored for the repository,
+    and only the files whose stamp changed since are read again when the
+    index is refreshed.
+    """
+
+    def __init__(self, root=None, cache=True):
+        if root is None:
+            root = os.getcwd()
+        toplevel = git.run(["rev-parse", "--show-toplevel"], root)
+        self.git = toplevel is not None
+        self.root = toplevel.decode().strip() if self.git else os.path.realpath(root)
+
+        if cache is True:
+            cache = DiskCache(cache_dir("content_index"), CONTENT_INDEX_MAX_BYTES)
+        self.cache = cache
+
+        # path: [stamp, keys], key: set of paths, and directory: the key of
+        # its shard, for the directories in the index and as they were
+        # stored the last time.
+        self.files = {}
+        self.buckets = {}
+        self.shards = {}
+        self.stored = {}
+        if self.cache is not None:
+            stored = self.cache.get(self._key())
+            # (The index used to be stored whole under the same key.)
+            if stored is not None and stored.get("root") == self.root and "shards" in stored:
+                self.stored = stored["shards"]
+        self.refresh()
+
+    def _key(self):
+        return hashlib.sha1(self.root.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def _shard_key(self, stamps):
+        """
+        Returns the key of the shard of a directory, given the stamp of
+        each file in it by name.
+        """
+        shard = repr((WINDOW, STRIDE, BANDS, ROWS, sorted(stamps.items())))
+        return hashlib.sha1(shard.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def _add(self, path, file_keys):
+        for key in file_keys:
+            self.buckets.setdefault(key, set()).add(path)
+
+    def _remove(self, path):
+        for key in self.files.pop(path)[1]:
+            paths = self.buckets.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self.buckets[key]
+
+    def _stamp(self, path):
+        try:
+            stat = os.stat(os.path.join(self.root, path))
+        except OSError:
+            return None
+        return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+
+    def _stamps(self):
+        """
+        Returns the stamp of every file there is now.
+        """
+        stamps = {}
+        if not self.git:
+            for directory, dirs, files in os.walk(self.root):
+                dirs[:] = [name for name in dirs if name != ".git"]
+                for name in files:
+                    path = os.path.relpath(os.path.join(directory, name), self.root)
+                    stamps[path] = self._stamp(path)
+            return stamps
+
+        staged = git.run(["ls-files", "--stage", "-z"], self.root)
+        for entry in git.split(staged or b""):
+            info, path = entry.split("\t", 1)
+            mode, blob, stage = info.split()
+            if mode.startswith("100"):
+                stamps[path] = blob
+
+        # Files that differ from the index, or that git doesn't know about.
+        status = git.run(
+            ["status", "--porcelain", "--no-renames", "--untracked-files=all", "-z"],
+            self.root,
+        )
+        for entry in git.split(status or b""):
+            path = entry[3:]
+            if os.path.isfile(os.path.join(self.root, path)):
+                stamps[path] = self._stamp(path)
+            else:
+                stamps.pop(path, None)
+        return stamps
+
+    def refresh(self):
+        """
+        Brings the index up to date with the files on disk.
+        """
+        stamps = self._stamps()
+        for path in list(self.files):
+            if stamps.get(path) != self.files[path][0]:
+                self._remove(path)
+
+        directories = {}
+        for path, stamp in stamps.items():
+            if stamp is not None:
+                directory, name = os.path.split(path)
+                directories.setdefault(directory, {})[name] = stamp
+
+        shards = {}
+        for directory, names in directories.items():
+            key = self._shard_key(names)
+            shards[directory] = key
+            if self.shards.get(directory) == key:
+                continue
+
+            shard = self.cache.get(key) if self.cache is not None else None
+            missing = shard is None
+            if missing:
+                # The files that haven't changed since the directory was
+                # last stored don't need to be read.
+                shard = {}
+                previous = self.stored.get(directory)
+                if previous is not None and self.cache is not None:
+                    shard = self.cache.get(previous) or {}
+
+            for name, stamp in names.items():
+                path = os.path.join(directory, name)
+                if path not in self.files:
+                    entry = shard.get(name)
+                    if entry is None or entry[0] != stamp:
+                        lines = None
+                        if not path.endswith(PATCH_EXTENSIONS):
+                            lines = _read(os.path.join(self.root, path))
+                        entry = [stamp, sorted(keys(lines)) if lines else []]
+                    self.files[path] = entry
+                    self._add(path, entry[1])
+
+            if missing and self.cache is not None:
+                shard = {name: self.files[os.path.join(directory, name)] for name in names}
+                self.cache.put(key, shard, evict=False)
+        self.shards = shards
+
+        if self.cache is not None and shards != self.stored:
+            self.stored = shards
+            self.cache.put(self._key(), {"root": self.root, "shards": shards}, evict=False)
+            # The shards in use are kept, however large the index is.
+            self.cache.evict(keep=set(shards.values()) | {self._key()})
+
+    def search(self, lines, limit=5, under=None, extension=None):
+        """
+        Returns up to limit (path, containment) pairs for the files most
+        likely to hold the normalised lines, best first.  containment is
+        how much of lines is in the file.  Paths are relative to the
+        current directory, and only files below under (by default the
+        current directory) are returned.  If extension is given (".c",
+        say), the files with that extension come before the others.
+        """
+        lines = [line for line in lines if line is not None]
+        if not lines:
+            return []
+
+        hits = {}
+        for key in keys(lines):
+            for path in self.buckets.get(key, ()):
+                hits[path] = hits.get(path, 0) + 1
+
+        cwd = os.path.realpath(os.getcwd())
+        if under is None:
+            under = cwd
+        under = os.path.relpath(os.path.realpath(under), self.root)
+        under = "" if under == "." else under + os.sep
+
+        # The files with the most keys in common are checked against the
+        # lines themselves.
+        def other(path):
+            return extension is not None and os.path.splitext(path)[1] != extension
+
+        candidates = sorted(
+            (path for path in hits
+             if path.startswith(under) and not path.endswith(PATCH_EXTENSIONS)),
+            key=lambda path: (other(path), -hits[path], path),
+        )
+        wanted = set(lines)
+        found = []
+        for path in candidates[:limit * 4]:
+            file_lines = _read(os.path.join(self.root, path))
+            if not file_lines:
+                continue
+            containment = len(wanted.intersection(file_lines)) / len(wanted)
+            if containment >= MIN_CONTAINMENT:
+                found.append((os.path.relpath(os.path.join(self.root, path), cwd), containment))
+
+        found.sort(key=lambda item: (other(item[0]), -item[1], item[0]))
+        return found[:limit]
+
+
+# The index of the repository the current directory is in; see
+# file_index for how it is kept up to date.
+_index = None
+_stale = False
+
+
+def get():
+    global _index, _stale
+    cwd = os.path.realpath(os.getcwd())
+    if _index is None or os.path.commonpath([cwd, _index.root]) != _index.root:
+        _index = ContentIndex()
+    elif _stale:
+        _index.refresh()
+    _stale = False
+    return _index
+
+
+def invalidate():
+    global _stale
+    _stale = True
+
+
+def clear():
+    global _index
+    _index = None
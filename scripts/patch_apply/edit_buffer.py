@@ -0,0 +1,167 @@
+import os
+import bisect
+
+import scripts.source_file as source_file
+
+ORIGINAL = 0
+ADDED = 1
+
+
+class EditBuffer:
+    """
+    Collects the changes made to one file by the hunks of a patch, so the
+    file is written once, when the whole patch is done, instead of once
+    for every hunk.  The buffers are managed by the overlay (see
+    scripts/overlay.py).
+
+    The contents are kept as a piece table: a list of (buffer, start,
+    length) pieces that refer either to the lines of the original file
+    or to lines added by hunks.  Replacing lines only splits and
+    replaces pieces; the lines themselves are never moved around, and
+    are only put together when the current contents are read (see
+    current).
+    """
+
+    def __init__(self, source):
+        self.path = source.path
+        self.encoding = source.encoding
+        self.source = source
+        self.buffers = (source.lines, [])
+        self.pieces = [(ORIGINAL, 0, len(source.lines))] if source.lines else []
+
+        # The added lines stripped, and where each of them is in the
+        # added buffer, like SourceFile.positions().
+        self.added_stripped = []
+        self.added_index = {}
+
+        # The Contents for the current pieces, once they have been read.
+        self._current = None
+
+        # Set once a hunk has been applied, even if it turned out not to
+        # change any lines, since writing the file also adds the missing
+        # newline at the end.
+        self.modified = False
+
+        # True if the file doesn't exist on disk yet.
+        self.created = False
+
+    def __len__(self):
+        return sum(length for _, _, length in self.pieces)
+
+    def isModified(self):
+        return self.modified
+
+    @property
+    def current(self):
+        """
+        The current contents of the file, as a SourceFile.
+        """
+        if not self.modified:
+            return self.source
+        if self._current is None:
+            self._current = Contents(self)
+        return self._current
+
+    def lines(self):
+        """
+        Returns the current contents of the file as a list of lines.
+        """
+        lines = []
+        for buffer, start, length in self.pieces:
+            lines.extend(self.buffers[buffer][start:start + length])
+        return lines
+
+    def _split(self, line):
+        """
+        Private helper that makes sure a piece starts at line (counting
+        from 0), and returns the index of that piece.
+        """
+        position = 0
+        for index, (buffer, start, length) in enumerate(self.pieces):
+            if position == line:
+                return index
+            if line < position + length:
+                offset = line - position
+                self.pieces[index:index + 1] = [
+                    (buffer, start, offset),
+                    (buffer, start + offset, length - offset),
+                ]
+                return index + 1
+            position += length
+        return len(self.pieces)
+
+    def replace(self, start, count, new_lines):
+        """
+        Replaces count lines of the current contents, starting at start
+        (counting from 0), with new_lines.
+        """
+        self.modified = True
+        self._current = None
+        if count == 0 and len(new_lines) == 0:
+            return
+
+        first = self._split(start)
+        last = self._split(start + count)
+        replacement = []
+        if new_lines:
+            added = self.buffers[ADDED]
+            replacement.append((ADDED, len(added), len(new_lines)))
+            for line in new_lines:
+                stripped = line.strip()
+                self.added_index.setdefault(stripped, []).append(len(added))
+                self.added_stripped.append(stripped)
+                added.append(line)
+        self.pieces[first:last] = replacement
+
+    def write(self):
+        """
+        Writes the current contents to the file (see source_file.write()).
+        """
+        if not self.isModified():
+            return
+
+        lines = self.lines()
+        # Every line gets a newline, including the last one.
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+
+        if self.created:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        source_file.write(self.path, lines, self.encoding)
+        self.modified = False
+
+
+class Contents(source_file.SourceFile):
+    """
+    The contents of an EditBuffer at one point in time.  The lines are
+    copied out of the pieces, but the line index isn't built again:
+    positions() looks each piece up in the index of the buffer it comes
+    from.
+    """
+
+    def __init__(self, buffer):
+        lines = []
+        stripped = []
+        strippedBuffers = (buffer.source.stripped, buffer.added_stripped)
+        for index, start, length in buffer.pieces:
+            lines.extend(buffer.buffers[index][start:start + length])
+            stripped.extend(strippedBuffers[index][start:start + length])
+        super().__init__(buffer.path, lines, encoding=buffer.encoding, stripped=stripped)
+        self.has_cr = buffer.source.has_cr
+
+        self._source = buffer.source
+        self._added_index = buffer.added_index
+        self._pieces = list(buffer.pieces)
+
+    def positions(self, stripped_line):
+        found = []
+        indexes = (self._source.positions(stripped_line),
+                   self._added_index.get(stripped_line, []))
+        position = 0
+        for index, start, length in self._pieces:
+            candidates = indexes[index]
+            lo = bisect.bisect_left(candidates, start)
+            hi = bisect.bisect_left(candidates, start + length)
+            found.extend(position + line - start for line in candidates[lo:hi])
+            position += length
+        return found
@@ -0,0 +1,246 @@
+import os
+import re
+
+import scripts.overlay as overlay
+from scripts.enums import natureOfChange, applyStatus
+from scripts.patch_apply.outcome import HunkOutcome, FileOutcome, PatchOutcome
+
+
+# Things in a patch that only git apply knows how to deal with: binary
+# patches, renames and copies, mode changes, and lines with "\ No newline
+# at end of file".
+UNSUPPORTED = re.compile(
+    r"^(GIT binary patch|Binary files |rename (from|to) |copy (from|to) |"
+    r"similarity index |(old|new) mode |deleted file mode |"
+    r"new file mode (?!100644$)|\\)",
+    re.MULTILINE,
+)
+HEADER = re.compile(r"^(?:---|\+\+\+) ([^\t\n]*)", re.MULTILINE)
+GIT_HEADER = re.compile(r"^diff --git ", re.MULTILINE)
+
+
+def _gitPrefix():
+    # Imported here since patchParser uses this module.
+    from scripts.patch_apply.patchParser import findGitPrefix
+    return findGitPrefix(".")
+
+
+def plain_names(text):
+    """
+    True if the file names in the patch are ones that patchParser and git
+    apply agree on.  patchParser only strips "a/" and "b/" from the names,
+    where git apply strips the first directory whatever it is (-p1), and
+    quoted names and names with spaces are left to git.
+    """
+    for header in HEADER.findall(text):
+        if header == "/dev/null":
+            continue
+        if not header.startswith(("a/", "b/")) or " " in header or '"' in header:
+            return False
+        name = header[2:]
+        if os.path.isabs(name) or name.split("/")[0] == "..":
+            return False
+    return True
+
+
+def _supported(patch_file, text):
+    """
+    True if the patch only uses the parts of the unified diff format that
+    apply_patch_file() handles exactly like git apply does.
+    """
+    if "\r" in text or UNSUPPORTED.search(text):
+        return False
+
+    if not plain_names(text):
+        return False
+
+    # In a git diff the names are relative to the top of the repository,
+    # not the current directory, and git skips the files outside of it.
+    if GIT_HEADER.search(text) and _gitPrefix() != "":
+        return False
+
+    try:
+        patch_file.getPatch()
+    except (AssertionError, AttributeError, IndexError, ValueError):
+        return False
+    if not patch_file.patches:
+        return False
+    if any(patch._isFileRemoved for patch in patch_file.patches):
+        return False
+
+    # A section without hunks (an empty new file, say) isn't in
+    # patch_file.patches.
+    sections = 1 + sum(
+        1 for before, after in zip(patch_file.patches, patch_file.patches[1:])
+        if before.getFileName() != after.getFileName()
+    )
+    if len(GIT_HEADER.findall(text)) > sections:
+        return False
+
+    return True
+
+
+def _split(patch):
+    """
+    Returns the lines the hunk expects to find, the lines it replaces
+    them with, and the number of context lines before and after the
+    change.  The first line of a Patch is the text after the "@@" and is
+    skipped.
+    """
+    old = []
+    new = []
+    kinds = []
+    for kind, text in patch.getLines()[1:]:
+        kinds.append(kind)
+        if kind != natureOfChange.ADDED:
+            old.append(text + "\n")
+        if kind != natureOfChange.REMOVED:
+            new.append(text + "\n")
+
+    leading = 0
+    while leading < len(kinds) and kinds[leading] == natureOfChange.CONTEXT:
+        leading += 1
+    trailing = 0
+    while trailing < len(kinds) - leading and kinds[-1 - trailing] == natureOfChange.CONTEXT:
+        trailing += 1
+    return old, new, leading, trailing
+
+
+def _findPosition(source, patched, old, expected, match_beginning, match_end):
+    """
+    Returns the line (counting from 0) where old is found in source, the
+    closest one to expected, or None.  Like git apply, a hunk that starts
+    at the beginning of the file has to match there, a hunk without
+    trailing context has to match at the end, and lines written by an
+    earlier hunk (patched[i] is True) can't be matched again.
+    """
+    lines = source.lines
+
+    def matches(position):
+        return (
+            lines[position:position + len(old)] == old
+            and not any(patched[position:position + len(old)])
+        )
+
+    last = len(lines) - len(old)
+    if last < 0:
+        return None
+
+    if match_beginning:
+        expected = 0
+    elif match_end:
+        expected = last
+    expected = min(max(expected, 0), last)
+
+    if match_beginning and match_end and expected != last:
+        return None
+    if match_beginning or match_end or not old:
+        return expected if matches(expected) else None
+
+    if matches(expected):
+        return expected
+
+    candidates = [
+        position for position in source.positions(old[0].strip())
+        if position <= last
+    ]
+    # Ties go to the line after expected, which git apply tries first.
+    candidates.sort(key=lambda position: (abs(position - expected), position < expected))
+
+    for position in candidates:
+        if matches(position):
+            return position
+    return None
+
+
+def _applyFile(fileName, hunks):
+    """
+    Applies the hunks for one file to the overlay, and returns a
+    FileOutcome.  The changes to the file are rolled back if any of the
+    hunks doesn't apply.
+    """
+    first = hunks[0]
+
+    if first.isNewFile():
+        if overlay.exists(fileName):
+            return FileOutcome(fileName, applyStatus.ALREADY_EXISTS,
+                               [HunkOutcome(hunk, applyStatus.NOT_TRIED) for hunk in hunks])
+        lines = []
+        outcomes = []
+        for hunk in hunks:
+            old, new, _, _ = _split(hunk)
+            lines.extend(new)
+            outcomes.append(HunkOutcome(hunk, applyStatus.APPLIED, hunk._newStart, 0))
+        overlay.current().create(fileName, lines)
+        return FileOutcome(fileName, applyStatus.APPLIED, outcomes)
+
+    if not overlay.isfile(fileName):
+        return FileOutcome(fileName, applyStatus.FILE_NOT_FOUND,
+                           [HunkOutcome(hunk, applyStatus.NOT_TRIED) for hunk in hunks])
+
+    # Like git apply --reject, the rest of the hunks are still tried when
+    # one doesn't apply, so that every hunk has an outcome.
+    outcomes = []
+    status = applyStatus.APPLIED
+    patched = [False] * len(overlay.read(fileName))
+    for hunk in hunks:
+        old, new, leading, trailing = _split(hunk)
+        expected = hunk._newStart - 1 if hunk._newStart > 0 else 0
+        match_beginning = hunk._oldStart <= 1
+        match_end = trailing == 0
+
+        position = _findPosition(overlay.read(fileName), patched, old, expected, match_beginning, match_end)
+        if position is None:
+            status = applyStatus.DOES_NOT_APPLY
+            outcomes.append(HunkOutcome(hunk, applyStatus.DOES_NOT_APPLY))
+            continue
+
+        if old != new:
+            overlay.edit(fileName).replace(position, len(old), new)
+        patched[position:position + len(old)] = [True] * len(new)
+        outcomes.append(HunkOutcome(hunk, applyStatus.APPLIED, position + 1, position - expected))
+
+    if status != applyStatus.APPLIED:
+        overlay.rollback(fileName)
+    return FileOutcome(fileName, status, outcomes)
+
+
+def apply_patch_file(patch_file, reverse=False):
+    """
+    Applies the patch to the overlay the way git apply would, without
+    starting git, and returns a PatchOutcome.  The caller commits or
+    rolls back the overlay.
+
+    Returns None, with the overlay untouched, if the patch uses something
+    only git apply knows how to do, in which case git apply has to be
+    used instead.
+    """
+    if reverse:
+        return None
+
+    try:
+        with open(patch_file.pathToFile, encoding="utf-8") as fileObj:
+            text = fileObj.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    if not _supported(patch_file, text):
+        return None
+
+    # The hunks of each file, in order.
+    files = []
+    for patch in patch_file.patches:
+        if files and files[-1][0] == patch.getFileName() and not patch.isNewFile():
+            files[-1][1].append(patch)
+        else:
+            files.append((patch.getFileName(), [patch]))
+
+    # Files whose line endings or missing final newline would be changed
+    # by writing them from the overlay are left to git.
+    for fileName, _ in files:
+        if overlay.isfile(fileName):
+            source = overlay.read(fileName)
+            if source.has_cr or (source.lines and not source.lines[-1].endswith("\n")):
+                return None
+
+    return PatchOutcome([_applyFile(fileName, hunks) for fileName, hunks in files])
@@ -0,0 +1,214 @@
+import os
+import hashlib
+import difflib
+
+import scripts.git as git
+import scripts.trace as trace
+from scripts.cache import DiskCache, cache_dir
+
+
+FILE_INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _scan(root):
+    """
+    Lists the files under root (relative to it) without git.
+    """
+    files = []
+    pending = [""]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(os.path.join(root, directory))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                name = os.path.join(directory, entry.name) if directory else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git":
+                        pending.append(name)
+                else:
+                    files.append(name)
+    return files
+
+
+def similarity(original, candidate):
+    """
+    How much candidate looks like the path original, as a sortable tuple:
+    the number of directories the two have in common at the end of the
+    path, then at the start, then how similar the whole paths are.
+    """
+    original_parts = original.split("/")[:-1]
+    candidate_parts = candidate.split("/")[:-1]
+
+    suffix = 0
+    while (suffix < min(len(original_parts), len(candidate_parts))
+           and original_parts[-1 - suffix] == candidate_parts[-1 - suffix]):
+        suffix += 1
+    prefix = 0
+    while (prefix < min(len(original_parts), len(candidate_parts))
+           and original_parts[prefix] == candidate_parts[prefix]):
+        prefix += 1
+
+    ratio = difflib.SequenceMatcher(None, original, candidate).ratio()
+    return (suffix, prefix, ratio)
+
+
+class FileIndex:
+    """
+    Maps the base name of every file in the repository to the paths
+    (relative to root) it can be found at.
+
+    In a git repository the files committed in HEAD are listed with git
+    and stored on disk, so the next run only has to ask git what changed
+    since (the commits in between, and git status for the working tree)
+    instead of listing the whole tree again.  Files ignored by git aren't
+    in the index.  Outside of a git repository the directory is walked
+    every time the index is built.
+    """
+
+    def __init__(self, root=None, cache=True):
+        if root is None:
+            root = os.getcwd()
+        toplevel = git.run(["rev-parse", "--show-toplevel"], root)
+        self.git = toplevel is not None
+        self.root = toplevel.decode().strip() if self.git else os.path.realpath(root)
+
+        if cache is True:
+            cache = DiskCache(cache_dir("file_index"), FILE_INDEX_MAX_BYTES)
+        self.cache = cache if self.git else None
+
+        # The commit the index was last brought up to date with, and the
+        # files in it.
+        self.head = None
+        self.committed = set()
+        self.byName = {}
+        self.refresh()
+
+    def _key(self):
+        return hashlib.sha1(self.root.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def _committed(self):
+        """
+        Returns the files committed in HEAD, reusing the list from the
+        last time if HEAD hasn't moved since, or the stored one.
+        """
+        head = git.run(["rev-parse", "--verify", "--quiet", "HEAD"], self.root)
+        if head is None:
+            return set()
+        head = head.decode().strip()
+        if head == self.head:
+            return set(self.committed)
+
+        if self.head is None and self.cache is not None:
+            stored = self.cache.get(self._key())
+            if stored is not None and stored.get("root") == self.root:
+                self.head = stored["head"]
+                self.committed = set(stored["files"])
+                if self.head == head:
+                    return set(self.committed)
+
+        files = None
+        if self.head is not None:
+            changes = git.run(
+                ["diff", "--name-status", "--no-renames", "-z", self.head, head],
+                self.root,
+            )
+            if changes is not None:
+                files = set(self.committed)
+                fields = git.split(changes)
+                for status, name in zip(fields[::2], fields[1::2]):
+                    if status == "D":
+                        files.discard(name)
+                    else:
+                        files.add(name)
+        if files is None:
+            files = git.run(["ls-tree", "-r", "--name-only", "-z", "HEAD"], self.root)
+            files = set(git.split(files)) if files is not None else set()
+
+        self.head = head
+        self.committed = files
+        if self.cache is not None:
+            self.cache.put(self._key(), {"root": self.root, "head": head, "files": sorted(files)})
+        return set(files)
+
+    def refresh(self):
+        """
+        Brings the index up to date with the files on disk.
+        """
+        if not self.git:
+            files = _scan(self.root)
+        else:
+            files = self._committed()
+
+            # Files added, removed or not yet committed in the working
+            # tree.  A path git status lists is in the index if it is on
+            # disk, whatever git thinks happened to it.
+            status = git.run(
+                ["status", "--porcelain", "--no-renames", "--untracked-files=all", "-z"],
+                self.root,
+            )
+            if status is not None:
+                for entry in git.split(status):
+                    name = entry[3:]
+                    if os.path.lexists(os.path.join(self.root, name)):
+                        files.add(name)
+                    else:
+                        files.discard(name)
+
+        self.byName = {}
+        for name in files:
+            self.byName.setdefault(os.path.basename(name), []).append(name)
+
+    def find(self, path, under=None):
+        """
+        Returns the paths of the files with the same base name as path,
+        the ones most like path first.  Paths are relative to the current
+        directory, and only files below the directory under (by default
+        the current directory) are returned.
+        """
+        # git gives the top of the repository with symbolic links
+        # resolved.
+        cwd = os.path.realpath(os.getcwd())
+        if under is None:
+            under = cwd
+        under = os.path.relpath(os.path.realpath(under), self.root)
+        under = "" if under == "." else under + os.sep
+
+        found = [
+            os.path.relpath(os.path.join(self.root, name), cwd)
+            for name in self.byName.get(os.path.basename(path), [])
+            if name.startswith(under)
+        ]
+        return sorted(found, key=lambda candidate: (
+            tuple(-value for value in similarity(path, candidate)), candidate
+        ))
+
+
+# The index of the repository the current directory is in, rebuilt if the
+# current directory moves to another one.  invalidate() marks it as
+# needing a refresh, which is done the next time it is used.
+_index = None
+_stale = False
+
+
+def get():
+    global _index, _stale
+    cwd = os.path.realpath(os.getcwd())
+    if _index is None or os.path.commonpath([cwd, _index.root]) != _index.root:
+        _index = FileIndex()
+    elif _stale:
+        _index.refresh()
+    _stale = False
+    return _index
+
+
+def invalidate():
+    global _stale
+    _stale = True
+
+
+def clear():
+    global _index
+    _index = None
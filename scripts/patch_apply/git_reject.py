@@ -0,0 +1,126 @@
+import os
+import re
+import glob
+import shutil
+import tempfile
+import subprocess
+
+import scripts.patch_apply.fast_apply as fast_apply
+import scripts.trace as trace
+from scripts.enums import applyStatus
+
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+# What git apply --verbose prints for each file it gets to apply hunks
+# to, with LC_ALL=C.
+FILE_DONE = re.compile(
+    r"^Appl(?:ied patch (.*) cleanly\.|ying patch (.*) with \d+ rejects?\.\.\.)$",
+    re.MULTILINE,
+)
+
+
+def _header(match):
+    old_start, old_length, new_start, new_length = match.groups()
+    return (
+        int(old_start),
+        int(old_length) if old_length is not None else 1,
+        int(new_start),
+        int(new_length) if new_length is not None else 1,
+    )
+
+
+@trace.traced("git_reject")
+def hunk_status(patch_file, reverse=False):
+    """
+    Asks git which hunks of the patch apply, by running git apply
+    --reject over copies of the files in a scratch directory and reading
+    back the .rej files it leaves.  Nothing in the working tree is
+    touched.
+
+    Returns a dictionary mapping each hunk (Patch object) of the files
+    git rejected hunks of to applyStatus.APPLIED or DOES_NOT_APPLY.  Only
+    those files are parsed (see PatchFile.hunksFor()); the hunks of the
+    files git applied cleanly are left out, unless the patch had already
+    been parsed, as are the ones git couldn't get to (new files, missing
+    files, patches that don't parse).
+    """
+    if reverse:
+        return {}
+
+    try:
+        with open(patch_file.pathToFile, encoding="utf-8") as fileObj:
+            text = fileObj.read()
+    except (OSError, UnicodeDecodeError):
+        return {}
+    if not fast_apply.plain_names(text):
+        return {}
+
+    try:
+        headers = patch_file.hunksFor(lambda fileName: False)
+    except (AssertionError, AttributeError, IndexError, ValueError):
+        return {}
+
+    hunks = set()
+    for patch in headers:
+        if patch.isNewFile() or not os.path.isfile(patch.getFileName()):
+            continue
+        hunks.add(patch.getFileName())
+    if not hunks:
+        return {}
+
+    scratch = tempfile.mkdtemp(prefix="applyplus-reject-")
+    try:
+        for name in hunks:
+            copy = os.path.join(scratch, name)
+            os.makedirs(os.path.dirname(copy), exist_ok=True)
+            shutil.copyfile(name, copy)
+
+        cmdline = ['git', 'apply', '--reject', '--verbose']
+        cmdline += ['--include=%s' % glob.escape(name) for name in hunks]
+        cmdline.append( os.path.abspath(patch_file.pathToFile) )
+
+        # The scratch directory mustn't be taken for part of a repository,
+        # and the messages have to be in English to be read back.
+        env = dict(os.environ)
+        env["LC_ALL"] = "C"
+        env["GIT_CEILING_DIRECTORIES"] = os.path.dirname(scratch)
+        with trace.span("git apply", "process", reject=True):
+            result = subprocess.run(
+                cmdline, cwd=scratch, env=env, capture_output=True, text=True
+            )
+
+        done = set()
+        with_rejects = set()
+        for match in FILE_DONE.finditer(result.stderr):
+            done.add(match.group(1) or match.group(2))
+            if match.group(2):
+                with_rejects.add(match.group(2))
+
+        try:
+            patches = patch_file.hunksFor(lambda fileName: fileName in with_rejects)
+        except (AssertionError, AttributeError, IndexError, ValueError):
+            return {}
+
+        rejected = {}
+        for name in hunks & with_rejects:
+            try:
+                with open(os.path.join(scratch, name + ".rej"), encoding="utf-8", errors="replace") as fileObj:
+                    rejected[name] = {_header(match) for match in HUNK_HEADER.finditer(fileObj.read())}
+            except FileNotFoundError:
+                pass
+
+        status = {}
+        for patch in patches:
+            name = patch.getFileName()
+            if name not in hunks or name not in done:
+                continue
+            if name not in with_rejects and not patch_file.parsed:
+                # Only the headers of this file were read.
+                continue
+            if patch.getLinesChanged() in rejected.get(name, ()):
+                status[patch] = applyStatus.DOES_NOT_APPLY
+            else:
+                status[patch] = applyStatus.APPLIED
+        return status
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,59 @@
+import os
+
+from scripts.enums import applyStatus
+
+
+class HunkOutcome:
+    """
+    What happened to one hunk.
+
+    status: applyStatus.APPLIED or DOES_NOT_APPLY, or NOT_TRIED if the
+        file couldn't be patched at all
+    line: the line the hunk was applied at (counting from 1)
+    offset: how many lines that is away from where the patch said
+    """
+
+    def __init__(self, patch, status, line=None, offset=None):
+        self.patch = patch
+        self.status = status
+        self.line = line
+        self.offset = offset
+
+
+class FileOutcome:
+    def __init__(self, fileName, status, hunks):
+        self.fileName = fileName
+        self.status = status
+        self.hunks = hunks
+
+
+class PatchOutcome:
+    """
+    What happened to each of the files of a patch, in the order they
+    appear in the patch.
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    @property
+    def success(self):
+        return all(file.status == applyStatus.APPLIED for file in self.files)
+
+    def message(self, prefix=""):
+        """
+        Returns the errors in the format git apply uses, with prefix (the
+        path from the top of the repository) added to the file names.
+        """
+        reasons = {
+            applyStatus.DOES_NOT_APPLY: "patch does not apply",
+            applyStatus.FILE_NOT_FOUND: "No such file or directory",
+            applyStatus.ALREADY_EXISTS: "already exists in working directory",
+        }
+        lines = []
+        for file in self.files:
+            if file.status in reasons:
+                lines.append("error: %s: %s\n" % (
+                    os.path.join(prefix, file.fileName), reasons[file.status]
+                ))
+        return "".join(lines)
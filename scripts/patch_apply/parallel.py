@@ -0,0 +1,255 @@
+import os
+import io
+import shutil
+import tempfile
+import traceback
+import subprocess
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+import scripts.git
+import scripts.trace as trace
+
+
+def git(args, cwd=None, input=None):
+    return subprocess.run(
+        ["git"] + args, cwd=cwd, input=input, capture_output=True
+    )
+
+
+class Worktree:
+    """
+    A scratch copy of the repository (a detached git worktree) that one
+    worker examines patches in, so that workers never see each other's
+    changes.  The worktree is put in the state of the original tree once,
+    when it is created, and only put back after a patch that changed it
+    (see changed()).
+    """
+
+    def __init__(self, path, prefix, changes, root=None, untracked=()):
+        # Where the worktree is, the directory inside of it that
+        # corresponds to the directory apply.py was started from, the
+        # uncommitted changes of the original tree (a binary diff), and
+        # the files of the original tree (at root) that git doesn't track
+        # but doesn't ignore either, which the diff leaves out.
+        self.path = path
+        self.cwd = os.path.join(path, prefix)
+        self.changes = changes
+        self.root = root
+        self.untracked = untracked
+        # What git status says once the worktree has been reset.
+        self.status = None
+
+    def _status(self):
+        return git(
+            ["status", "--porcelain", "--untracked-files=all", "--ignored", "-z"],
+            cwd=self.path,
+        ).stdout
+
+    def reset(self):
+        git(["reset", "--quiet", "--hard", "HEAD"], cwd=self.path)
+        git(["clean", "--quiet", "-fdx"], cwd=self.path)
+        if self.changes:
+            git(["apply", "--binary", "-"], cwd=self.path, input=self.changes)
+        for name in self.untracked:
+            copy = os.path.join(self.path, name)
+            os.makedirs(os.path.dirname(copy), exist_ok=True)
+            shutil.copy2(os.path.join(self.root, name), copy, follow_symlinks=False)
+        self.status = self._status()
+
+    def changed(self, written=()):
+        """
+        True if the worktree may no longer be in the state of the original
+        tree: written (the files the overlay wrote) isn't empty, or git
+        status says something else than after the last reset.  git status
+        doesn't see a file that was already changed being changed again,
+        but everything apply() writes goes through the overlay.
+        """
+        return bool(written) or self._status() != self.status
+
+
+class WorktreePool:
+    """
+    Creates one worktree for each worker, and removes them again when
+    the pool is closed.  If the current directory isn't in a git
+    repository there is nothing to copy, and the workers all share the
+    current directory.
+    """
+
+    def __init__(self, count):
+        self.root = None
+        self.tmpdir = None
+        self.worktrees = []
+
+        toplevel = git(["rev-parse", "--show-toplevel"])
+        if toplevel.returncode != 0:
+            return
+        self.root = toplevel.stdout.decode().strip()
+        prefix = git(["rev-parse", "--show-prefix"]).stdout.decode().strip()
+        changes = git(["diff", "--binary", "HEAD"], cwd=self.root).stdout
+        untracked = scripts.git.split(
+            git(["ls-files", "--others", "--exclude-standard", "-z"], cwd=self.root).stdout
+        )
+
+        self.tmpdir = tempfile.mkdtemp(prefix="applyplus-")
+        for i in range(count):
+            path = os.path.join(self.tmpdir, str(i))
+            result = git(["worktree", "add", "--quiet", "--detach", path, "HEAD"], cwd=self.root)
+            if result.returncode != 0:
+                self.close()
+                raise RuntimeError(
+                    "Unable to create a worktree: %s" % result.stderr.decode().strip()
+                )
+            worktree = Worktree(path, prefix, changes, self.root, untracked)
+            worktree.reset()
+            self.worktrees.append(worktree)
+
+    def close(self):
+        for worktree in self.worktrees:
+            git(["worktree", "remove", "--force", worktree.path], cwd=self.root)
+        self.worktrees = []
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            git(["worktree", "prune"], cwd=self.root)
+            self.tmpdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# The worktree of this worker process, or None if the workers share the
+# current directory.
+_worktree = None
+
+
+def _init_worker(worktrees):
+    global _worktree
+    _worktree = worktrees.get()
+
+
+def _traced(tracing, function, *args):
+    """
+    Returns what function(*args) returns and, if tracing, what was traced
+    while it ran (see trace.Tracer.export), to be merged into the trace
+    of the parent.
+    """
+    if not tracing:
+        return function(*args), None
+    trace.disable()
+    tracer = trace.enable()
+    try:
+        return function(*args), tracer.export()
+    finally:
+        trace.disable()
+
+
+def _merge(exported):
+    if exported is not None and trace.current() is not None:
+        trace.current().merge(exported)
+
+
+def _examine(kwargs):
+    """
+    Runs apply() for one patch in the worktree of the worker and returns
+    what it printed and, in batch mode, the records it wrote.
+    """
+    import scripts.patch_apply.apply as apply
+    import scripts.overlay as overlay
+
+    # The patches themselves are already spread over the workers.
+    kwargs = dict(kwargs, jobs=1)
+
+    if _worktree is not None:
+        os.chdir(_worktree.cwd)
+    overlay.current().written.clear()
+
+    output = io.StringIO()
+    records = io.StringIO()
+    if kwargs.get('batch'):
+        kwargs['records'] = records
+    with contextlib.redirect_stdout(output):
+        try:
+            with trace.span("patch", path=kwargs['pathToPatch']):
+                apply.apply(**kwargs)
+        except Exception:
+            traceback.print_exc(file=output)
+
+    # Dry runs leave the worktree as it was, so it is rarely put back.
+    if _worktree is not None and _worktree.changed(overlay.current().written):
+        _worktree.reset()
+    return output.getvalue(), records.getvalue()
+
+
+def examine_all(patches, jobs, kwargs):
+    """
+    Generator that examines each of the patches (absolute paths) with
+    apply(**kwargs), spread over jobs worker processes, and yields what
+    apply() printed for each patch, and the records it wrote in batch
+    mode, in the order of patches.
+
+    Every patch is examined against the tree as it was when this was
+    called, not against the changes made by the patches before it.
+    """
+    with WorktreePool(jobs) as pool:
+        worktrees = multiprocessing.Queue()
+        for worktree in pool.worktrees:
+            worktrees.put(worktree)
+        if not pool.worktrees:
+            for i in range(jobs):
+                worktrees.put(None)
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(worktrees,)
+        ) as executor:
+            tracing = trace.current() is not None
+            futures = [
+                executor.submit(_traced, tracing, _examine, dict(kwargs, pathToPatch=patch))
+                for patch in patches
+            ]
+            for future in futures:
+                result, exported = future.result()
+                _merge(exported)
+                yield result
+
+
+def _analyse(hunks):
+    import scripts.patch_apply.apply as apply
+
+    return list(apply.analyse_hunks(hunks))
+
+
+def analyse_all(hunks, jobs):
+    """
+    Runs apply.analyse_hunks() over the (patch, fileName) pairs in hunks
+    using jobs worker processes.  This is a generator that yields the
+    results in the same order as hunks, each one as soon as it and all of
+    the results before it are ready.
+
+    The hunks for one file are analysed by the same worker, one after
+    the other, so the file is only read (and sliced) once.  Each worker
+    slices its files on its own; the slice cache is shared through the
+    disk.
+    """
+    by_file = {}
+    for index, (patch, fileName) in enumerate(hunks):
+        by_file.setdefault(fileName, []).append(index)
+
+    tracing = trace.current() is not None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [None] * len(hunks)
+        for indexes in by_file.values():
+            future = executor.submit(_traced, tracing, _analyse, [hunks[i] for i in indexes])
+            for position, index in enumerate(indexes):
+                futures[index] = (future, position)
+
+        merged = set()
+        for future, position in futures:
+            results, exported = future.result()
+            if future not in merged:
+                merged.add(future)
+                _merge(exported)
+            yield results[position]
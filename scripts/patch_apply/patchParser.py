@@ -1,25 +1,104 @@
 from enum import Enum
 import re
 import os
+import mmap
+import locale
 import subprocess
-from scripts.enums import natureOfChange, precheckStatus
+import bisect
+import scripts.overlay as overlay
+import scripts.trace as trace
+import scripts.patch_apply.fast_apply as fast_apply
+import scripts.patch_apply.git_reject as git_reject
+from scripts.enums import natureOfChange, precheckStatus, applyStatus
+
+
+# The kind of each line of a hunk is stored as the character that starts
+# the line in the patch.
+CONTEXT_LINE = ord(" ")
+ADDED_LINE = ord("+")
+REMOVED_LINE = ord("-")
+_KIND_BYTES = {
+    natureOfChange.CONTEXT: CONTEXT_LINE,
+    natureOfChange.ADDED: ADDED_LINE,
+    natureOfChange.REMOVED: REMOVED_LINE,
+}
+_BYTE_KINDS = {byte: kind for kind, byte in _KIND_BYTES.items()}
+
+# "@@ -start,length +start,length @@ text", where a length of 1 can be
+# left out.
+HUNK_HEADER = re.compile(r'@@ -([0-9]+)(?:,([0-9]+))? *\+([0-9]+)(?:,([0-9]+))? @@.*')
+_HUNK_HEADER_BYTES = re.compile(HUNK_HEADER.pattern.encode("ascii"))
+
+
+class HunkLines:
+    """
+    The lines of a hunk.  It behaves like the list of (natureOfChange,
+    text) pairs it replaces, but the kinds are kept as one byte per line
+    (CONTEXT_LINE, ADDED_LINE or REMOVED_LINE) and the text in a single
+    list, instead of a tuple for every line.  Code that goes through
+    every line uses kinds and text directly.
+    """
+
+    __slots__ = ("kinds", "text")
+
+    def __init__(self, lines=()):
+        self.kinds = bytearray()
+        self.text = []
+        for line in lines:
+            self.append(line)
+
+    def append(self, line):
+        kind, text = line
+        self.kinds.append(_KIND_BYTES[kind])
+        self.text.append(text)
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [
+                (_BYTE_KINDS[kind], text)
+                for kind, text in zip(self.kinds[index], self.text[index])
+            ]
+        return (_BYTE_KINDS[self.kinds[index]], self.text[index])
+
+    def __setitem__(self, index, line):
+        kind, text = line
+        self.kinds[index] = _KIND_BYTES[kind]
+        self.text[index] = text
+
+    def __iter__(self):
+        for kind, text in zip(self.kinds, self.text):
+            yield (_BYTE_KINDS[kind], text)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class Patch:
+    __slots__ = (
+        "_fileName", "_hunk", "_oldStart", "_oldLength", "_newStart",
+        "_newLength", "_isNewFile", "_isFileRemoved",
+    )
+
     def __init__(self):
         """
         Constructor
         --------------------------
         Gets patch name as input
         --------------------------
-        _lines is a list of tuples of the format-
+        _lines is a HunkLines, which acts as a list of tuples of the format-
         [(<nature_of_change>, <change>),(<nature_of_change>, <change>),...,]
         Nature of Change can be one of the enums defined in natureOfChange (ADDED, REMOVED, CONTEXT)
         _oldStart, _oldLength, _newStart, and _newLength store the lines changed info for a patch.
         ie- The data found between @@s
         """
         self._fileName = None
-        self._lines = []
+        self._hunk = HunkLines()
         self._oldStart = -1
         self._oldLength = -1
         self._newStart = -1
@@ -27,6 +106,14 @@ class Patch:
         self._isNewFile = False
         self._isFileRemoved = False
 
+    @property
+    def _lines(self):
+        return self._hunk
+
+    @_lines.setter
+    def _lines(self, lines):
+        self._hunk = lines if isinstance(lines, HunkLines) else HunkLines(lines)
+
     def __str__(self):
         """
         Overloaded print function
@@ -43,17 +130,17 @@ class Patch:
         """
         Method used to add a line to a patch file
         """
-        self._lines.append((lineType, lineToAdd))
+        self._hunk.append((lineType, lineToAdd))
 
     def getLines(self):
         """
         Accessor to get lines stored in patch
         --------------------------
-        Returns a list of tuples of the format-
+        Returns a HunkLines, which acts as a list of tuples of the format-
         [(<nature_of_change>, <change>),(<nature_of_change>, <change>),...,]
         Nature of Change can be one of the enums defined in natureOfChange (ADDED, REMOVED, CONTEXT)
         """
-        return self._lines
+        return self._hunk
 
     def getFileName(self):
         """
@@ -71,39 +158,15 @@ class Patch:
         """
         Method used to add lines changed info for a patch
         """
-        match = re.fullmatch(r'@@ -([0-9]+),([0-9]+) *\+([0-9]+),([0-9]+) @@.*', rawData)
-        if match is not None:
-            self._oldStart = int(match.group(1))
-            self._oldLength = int(match.group(2))
-            self._newStart = int(match.group(3))
-            self._newLength = int(match.group(4))
-            return
+        match = HUNK_HEADER.fullmatch(rawData)
+        if match is None:
+            raise ValueError( "Don't know how to handle context line %s" % rawData)
 
-        match = re.fullmatch(r'@@ -([0-9]+) *\+([0-9]+),([0-9]+) @@.*', rawData)
-        if match is not None:
-            self._oldStart = int(match.group(1))
-            self._oldLength = 1
-            self._newStart = int(match.group(2))
-            self._newLength = int(match.group(3))
-            return
-
-        match = re.fullmatch(r'@@ -([0-9]+),([0-9]+) *\+([0-9]+) @@.*', rawData)
-        if match is not None:
-            self._oldStart = int(match.group(1))
-            self._oldLength = int(match.group(2))
-            self._newStart = int(match.group(3))
-            self._newLength = 1
-            return
-
-        match = re.fullmatch(r'@@ -([0-9]+) *\+([0-9]+) @@.*', rawData)
-        if match is not None:
-            self._oldStart = int(match.group(1))
-            self._oldLength = 1
-            self._newStart = int(match.group(2))
-            self._newLength = 1
-            return
-
-        raise ValueError( "Don't know how to handle context line %s" % rawData)
+        oldStart, oldLength, newStart, newLength = match.groups()
+        self._oldStart = int(oldStart)
+        self._oldLength = int(oldLength) if oldLength is not None else 1
+        self._newStart = int(newStart)
+        self._newLength = int(newLength) if newLength is not None else 1
 
     def getLinesChanged(self):
         """
@@ -118,6 +181,54 @@ class Patch:
         """ Private helper method to return raw string"""
         return str(string)
 
+    def _candidateStarts(self, source):
+        """
+        Private helper returning, in order, the lines of source where this
+        hunk could start.  The hunk has to start on a line that matches
+        its first line, so those are looked up in the line index of the
+        file instead of comparing every line.
+
+        When the first line is common (a brace, for instance), the rarest
+        line of the context at the top of the hunk is used to throw away
+        starts that can't possibly match.  Only context lines are used so
+        that the starts thrown away are ones that would have failed
+        without converting any added line or flagging any removed line.
+        """
+        kinds = self._hunk.kinds
+        text = self._hunk.text
+        starts = source.positions(self._to_raw(text[1]).strip())
+
+        rarest = None
+        needed = 0
+        for ite in range(2, len(text)):
+            if kinds[ite] != CONTEXT_LINE:
+                break
+            line = text[ite].strip()
+            if len(line) == 0:
+                continue
+            positions = source.positions(line)
+            if rarest is None or len(positions) < len(rarest[0]):
+                rarest = (positions, needed)
+            needed += 1
+
+        if rarest is None or len(rarest[0]) >= len(starts):
+            return starts
+
+        # Between the start and the rare line, the file can only have as
+        # many non blank lines as there are non blank lines in the hunk
+        # between them.  Blank lines in the file can always be skipped.
+        positions, allowed = rarest
+        nonblank = source.nonblank
+        candidates = set()
+        for position in positions:
+            first = bisect.bisect_left(nonblank, nonblank[position] - allowed) - 1
+            lo = bisect.bisect_left(starts, max(first, 0))
+            hi = bisect.bisect_left(starts, position)
+            candidates.update(starts[lo:hi])
+
+        return sorted(candidates)
+
+    @trace.traced("canApply")
     def canApply(self, applyTo=None):
         """
             Returns a enum precheckStatus:
@@ -129,211 +240,223 @@ class Patch:
         if applyTo is None:
             applyTo = os.path.join( os.getcwd(), self.getFileName())
 
-        if not os.path.isfile(applyTo):
+        if not overlay.isfile(applyTo):
             if self.isNewFile():
                 return True
             return False
 
-        orgPatch = []
-        with open(applyTo, "r", encoding="utf-8", errors='ignore') as srcfile:
-            while True:
-                line = srcfile.readline()
-                if not line:
+        # The file is read and stripped once per run, no matter how many
+        # hunks are checked against it.
+        source = overlay.read(applyTo)
+        orgPatch = source.stripped
+        kinds = self._hunk.kinds
+        text = self._hunk.text
+        removedFlag = [ True for i in range(len(text))]
+        for checkLines in self._candidateStarts(source):
+            patch_found_flag = True
+            blank_line_offset_file = 0
+            added_offset = 0
+            ite = 2
+
+            # Check if the following lines match
+            while ite < len(text):
+                original_patch_offset = (
+                    checkLines + ite - 1 - blank_line_offset_file - added_offset
+                )
+
+                if original_patch_offset >= len(orgPatch):
+                    patch_found_flag = False
                     break
+                if kinds[ite] == ADDED_LINE:
+                    if orgPatch[original_patch_offset] == text[ite].strip():
+                        kinds[ite] = CONTEXT_LINE
+                    else:
+                        added_offset += 1
+                elif kinds[ite] == REMOVED_LINE:
+                    if orgPatch[original_patch_offset] == text[ite].strip():
+                        # removed line still present
+                        removedFlag[ite] = False
+                    else:
+                        # line removed, do not increase the orgPatch index.
+                        added_offset += 1
+                elif orgPatch[original_patch_offset] != text[ite].strip():
+                    if len(orgPatch[original_patch_offset]) == 0:
+                        # orgPatch empty line. keep ite the same but check next line of orgPatch
+                        blank_line_offset_file -= 1
+                        ite -= 1
+                    elif len(text[ite].strip()) == 0 and kinds[ite] != REMOVED_LINE:
+                        # hunk empty line. go to next line of hunk
+                        blank_line_offset_file += 1
+                    else:
+                        # doesn't match
+                        patch_found_flag = False
+                        break
+                ite += 1
+            if patch_found_flag:
+                # If they are all context lines now, this patch
+                # has already been applied and shouldn't be
+                # applied again.
+
+                if ADDED_LINE in kinds:
+                    # the lines to be added hasn't beed added yet
+                    return precheckStatus.CAN_APPLY
+                for removed in removedFlag:
+                    if not removed:
+                        # the lines to be removed present in the file
+                        return precheckStatus.CAN_APPLY
+                return precheckStatus.ALREADY_APPLIED
+            else:
+                for removed in removedFlag:
+                    if not removed:
+                        # We found some lines should be removed presented in the file
+                        # But we cannot find the exact match of this patch
+                        # This is the case when, we might partially find some removed line presented in the file in the firse checkLines chunk
+                        # But then the following lines did not match the patch
+                        # We kept those records in the array. We cannot keep it towards the next checkLines chunk check. Discard that change will also result in false positive
+                        # see msm-3.10: CVE-2016-3672.patch
+                        return precheckStatus.NO_MATCH_FOUND
+        return precheckStatus.NO_MATCH_FOUND
+
+    @trace.traced("Apply")
+    def Apply(self, applyTo, dry_run=False, buffered=False):
+        """
+        If patch can be applied, this method
+        applies it.
+
+        The change is made in the overlay (see scripts/overlay.py).  If
+        buffered is True, it is left there for the caller to commit or
+        roll back together with the rest of the patch, so later hunks
+        see it and a file changed by several hunks is written once.
+        Otherwise it is written straight away, unless dry_run is True.
+        """
+        if self.canApply(applyTo) == precheckStatus.CAN_APPLY:
+            source = overlay.read(applyTo)
+            stripped = source.stripped
+            kinds = self._hunk.kinds
+            text = self._hunk.text
 
-                line = line.strip("\n")
-                orgPatch.append(line)
-        removedFlag = [ True for i in range(len(self._lines))]
-        for checkLines in range(len(orgPatch)):
-            # Check if first line of patch exists
-            if orgPatch[checkLines].strip() == self._to_raw(self._lines[1][1]).strip():
+            # start by assuming all lines to be removed are removed
+            removedFlag = [ True for i in range(len(text))]
+            for checkLines in self._candidateStarts(source):
                 patch_found_flag = True
                 blank_line_offset_file = 0
                 added_offset = 0
                 ite = 2
-
-                # Check if the following lines match
-                while ite < len(self._lines):
+                # check the following lines after matched the first line
+                while ite < len(text):
                     original_patch_offset = (
                         checkLines + ite - 1 - blank_line_offset_file - added_offset
                     )
-
-                    if original_patch_offset >= len(orgPatch):
+                    if original_patch_offset >= len(stripped):
                         patch_found_flag = False
                         break
-                    if self._lines[ite][0] == natureOfChange.ADDED:
-                        if (
-                            orgPatch[original_patch_offset].strip()
-                            == self._lines[ite][1].strip()
-                        ):
-                            self._lines[ite] = (
-                                natureOfChange.CONTEXT,
-                                self._lines[ite][1],
-                            )
+                    if kinds[ite] == ADDED_LINE and stripped[original_patch_offset]:
+                        if stripped[original_patch_offset] == text[ite].strip():
+                            kinds[ite] = CONTEXT_LINE
                         else:
                             added_offset += 1
-                    elif self._lines[ite][0] == natureOfChange.REMOVED:
-                        if (
-                            orgPatch[original_patch_offset].strip()
-                            == self._lines[ite][1].strip()
-                        ):  # removed line still present
+                    elif kinds[ite] == REMOVED_LINE:
+                        if stripped[original_patch_offset] == text[ite].strip():
+                            # find presence of a removed line
                             removedFlag[ite] = False
                         else:
-                            # line removed, do not increase the orgPatch index.
                             added_offset += 1
-                    elif (
-                        orgPatch[original_patch_offset].strip()
-                        != self._lines[ite][1].strip()
-                    ):
-                        if len(orgPatch[original_patch_offset].strip()) == 0:
-                            # orgPatch empty line. keep ite the same but check next line of orgPatch
+                    elif stripped[original_patch_offset] != text[ite].strip():
+                        if len(stripped[original_patch_offset]) == 0:
                             blank_line_offset_file -= 1
                             ite -= 1
-                        elif len(self._lines[ite][1].strip()) == 0 and self._lines[ite][0] != natureOfChange.REMOVED:
-                            # hunk empty line. go to next line of hunk
+                        elif len(text[ite].strip()) == 0:
                             blank_line_offset_file += 1
                         else:
-                            # doesn't match
                             patch_found_flag = False
                             break
                     ite += 1
                 if patch_found_flag:
-                    # If they are all context lines now, this patch
-                    # has already been applied and shouldn't be
-                    # applied again.
-
-                    for ite_line in self._lines:
-                        if ite_line[0] == natureOfChange.ADDED:
-                            # the lines to be added hasn't beed added yet
-                            return precheckStatus.CAN_APPLY
-                    for removed in removedFlag:
-                        if not removed:
-                            # the lines to be removed present in the file
-                            return precheckStatus.CAN_APPLY
-                    return precheckStatus.ALREADY_APPLIED
-                else:
-                    for removed in removedFlag:
-                        if not removed:
-                            # We found some lines should be removed presented in the file
-                            # But we cannot find the exact match of this patch
-                            # This is the case when, we might partially find some removed line presented in the file in the firse checkLines chunk
-                            # But then the following lines did not match the patch
-                            # We kept those records in the array. We cannot keep it towards the next checkLines chunk check. Discard that change will also result in false positive
-                            # see msm-3.10: CVE-2016-3672.patch
-                            return precheckStatus.NO_MATCH_FOUND
-        return precheckStatus.NO_MATCH_FOUND
-
-    def Apply(self, applyTo, dry_run=False):
-        """
-        If patch can be applied, this method
-        applies it.
-        """
-        if self.canApply(applyTo) == precheckStatus.CAN_APPLY:
-            orgPatch = []
-            with open(applyTo, "r", encoding="utf-8") as srcfile:
-                while True:
-                    line = srcfile.readline()
-                    if not line:
-                        break
-                    orgPatch.append(line.strip("\n"))
-
-            # start by assuming all lines to be removed are removed
-            removedFlag = [ True for i in range(len(self._lines))]
-            for checkLines in range(len(orgPatch)):
-                # Check if first line of patch exists
-                if (
-                    orgPatch[checkLines].strip()
-                    == self._to_raw(self._lines[1][1]).strip()
-                ):
-                    patch_found_flag = True
-                    blank_line_offset_file = 0
-                    added_offset = 0
-                    ite = 2
-                    # check the following lines after matched the first line
-                    while ite < len(self._lines):
-                        original_patch_offset = (
-                            checkLines + ite - 1 - blank_line_offset_file - added_offset
-                        )
-                        if original_patch_offset >= len(orgPatch):
-                            patch_found_flag = False
-                            break
-                        if (
-                            self._lines[ite][0] == natureOfChange.ADDED
-                            and orgPatch[original_patch_offset].strip()
-                        ):
-                            if (
-                                orgPatch[original_patch_offset].strip()
-                                == self._lines[ite][1].strip()
-                            ):
-                                self._lines[ite] = (
-                                    natureOfChange.CONTEXT,
-                                    self._lines[ite][1],
-                                )
-                            else:
-                                added_offset += 1
-                        elif (
-                            self._lines[ite][0] == natureOfChange.REMOVED
-                        ):
-                            if (
-                                orgPatch[original_patch_offset].strip()
-                                == self._lines[ite][1].strip()
-                            ):
-                                # find presence of a removed line
-                                removedFlag[ite] = False
-                            else:
-                                added_offset += 1
-                        elif (
-                            orgPatch[original_patch_offset].strip()
-                            != self._lines[ite][1].strip()
-                        ):
-                            if len(orgPatch[original_patch_offset].strip()) == 0:
-                                blank_line_offset_file -= 1
-                                ite -= 1
-                            elif len(self._lines[ite][1].strip()) == 0:
-                                blank_line_offset_file += 1
+                    # If the next line runs, we know the patch is applied here
+
+                    # The hunk can only touch the lines from checkLines
+                    # up to twice its own length (every line of the hunk
+                    # can skip at most one removed line), so only that
+                    # window of the file is edited.
+                    window_end = min(len(stripped), checkLines + 2 * len(text) + 2)
+                    orgWindow = source.content(checkLines, window_end)
+                    window = list(orgWindow)
+                    ite2 = 0
+                    ite3 = 1
+                    goal = len(text)
+                    while ite2 < goal and ite3 < len(text):
+                        if kinds[ite3] == REMOVED_LINE:
+                            if not removedFlag[ite3]:
+                                goal -= 1
+                                window.pop(ite2)
+                            ite3 += 1
+                        elif kinds[ite3] == ADDED_LINE:
+                            window.insert(ite2, text[ite3])
+                            ite2 += 1
+                            ite3 += 1
+                        elif kinds[ite3] == CONTEXT_LINE:
+                            if text[ite3].strip() != window[ite2].strip():
+                                if len(text[ite3].strip()) == 0:
+                                    ite3 += 1
+                                else:
+                                    ite2 += 1
                             else:
-                                patch_found_flag = False
-                                break
-                        ite += 1
-                    if patch_found_flag:
-                        # If the next line runs, we know the patch is applied here
-                        ite2 = 0
-                        ite3 = 1
-                        goal = len(self._lines)
-                        while ite2 < goal and ite3 < len(self._lines):
-                            if self._lines[ite3][0] == natureOfChange.REMOVED:
-                                if not removedFlag[ite3]:
-                                    goal -= 1
-                                    orgPatch.pop(checkLines + ite2)
-                                ite3 += 1
-                            elif self._lines[ite3][0] == natureOfChange.ADDED:
-                                orgPatch.insert(checkLines + ite2, self._lines[ite3][1])
                                 ite2 += 1
                                 ite3 += 1
-                            elif self._lines[ite3][0] == natureOfChange.CONTEXT:
-                                if (
-                                    self._lines[ite3][1].strip()
-                                    != orgPatch[checkLines + ite2].strip()
-                                ):
-                                    if len(self._lines[ite3][1].strip()) == 0:
-                                        ite3 += 1
-                                    else:
-                                        ite2 += 1
-                                else:
-                                    ite2 += 1
-                                    ite3 += 1
 
-                        if not dry_run:
-                            writeobj = open(applyTo, "w")
-                            for i in orgPatch:
-                                i = i.replace("\n", "\\n")
-                                writeobj.write(i + "\n")
-                            writeobj.close()
-                        return True
+                    # Leave the unchanged lines at the end of the window
+                    # alone.
+                    unchanged = 0
+                    while (
+                        unchanged < min(len(window), len(orgWindow))
+                        and window[-1 - unchanged] == orgWindow[-1 - unchanged]
+                    ):
+                        unchanged += 1
+
+                    overlay.edit(applyTo).replace(
+                        checkLines,
+                        len(orgWindow) - unchanged,
+                        [
+                            i.replace("\n", "\\n") + "\n"
+                            for i in window[:len(window) - unchanged]
+                        ],
+                    )
+                    if not buffered:
+                        if dry_run:
+                            overlay.rollback(applyTo)
+                        else:
+                            overlay.commit(applyTo)
+                    return True
 
         return False
 
 
+def findGitPrefix(path):
+    prefix=''
+    resolved=False
+
+    while True:
+        if path == os.path.dirname(path) and not resolved:
+            path = os.path.realpath(path)
+            resolved = True
+
+        if os.path.isdir(path):
+            if os.path.isdir(os.path.join(path, ".git")):
+                if os.path.isfile(os.path.join(path, ".git", "config")):
+                    return prefix
+            elif os.path.isfile(os.path.join(path, ".git")):
+                # A worktree, where .git points at the real repository.
+                return prefix
+
+        if path == os.path.dirname(path):
+            break
+
+        if resolved:
+            prefix=os.path.join(prefix, os.path.basename(path))
+        path=os.path.dirname(path)
+    return ''
+
+
 class PatchFile:
     def __init__(self, pathToFile=""):
         """
@@ -345,16 +468,65 @@ class PatchFile:
         """
         self.pathToFile = pathToFile
         self.patches = []
+        self.parsed = False
+        # The PatchSections of the file (see index()), False if the file
+        # can't be indexed, or None if it hasn't been looked at yet.
+        self._sections = None
         self.runSuccess = False
         self.runResult = "Patch has not been run yet"
-
-    def runPatch(self, reverse=False, dry_run=False):
+        # The outcome.PatchOutcome if the patch was run without git
+        # apply, otherwise None.
+        self.outcome = None
+        # applyStatus.APPLIED or DOES_NOT_APPLY for the hunks it is known
+        # for, by hunk, once the patch has failed to run.
+        self.hunkStatus = {}
+
+    @trace.traced("runPatch")
+    def runPatch(self, reverse=False, dry_run=False, fast=True, cross_check=False):
         """
         Returns an empty string if patch successfully runs
         else returns the exact error message as a string
 
         If revert=True arg is provided, git apply --reverse is run.
+
+        Unless fast is False, the patch is first applied without starting
+        git (see fast_apply), and git apply is only run if the patch
+        uses something fast_apply doesn't handle.  With cross_check, git
+        apply --check is run as well and wins if the two disagree.
+
+        If the patch doesn't apply, hunkStatus is filled in with the
+        hunks that would have applied on their own and the ones that
+        wouldn't.
         """
+        self.outcome = None
+        self.hunkStatus = {}
+        if fast:
+            with trace.span("fast_apply"):
+                outcome = fast_apply.apply_patch_file(self, reverse=reverse)
+            if outcome is not None and cross_check:
+                if outcome.success != self._gitCheck(reverse):
+                    print( "Warning: git apply disagrees about %s, using git apply." % self.pathToFile )
+                    outcome = None
+            if outcome is not None:
+                if outcome.success and not dry_run:
+                    overlay.commit()
+                else:
+                    overlay.rollback()
+                self.outcome = outcome
+                self.runSuccess = outcome.success
+                if outcome.success:
+                    self.runResult = "Patch ran successfully"
+                else:
+                    self.runResult = outcome.message(findGitPrefix("."))
+                    for file in outcome.files:
+                        if file.hunks[0].patch.isNewFile():
+                            continue
+                        for hunk in file.hunks:
+                            if hunk.status in (applyStatus.APPLIED, applyStatus.DOES_NOT_APPLY):
+                                self.hunkStatus[hunk.patch] = hunk.status
+                return
+            overlay.rollback()
+
         cmdline = ['git', 'apply']
         if reverse == True:
             cmdline.append( '--reverse' )
@@ -363,7 +535,8 @@ class PatchFile:
         cmdline.append( '--verbose' )
         cmdline.append( self.pathToFile )
 
-        result = subprocess.run( cmdline, capture_output=True, text=True )
+        with trace.span("git apply", "process", check=dry_run):
+            result = subprocess.run( cmdline, capture_output=True, text=True )
         if result.returncode == 0:
             # Need to make sure that GIT didn't skip any patches.
             if re.search( '^Skipped patch', result.stderr ) is None:
@@ -379,153 +552,459 @@ class PatchFile:
         else:
             self.runResult = result.stderr
 
+        if not self.runSuccess:
+            self.hunkStatus = git_reject.hunk_status(self, reverse=reverse)
+
+    def _gitCheck(self, reverse=False):
+        cmdline = ['git', 'apply', '--check']
+        if reverse == True:
+            cmdline.append( '--reverse' )
+        cmdline.append( self.pathToFile )
+        with trace.span("git apply", "process", check=True):
+            result = subprocess.run( cmdline, capture_output=True, text=True )
+        return result.returncode == 0 and re.search( '^Skipped patch', result.stderr, re.MULTILINE ) is None
+
+    def iterPatches(self):
+        """
+        Generator that yields the hunks of the patch file one at a time,
+        each as soon as its last line has been read, without keeping
+        them (see iterHunks()).  Once getPatch() has been called, the
+        parsed hunks are yielded instead.
+        """
+        if self.parsed:
+            yield from self.patches
+            return
+
+        trace.count("bytes read", os.path.getsize(self.pathToFile))
+        with open(self.pathToFile) as fileObj:
+            yield from iterHunks(fileObj)
+
+    @trace.traced("getPatch")
     def getPatch(self):
         """
         A patch file has multiple patches.
         This method returns a list of patch objects
         each representing one patch
+
+        The patch file is only parsed once; later calls do nothing.
+        Code that only needs to look at each hunk once should use
+        iterPatches() instead, so the hunks aren't all kept in memory.
         """
+        if self.parsed:
+            return
+        if self._sections:
+            # Some files may have been parsed already (see hunksFor()).
+            self.patches = [
+                patch for section in self._sections for patch in self._parseSection(section)
+            ]
+        else:
+            self.patches = list(self.iterPatches())
+        self.parsed = True
 
-        with open(self.pathToFile) as fileObj:
-            file = fileObj.read().split("\n")
+    def index(self):
+        """
+        Returns the PatchSections of the patch file, found in one pass
+        over the file without parsing the hunks, or None if the file
+        isn't laid out simply enough to be indexed (see indexSections()).
+        """
+        if self._sections is None:
+            with open(self.pathToFile, "rb") as fileObj:
+                try:
+                    data = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # An empty file can't be mapped.
+                    data = b""
+                try:
+                    self._sections = indexSections(data) or False
+                finally:
+                    if isinstance(data, mmap.mmap):
+                        data.close()
+        return self._sections or None
+
+    def _parseSection(self, section):
+        if section.patches is None:
+            with open(self.pathToFile, "rb") as fileObj:
+                fileObj.seek(section.start)
+                data = fileObj.read(section.end - section.start)
+            trace.count("bytes read", len(data))
+            # Decoded the same way open() would have.
+            text = data.decode(locale.getpreferredencoding(False))
+            section.patches = list(iterHunks(text.split("\n")))
+        return section.patches
+
+    def hunksFor(self, wanted):
+        """
+        Returns every hunk of the patch file, in order.  Only the hunks of
+        the files for which wanted(fileName) is true are parsed into Patch
+        objects; the others are HunkHeaders, which is all that is needed
+        to name them.  The parsed hunks are kept, so asking for a file
+        again (or calling getPatch()) gives the same objects.  If the
+        patch has been parsed already, or can't be indexed, every hunk is
+        a Patch.
+        """
+        if not self.parsed and self.index() is None:
+            self.getPatch()
+        if self.parsed:
+            return list(self.patches)
+
+        hunks = []
+        for section in self._sections:
+            if wanted(section.fileName):
+                hunks.extend(self._parseSection(section))
+            else:
+                # As with iterHunks(), only the hunk right after the file
+                # header is for a new file.
+                hunks.extend(
+                    HunkHeader(section.fileName, header, section.isNewFile and i == 0)
+                    for i, header in enumerate(section.headers)
+                )
+        return hunks
+
+
+def iterHunks(lines):
+    """
+    Generator that parses the lines of a patch (an open file, say) and
+    yields each hunk as a Patch as soon as its last line has been read,
+    so only the hunk being read is held in memory.
+    """
+    patchObj = None
+    oldPatchObj = None
+
+    hunkRemaining = [0, 0]
+
+    for line in lines:
+        if line.endswith("\n"):
+            line = line[:-1]
+
+        if hunkRemaining[0] > 0 or hunkRemaining[1] > 0:
+            kind = line[0:1]
+            if kind == "-":
+                hunk.kinds.append(REMOVED_LINE)
+                hunk.text.append(line[1:])
+                hunkRemaining[0] -= 1
+
+            elif kind == "+":
+                hunk.kinds.append(ADDED_LINE)
+                hunk.text.append(line[1:])
+                hunkRemaining[1] -= 1
+
+            elif kind == ' ':
+                hunk.kinds.append(CONTEXT_LINE)
+                hunk.text.append(line[1:])
+                hunkRemaining[0] -= 1
+                hunkRemaining[1] -= 1
+
+            # It's a corrupt patch if we have too many removed or
+            # added lines for the line count in the hunk header.
+            assert( hunkRemaining[0] >= 0 and hunkRemaining[1] >= 0)
+
+            if hunkRemaining[0] == 0 and hunkRemaining[1] == 0:
+                assert( patchObj.getFileName() != None )
+                yield patchObj
+                oldPatchObj = patchObj
+                patchObj = None
+
+            continue
+
+        # If it's an empty line (including the last newline in the
+        # file), don't immediately start a new patch.
+        if line == "":
+            continue
+
+        # This is a HACK.  In general, we should probably not be
+        # modifying the file name in the patch.  In this case
+        # though, GIT always adds a "b/" to the name of the file
+        # being modified.  It also turns out that the unit tests
+        # do this (not that we want to have specific code just for
+        # the unit tests).
+        if line.startswith('+++ b/'):
+            filename = line.split()[1][2:]
+
+            if patchObj is None:
+                patchObj = Patch()
+
+            if patchObj.getFileName() is not None:
+                # We don't support patches where the two file
+                # names are different, except for patches that
+                # either add new files (original file was
+                # /dev/null) or delete files (new file is
+                # /dev/null).
+                assert( patchObj.getFileName() == filename )
+            else:
+                patchObj.setFileName(filename)
 
-        patchObj = None
-        oldPatchObj = None
+        elif line.startswith('+++ /dev/null'):
+            if patchObj is None:
+                patchObj = Patch()
 
-        hunkRemaining = [0, 0]
+            patchObj._isFileRemoved = True
+            pass
 
-        for line in file:
+        elif line.startswith('+++ '):
+            filename = line.split()[1]
 
-            if hunkRemaining[0] > 0 or hunkRemaining[1] > 0:
-                if line[0:1] == "-":
-                    contextline = line[1:]
-                    patchObj.addLines(natureOfChange.REMOVED, contextline)
-                    hunkRemaining[0] -= 1
+            if patchObj is None:
+                patchObj = Patch()
 
-                elif line[0:1] == "+":
-                    contextline = line[1:]
-                    patchObj.addLines(natureOfChange.ADDED, contextline)
-                    hunkRemaining[1] -= 1
+            if patchObj.getFileName() is not None:
+                assert( patchObj.getFileName() == filename )
+            else:
+                patchObj.setFileName(filename)
 
-                elif line[0:1] == ' ':
-                    contextline = line[1:]
-                    patchObj.addLines(natureOfChange.CONTEXT, contextline)
-                    hunkRemaining[0] -= 1
-                    hunkRemaining[1] -= 1
 
-                # It's a corrupt patch if we have too many removed or
-                # added lines for the line count in the hunk header.
-                assert( hunkRemaining[0] >= 0 and hunkRemaining[1] >= 0)
+        elif line.startswith('--- a/'):
+            filename = line.split()[1][2:]
 
-                if hunkRemaining[0] == 0 and hunkRemaining[1] == 0:
-                    assert( patchObj.getFileName() != None )
-                    self.patches.append(patchObj)
-                    oldPatchObj = patchObj
-                    patchObj = None
+            if patchObj is None:
+                patchObj = Patch()
 
-                continue
+            if patchObj.getFileName() is not None:
+                # We don't support patches where the two file
+                # names are different, except for patches that
+                # either add new files (original file was
+                # /dev/null) or delete files (new file is
+                # /dev/null).
+                assert( patchObj.getFileName() == filename )
+            else:
+                patchObj.setFileName(filename)
 
-            # If it's an empty line (including the last newline in the
-            # file), don't immediately start a new patch.
-            if line == "":
-                continue
+        elif line.startswith('--- /dev/null'):
+            if patchObj is None:
+                patchObj = Patch()
 
-            # This is a HACK.  In general, we should probably not be
-            # modifying the file name in the patch.  In this case
-            # though, GIT always adds a "b/" to the name of the file
-            # being modified.  It also turns out that the unit tests
-            # do this (not that we want to have specific code just for
-            # the unit tests).
-            if line.startswith('+++ b/'):
-                filename = line.split()[1][2:]
-
-                if patchObj is None:
-                    patchObj = Patch()
-
-                if patchObj.getFileName() is not None:
-                    # We don't support patches where the two file
-                    # names are different, except for patches that
-                    # either add new files (original file was
-                    # /dev/null) or delete files (new file is
-                    # /dev/null).
-                    assert( patchObj.getFileName() == filename )
-                else:
-                    patchObj.setFileName(filename)
+            patchObj._isNewFile = True
 
-            elif line.startswith('+++ /dev/null'):
-                if patchObj is None:
-                    patchObj = Patch()
+        elif line.startswith('--- '):
+            filename = line.split()[1]
 
-                patchObj._isFileRemoved = True
-                pass
+            if patchObj is None:
+                patchObj = Patch()
 
-            elif line.startswith('+++ '):
-                filename = line.split()[1]
+            if patchObj.getFileName() is not None:
+                assert( patchObj.getFileName() == filename )
+            else:
+                patchObj.setFileName(filename)
 
-                if patchObj is None:
-                    patchObj = Patch()
+        elif line.startswith('@@ '):
+            contextline = line[2:].split(" @@ ")[-1]
 
-                if patchObj.getFileName() is not None:
-                    assert( patchObj.getFileName() == filename )
-                else:
-                    patchObj.setFileName(filename)
+            if patchObj is None:
+                patchObj = Patch()
 
+            if patchObj.getFileName() is None:
+                patchObj.setFileName(oldPatchObj.getFileName())
 
-            elif line.startswith('--- a/'):
-                filename = line.split()[1][2:]
+            patchObj.setLinesChanged(line)
+            hunkRemaining = [patchObj._oldLength, patchObj._newLength]
+            hunk = patchObj._hunk
 
-                if patchObj is None:
-                    patchObj = Patch()
+            patchObj.addLines(
+                natureOfChange.CONTEXT,
+                contextline,
+            )
 
-                if patchObj.getFileName() is not None:
-                    # We don't support patches where the two file
-                    # names are different, except for patches that
-                    # either add new files (original file was
-                    # /dev/null) or delete files (new file is
-                    # /dev/null).
-                    assert( patchObj.getFileName() == filename )
-                else:
-                    patchObj.setFileName(filename)
+        else:
+            # A patch can have lots of lines in it that are added
+            # by tools like GIT.  These lines have no particular
+            # format, other than the fact that they are not within
+            # hunks.
+            pass
 
-            elif line.startswith('--- /dev/null'):
-                if patchObj is None:
-                    patchObj = Patch()
 
-                patchObj._isNewFile = True
+    assert(patchObj is None)
 
-            elif line.startswith('--- '):
-                filename = line.split()[1]
 
-                if patchObj is None:
-                    patchObj = Patch()
+class PatchSection:
+    """
+    The hunks in a patch file that follow one file header, as found by
+    indexSections().  start and end are the byte offsets of the section
+    in the file, and headers the (oldStart, oldLength, newStart,
+    newLength) of each of its hunks.  patches is None until the section
+    has been parsed.
+    """
 
-                if patchObj.getFileName() is not None:
-                    assert( patchObj.getFileName() == filename )
-                else:
-                    patchObj.setFileName(filename)
+    __slots__ = ("fileName", "isNewFile", "start", "end", "headers", "patches")
 
-            elif line.startswith('@@ '):
-                contextline = line[2:].split(" @@ ")[-1]
+    def __init__(self, start):
+        self.fileName = None
+        self.isNewFile = False
+        self.start = start
+        self.end = None
+        self.headers = []
+        self.patches = None
 
-                if patchObj is None:
-                    patchObj = Patch()
 
-                if patchObj.getFileName() is None:
-                    patchObj.setFileName(oldPatchObj.getFileName())
+class HunkHeader:
+    """
+    Stands in for a Patch that hasn't been parsed (see
+    PatchFile.hunksFor()), with only what the headers say about it.
+    """
 
-                patchObj.setLinesChanged(line)
-                hunkRemaining = [patchObj._oldLength, patchObj._newLength]
+    __slots__ = ("_fileName", "_oldStart", "_oldLength", "_newStart", "_newLength", "_isNewFile")
 
-                patchObj.addLines(
-                    natureOfChange.CONTEXT,
-                    contextline,
-                )
+    def __init__(self, fileName, header, isNewFile):
+        self._fileName = fileName
+        self._oldStart, self._oldLength, self._newStart, self._newLength = header
+        self._isNewFile = isNewFile
 
-            else:
-                # A patch can have lots of lines in it that are added
-                # by tools like GIT.  These lines have no particular
-                # format, other than the fact that they are not within
-                # hunks.
-                pass
+    def getFileName(self):
+        return self._fileName
+
+    def isNewFile(self):
+        return self._isNewFile
 
-        assert(patchObj is None)
+    def getLinesChanged(self):
+        return (self._oldStart, self._oldLength, self._newStart, self._newLength)
+
+
+def _headerName(line):
+    """
+    Returns the file name iterHunks() takes from a "--- " or "+++ " line,
+    or None for /dev/null.
+    """
+    if line.startswith(b'--- /dev/null') or line.startswith(b'+++ /dev/null'):
+        return None
+    name = line.split()[1].decode(locale.getpreferredencoding(False))
+    if line.startswith(b'--- a/') or line.startswith(b'+++ b/'):
+        name = name[2:]
+    return name
+
+
+# The lines indexSections() stops at; the lines in between are only
+# counted.
+_HEADER_START = (b"--- ", b"+++ ", b"@@ ")
+_HEADER_LINES = tuple(b"\n" + start for start in _HEADER_START)
+
+
+def _countLines(data, start, end):
+    """
+    Returns how many of the old and new lines of a hunk the lines of data
+    from start up to end are.
+    """
+    # Each line is counted by the newline before it.
+    chunk = data[start - 1:end] if start > 0 else b"\n" + data[:end]
+    context = chunk.count(b"\n ")
+    return chunk.count(b"\n-") + context, chunk.count(b"\n+") + context
+
+
+def _skipHunk(data, position, old, new):
+    """
+    Returns the offset just after the lines of a hunk that starts at
+    position in data and has old and new lines, or None if the hunk is
+    broken, going one line at a time.
+    """
+    while old > 0 or new > 0:
+        if position >= len(data):
+            return None
+        end = data.find(b"\n", position)
+        if end == -1:
+            end = len(data)
+        removed, added = _countLines(data, position, end)
+        old -= removed
+        new -= added
+        if old < 0 or new < 0:
+            return None
+        position = end + 1
+    return position
+
+
+def indexSections(data):
+    """
+    Finds the file sections of a patch and the headers of their hunks in
+    data (the bytes of the patch, or an mmap of it).  Only the lines that
+    may be headers are looked at; the lines of the hunks in between are
+    counted with bytes.count(), one hunk at a time, rather than parsed.
+
+    Returns a list of PatchSections, or None for anything iterHunks()
+    would parse differently from the sections one at a time or would
+    reject (carriage returns, headers without hunks, broken hunks), so
+    that the whole file is parsed and any error reported as before.
+    """
+    if data.find(b"\r") != -1:
+        return None
+
+    sections = []
+    section = None
+    # The offset of the lines of the last hunk that haven't been counted
+    # yet, and how many old and new lines are still to come, while the
+    # end of the hunk hasn't been found.
+    hunk = None
+    position = 0
+    size = len(data)
+    # Where the next line starting with each of _HEADER_START is, found
+    # with bytes.find(), which is quicker than any regular expression.
+    following = [-1, -1, -1]
+    while True:
+        if position == 0 and data[:4].startswith(_HEADER_START):
+            start = 0
+        else:
+            for i, header in enumerate(_HEADER_LINES):
+                if following[i] != size and following[i] < position:
+                    found = data.find(header, max(position - 1, 0))
+                    following[i] = found + 1 if found != -1 else size
+            start = min(following)
+        match = start < size
+        end = data.find(b"\n", start)
+        if end == -1:
+            end = size
+
+        if hunk is not None:
+            lines, old, new = hunk
+            removed, added = _countLines(data, lines, start)
+            if old - removed > 0 or new - added > 0:
+                if not match:
+                    return None
+                # The line is part of the hunk ("--- " is a removed "-- "
+                # line, say).
+                hunk = (start, old - removed, new - added)
+                position = end + 1
+                continue
+            if old - removed < 0 or new - added < 0:
+                # There are other "-", "+" or " " lines after the hunk,
+                # so look for where it ends line by line.
+                position = _skipHunk(data, lines, old, new)
+                hunk = None
+                if position is None:
+                    return None
+                continue
+            hunk = None
+
+        if not match:
+            break
+        line = data[start:end]
+        position = end + 1
+
+        if line.startswith(b"@@ "):
+            match = _HUNK_HEADER_BYTES.fullmatch(line)
+            if match is None or section is None or section.fileName is None:
+                return None
+            oldStart, oldLength, newStart, newLength = match.groups()
+            old = int(oldLength) if oldLength is not None else 1
+            new = int(newLength) if newLength is not None else 1
+            if old == 0 and new == 0:
+                return None
+            section.headers.append((int(oldStart), old, int(newStart), new))
+            hunk = (position, old, new)
+            continue
+
+        if section is None or section.headers:
+            if section is not None:
+                section.end = start
+            section = PatchSection(start)
+            sections.append(section)
+        try:
+            name = _headerName(line)
+        except (IndexError, UnicodeDecodeError):
+            return None
+        if name is None:
+            section.isNewFile = section.isNewFile or line.startswith(b"---")
+        elif section.fileName is None:
+            section.fileName = name
+        elif section.fileName != name:
+            return None
+
+    if section is not None and not section.headers:
+        return None
+    if section is not None:
+        section.end = size
+    return sections
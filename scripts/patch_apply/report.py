@@ -0,0 +1,81 @@
+import json
+
+
+# The policies for --batch.
+AUTO_APPLY = "auto-apply"
+NEVER_APPLY = "never-apply"
+REPORT_ONLY = "report-only"
+POLICIES = [AUTO_APPLY, NEVER_APPLY, REPORT_ONLY]
+
+
+class Report:
+    """
+    Writes a JSON object on its own line (NDJSON) to stream for every
+    hunk of a patch as soon as what happens to the hunk is known, so
+    that a program reading the output doesn't have to wait for the whole
+    patch.  If stream is None nothing is written.
+
+    Every record has the patch, the subpatch name (file:line), the file
+    and the status.  Depending on the status, records also have:
+
+    percentages: the percentage of added lines applied, removed lines
+        applied and context lines found
+    match_line: the line the hunk was matched to
+    context_message: why the context does or doesn't allow the hunk to
+        be applied
+    """
+
+    def __init__(self, stream, pathToPatch):
+        self.stream = stream
+        self.pathToPatch = pathToPatch
+        # Details found while analysing a hunk whose record is only
+        # written once it has been applied (or not), by subpatch name.
+        self.pending = {}
+
+    def write(self, record):
+        if self.stream is None:
+            return
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+    def patch(self, status, **fields):
+        """
+        Writes a record for the whole patch, for when it can't be split
+        into hunks (a corrupt or binary patch).
+        """
+        record = {"patch": self.pathToPatch, "subpatch": None, "status": status}
+        record.update(fields)
+        self.write(record)
+
+    def note(self, subpatch, **fields):
+        """
+        Remembers fields for the record of subpatch, which is written
+        later by hunk().
+        """
+        self.pending.setdefault(subpatch, {}).update(fields)
+
+    def hunk(self, subpatch, fileName, status, **fields):
+        record = {
+            "patch": self.pathToPatch,
+            "subpatch": subpatch,
+            "file": fileName,
+            "status": status,
+        }
+        record.update(self.pending.pop(subpatch, {}))
+        record.update(fields)
+        self.write(record)
+
+    def matched(self, subpatch, fileName, status, percentages, match_line, context_message):
+        fields = {
+            "percentages": {
+                "added": percentages[0],
+                "removed": percentages[1],
+                "context": percentages[2],
+            },
+            "match_line": match_line,
+            "context_message": context_message,
+        }
+        if status is None:
+            self.note(subpatch, **fields)
+        else:
+            self.hunk(subpatch, fileName, status, **fields)
@@ -0,0 +1,129 @@
+import os
+import re
+import tempfile
+import email.header
+
+import scripts.patch_apply.patchParser as parse
+
+
+# The line that starts each message of an mbox, as git format-patch
+# (and mail programs) write it: the commit (or sender) and an asctime()
+# date.  Lines of a diff always start with " ", "+" or "-", so this can't
+# be one of them.
+FROM_LINE = re.compile(rb"From \S+ +\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4}\s*$")
+# The number git format-patch puts at the start of the file names.
+SERIES_NUMBER = re.compile(r"^[0-9]+")
+
+
+class Message:
+    """
+    One patch of a series.  number is where it is in the series (counting
+    from 1), path the file the patch is in, and name what it is called in
+    the output and the batch records.
+    """
+
+    __slots__ = ("number", "subject", "path", "name")
+
+    def __init__(self, number, subject, path, name):
+        self.number = number
+        self.subject = subject
+        self.path = path
+        self.name = name
+
+
+def iter_messages(fileObj):
+    """
+    Generator that splits an mbox (a file opened in binary mode) into its
+    messages, and yields the lines of each one as soon as the line
+    starting the next one has been read.  Anything before the first
+    message (all of a plain patch) is a message of its own.
+    """
+    lines = []
+    for line in fileObj:
+        if FROM_LINE.match(line) and lines:
+            if any(text.strip() for text in lines):
+                yield lines
+            lines = []
+        lines.append(line)
+
+    if any(text.strip() for text in lines):
+        yield lines
+
+
+def subject(lines):
+    """
+    Returns the Subject header of a message, or None if it has none.
+    """
+    found = None
+    for line in lines:
+        if line.strip() == b"":
+            # The end of the headers.
+            break
+        if found is not None and line[:1] in (b" ", b"\t"):
+            found += b" " + line.strip()
+        elif found is not None:
+            break
+        elif line.lower().startswith(b"subject:"):
+            found = line[len(b"subject:"):].strip()
+
+    if found is None:
+        return None
+    text = found.decode("utf-8", "replace")
+    try:
+        # "=?UTF-8?q?...?=" and the like.
+        return str(email.header.make_header(email.header.decode_header(text)))
+    except (ValueError, LookupError):
+        return text
+
+
+def _series_order(name):
+    number = SERIES_NUMBER.match(name)
+    if number is None:
+        return (1, 0, name)
+    return (0, int(number.group()), name)
+
+
+def iter_series(path):
+    """
+    Generator that yields the patches of a series as Messages, in the
+    order of the series.  path is either an mbox, such as git
+    format-patch --stdout writes, which is read one message at a time,
+    each message being written to a temporary file that is removed once
+    the next one is asked for, or a directory of git format-patch files,
+    taken in the order of their numbers.
+    """
+    if os.path.isdir(path):
+        names = [
+            name for name in sorted(os.listdir(path), key=_series_order)
+            if not name.endswith("~") and os.path.isfile(os.path.join(path, name))
+        ]
+        for number, name in enumerate(names, 1):
+            pathToPatch = os.path.join(path, name)
+            with open(pathToPatch, "rb") as fileObj:
+                # Only the headers are needed.
+                headers = []
+                for line in fileObj:
+                    headers.append(line)
+                    if line.strip() == b"":
+                        break
+            yield Message(number, subject(headers) or name, pathToPatch, pathToPatch)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="applyplus-series-") as tmpdir:
+        with open(path, "rb") as fileObj:
+            for number, lines in enumerate(iter_messages(fileObj), 1):
+                pathToPatch = os.path.join(tmpdir, "%04d.patch" % number)
+                with open(pathToPatch, "wb") as patchObj:
+                    patchObj.writelines(lines)
+                name = "%s:%d" % (path, number)
+                yield Message(number, subject(lines) or name, pathToPatch, name)
+                os.remove(pathToPatch)
+
+
+def changed_files(pathToPatch):
+    """
+    Returns the names of the files the patch changes, from its headers
+    alone.
+    """
+    hunks = parse.PatchFile(pathToPatch).hunksFor(lambda fileName: False)
+    return {hunk.getFileName() for hunk in hunks}
@@ -1,6 +1,8 @@
 import scripts.patch_apply.patchParser as parse
 import scripts.patch_match.test_match as match
 import scripts.patch_context.slice_and_parse as slice
+import scripts.overlay as overlay
+import scripts.trace as trace
 import diff_match_patch as dmp_module
 import re, os
 from scripts.enums import CONTEXT_DECISION, MatchStatus
@@ -28,7 +30,17 @@ class ContextResult:
         self.is_comment = is_comment
 
 
-def context_changes(sub_patch, expand=False):
+def unsupported_result():
+    return ContextResult(
+        CONTEXT_DECISION.DONT_RUN.value,
+        "The extension of the file the patch refers to is not supported by srcML",
+        None,
+        False,
+    )
+
+
+@trace.traced("context_changes")
+def context_changes(sub_patch, expand=False, slices=None):
     """
     context_changes(str): takes in a sub-patch and
         returns a ContextResult object that determines
@@ -36,11 +48,14 @@ def context_changes(sub_patch, expand=False):
         message that can be shown to users
 
     patch_file_path: string representing the path to a patch file
+
+    slices: optional slice.SliceBatch shared by all of the sub-patches
+        in a run, so the files are sliced together
     """
 
     file_path = os.path.join( os.getcwd(), sub_patch.getFileName() )
 
-    if not os.path.exists(file_path):
+    if not overlay.exists(file_path):
         if not sub_patch.isNewFile():
             return ContextResult(
                 CONTEXT_DECISION.DONT_RUN.value,
@@ -56,16 +71,17 @@ def context_changes(sub_patch, expand=False):
                 False,
             )
 
-    file_slice = slice.SliceParser(file_path)
-    file_slice_parsed = file_slice.slice_parse()
+    if not slice.is_supported(file_path):
+        return unsupported_result()
 
-    if not file_slice_parsed:
-        return ContextResult(
-            CONTEXT_DECISION.DONT_RUN.value,
-            "The extension of the file the patch refers to is not supported by srcML",
-            None,
-            False,
-        )
+    # Slicing is expensive and only a few of the rules below need to know
+    # about variables, so it is put off until one of them asks.
+    if overlay.isModified(file_path):
+        # The file has been changed by an earlier hunk that hasn't been
+        # written yet, so slice what is in the overlay.
+        file_slice = slice.LazySlice(file_path, text=overlay.read(file_path).text)
+    else:
+        file_slice = slice.LazySlice(file_path, slices)
 
     diff_file_patch = match.find_diffs(
         sub_patch,
@@ -217,6 +233,10 @@ def context_changes(sub_patch, expand=False):
                 return context_result
 
             elif unchanged_diff.rstrip().endswith("="):
+                file_slice_parsed = file_slice.get()
+                if not file_slice_parsed:
+                    return unsupported_result()
+
                 # dissect the context line to determine type
                 function_name = context_diff.function_for_patch
 
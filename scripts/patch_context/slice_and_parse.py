@@ -1,7 +1,10 @@
 import os, subprocess, threading, sys
-import tempfile as tfile
+import io
 import re
-from enum import Enum
+import shutil
+import hashlib
+import scripts.trace as trace
+from scripts.cache import DiskCache, cache_dir
 
 src_slice_path = os.path.dirname(os.path.abspath(__file__))
 if sys.platform.startswith("darwin"):
@@ -9,94 +12,460 @@ if sys.platform.startswith("darwin"):
 else:
     src_slice_path += "/srcSliceBuilds/ubuntu/srcslice-ubuntu"
 
-class RunWithTimeout(object):
-    def __init__(self, cmd):
-        self.cmd = cmd
-        self.process = None
-        self.out = None
-        self.err = None
+# Bump this whenever the layout of the parsed slice dictionary changes so
+# that stale cache entries are ignored.
+SLICE_FORMAT_VERSION = 1
+SLICE_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
-    def run(self, timeout):
-        def target():
-            self.process = subprocess.Popen( args=self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
-            self.out, self.err = self.process.communicate()
+# Seconds to wait for srcml and srcslice to finish with one file, and the
+# extra time allowed for each additional file in a batch.
+SLICE_TIMEOUT = 120
+SLICE_TIMEOUT_PER_FILE = 30
 
-        thread = threading.Thread(target=target)
-        thread.start()
 
-        for i in range(0, timeout, 5):
-            thread.join(5)
-            if not thread.is_alive():
-                break
+def tool_version():
+    """
+    Returns a string identifying the srcml and srcslice binaries in use.
+    The binaries are identified by their location, size and modification
+    time so that no process has to be started to find out their version.
+    """
+    global _tool_version
+    if _tool_version is None:
+        fields = [str(SLICE_FORMAT_VERSION)]
+        for tool in [shutil.which("srcml"), src_slice_path]:
+            if tool is None:
+                fields.append("missing")
+                continue
+            tool = os.path.realpath(tool)
+            try:
+                stat = os.stat(tool)
+                fields.append(f"{tool}:{stat.st_size}:{stat.st_mtime_ns}")
+            except OSError:
+                fields.append(f"{tool}:missing")
+        _tool_version = ";".join(fields)
+    return _tool_version
 
-            print( f"Waited {i} seconds for {self.cmd} to exit." )
+_tool_version = None
+
+
+class SliceCache(DiskCache):
+    """
+    Persistent cache of parsed slices.  Entries are keyed on a hash of
+    the contents of the sliced file and the version of the tools, so the
+    same file in different trees (or in the same tree for different
+    hunks) only gets sliced once.
+    """
+
+    def __init__(self, directory=None, max_bytes=SLICE_CACHE_MAX_BYTES):
+        if directory is None:
+            directory = cache_dir("slices")
+        super().__init__(directory, max_bytes)
+
+    def key(self, file, text=None):
+        """
+        Returns the key for file.  If text is given it is used as the
+        contents of the file instead of what is on disk.
+        """
+        digest = hashlib.sha256()
+        digest.update(tool_version().encode("utf-8"))
+        digest.update(b"\0")
+        # The extension decides which language srcml parses the file as.
+        digest.update(os.path.splitext(file)[1].encode("utf-8"))
+        digest.update(b"\0")
+        if text is not None:
+            digest.update(text.encode("utf-8", errors="surrogateescape"))
+        else:
+            with open(file, "rb") as fileObj:
+                for block in iter(lambda: fileObj.read(1 << 16), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+
+def default_cache():
+    """
+    Returns the slice cache shared by every SliceParser, or None if the
+    cache has been disabled by setting APPLYPLUS_SLICE_CACHE=0.
+    """
+    global _default_cache
+    if os.environ.get("APPLYPLUS_SLICE_CACHE", "1") == "0":
+        return None
+    if _default_cache is None:
+        _default_cache = SliceCache()
+    return _default_cache
+
+_default_cache = None
 
-        if thread.is_alive():
-            print( f"Timeout waiting for {self.cmd} to exit." )
-            self.process.terminate()
-            thread.join()
-            self.err += f"Timeout waiting for {self.cmd} to exit.".encode('ascii')
 
 class SliceParser:
-    def __init__(self, file):
+    def __init__(self, file, cache=True, text=None):
+        """
+        text: the contents to slice, if they aren't what is on disk (the
+            file has been changed in the overlay)
+        """
         self.file = file
+        self.text = text
+        if cache is True:
+            cache = default_cache()
+        self.cache = cache
+
+    def cache_key(self):
+        """
+        Returns the key for this file in the slice cache, or None if the
+        file is not cached.
+        """
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.key(self.file, self.text)
+        except OSError:
+            return None
 
     def slice_parse(self):
+        key = self.cache_key()
+        if key is not None:
+            slice_dict = self.cache.get(key)
+            if slice_dict is not None:
+                return slice_dict
 
-        srcml = RunWithTimeout(["srcml", f"{self.file}", "--position"])
-        srcml.run(timeout=120)
+        if self.text is not None:
+            sliced = slice_files([self.file], text=self.text)
+        else:
+            sliced = slice_files([self.file])
+        slice_dict = sliced[self.file] if sliced is not None else None
 
-        if srcml.err:
-            return None
+        if key is not None and slice_dict is not None:
+            self.cache.put(key, slice_dict)
+
+        return slice_dict
+
+
+class LazySlice:
+    """
+    Stands in for the slices of a file without running anything.  The
+    file is only sliced (through the batch, if one is given) the first
+    time get() is called, and the result is remembered after that.
+    """
+
+    def __init__(self, file, batch=None, text=None):
+        self.file = file
+        self.batch = batch
+        self.text = text
+        self.sliced = False
+        self.slice_dict = None
+
+    def get(self):
+        if not self.sliced:
+            if self.batch is not None and self.text is None:
+                self.slice_dict = self.batch.get(self.file)
+            else:
+                self.slice_dict = SliceParser(self.file, text=self.text).slice_parse()
+            self.sliced = True
+        return self.slice_dict
+
+
+class SliceBatch:
+    """
+    Collects every file that is going to be sliced during a run so that
+    they can all be converted with one srcml invocation and sliced with
+    one srcslice invocation, instead of starting two processes for every
+    hunk.  The pending files are sliced the first time any of them is
+    asked for.
+    """
+
+    def __init__(self, cache=True):
+        if cache is True:
+            cache = default_cache()
+        self.cache = cache
+        self.pending = []
+        self.results = {}
+
+    def add(self, file):
+        file = os.path.abspath(file)
+        if file not in self.results and file not in self.pending:
+            self.pending.append(file)
+
+    def get(self, file):
+        """
+        Returns the slice dictionary for the file, or None if it could
+        not be sliced.
+        """
+        file = os.path.abspath(file)
+        if file not in self.results:
+            self.add(file)
+            self.run()
+        return self.results.get(file)
+
+    def run(self):
+        pending, self.pending = self.pending, []
+        keys = {}
+        to_slice = []
+
+        for file in pending:
+            parser = SliceParser(file, cache=self.cache)
+            key = parser.cache_key()
+            if key is not None:
+                slice_dict = self.cache.get(key)
+                if slice_dict is not None:
+                    trace.count("slice cache hits")
+                    self.results[file] = slice_dict
+                    continue
+
+            keys[file] = key
+            if is_supported(file) and os.path.isfile(file):
+                to_slice.append(file)
+            else:
+                self.results[file] = None
+
+        if not to_slice:
+            return
+
+        sliced = slice_files(to_slice)
+        if sliced is None:
+            # One bad file makes srcml fail for the whole archive, so
+            # fall back to slicing the files one at a time.
+            sliced = {}
+            for file in to_slice:
+                single = slice_files([file])
+                sliced[file] = single[file] if single is not None else None
+
+        stored = False
+        for file in to_slice:
+            slice_dict = sliced.get(file)
+            self.results[file] = slice_dict
+            if keys[file] is not None and slice_dict is not None:
+                # The cache is trimmed once, after the whole batch.
+                self.cache.put(keys[file], slice_dict, evict=False)
+                stored = True
+        if stored:
+            self.cache.evict()
 
-        fd, path = tfile.mkstemp(suffix=".xml", prefix="temp")
-        try:
-            with os.fdopen(fd, "w") as tmpo:
-                tmpo.write(str(srcml.out, "utf-8"))
 
-            srcslice = RunWithTimeout([src_slice_path, f"{path}"])
-            srcslice.run(timeout=120)
+# Extensions that srcml knows how to parse, and the language srcml has to
+# be told when the file is read from its standard input.
+SRCML_LANGUAGES = {
+    ".c": "C", ".h": "C", ".i": "C",
+    ".cpp": "C++", ".cp": "C++", ".hpp": "C++", ".cxx": "C++",
+    ".hxx": "C++", ".cc": "C++", ".hh": "C++", ".c++": "C++",
+    ".h++": "C++", ".tcc": "C++", ".ipp": "C++",
+    ".cs": "C#",
+    ".java": "Java", ".aj": "Java",
+}
+SRCML_EXTENSIONS = set(SRCML_LANGUAGES)
 
-            # Remove the "Time is: ...." line from the error output.
-            srcslice.err = re.sub(b'Time is: [0-9.]*\n', b'', srcslice.err)
+def is_supported(file):
+    return os.path.splitext(file)[1].lower() in SRCML_EXTENSIONS
 
-            if srcslice.err:
-                return None
 
-            str_out = srcslice.out.decode("utf-8")
-            slice_dict = {}
-            for line in str_out.splitlines():
+def split_slice_line(line):
+    """
+    Splits a line of srcslice output into its fields (see SliceFields).
+    Returns None if the line is not a slice.
+    """
 
-                # TODO: observe issue that arrises for patch CVE-2014-9710
+    # TODO: observe issue that arrises for patch CVE-2014-9710
 
-                file_data = re.split(",\s*(?![^{}]*\})", line)
-                if len(file_data) == 8:
+    file_data = re.split(r",\s*(?![^{}]*\})", line)
+    if len(file_data) != 8:
+        return None
+    return file_data
 
-                    slice_dict[file_data[1]] = {}
 
-                    slice_dict[file_data[1]][file_data[2]] = []
+def add_slice(slice_dict, file_data):
+    slice_dict[file_data[1]] = {}
 
-                    slice_dict[file_data[1]][file_data[2]].append(file_data[0])
-                    slice_dict[file_data[1]][file_data[2]].append(file_data[1])
-                    slice_dict[file_data[1]][file_data[2]].append(file_data[2])
+    slice_dict[file_data[1]][file_data[2]] = []
 
-                    slice_dict[file_data[1]][file_data[2]].append(
-                        (file_data[3].split("{", 1)[1].split("}")[0])
-                    )
-                    slice_dict[file_data[1]][file_data[2]].append(
-                        (file_data[4].split("{", 1)[1].split("}")[0])
-                    )
-                    slice_dict[file_data[1]][file_data[2]].append(
-                        (file_data[5].split("{", 1)[1].split("}")[0])
-                    )
-                    slice_dict[file_data[1]][file_data[2]].append(
-                        (file_data[6].split("{", 1)[1].split("}")[0])
-                    )
-                    slice_dict[file_data[1]][file_data[2]].append(
-                        (file_data[7].split("{", 1)[1].rsplit("}", 1)[0])
-                    )
+    slice_dict[file_data[1]][file_data[2]].append(file_data[0])
+    slice_dict[file_data[1]][file_data[2]].append(file_data[1])
+    slice_dict[file_data[1]][file_data[2]].append(file_data[2])
 
-            return slice_dict
+    slice_dict[file_data[1]][file_data[2]].append(
+        (file_data[3].split("{", 1)[1].split("}")[0])
+    )
+    slice_dict[file_data[1]][file_data[2]].append(
+        (file_data[4].split("{", 1)[1].split("}")[0])
+    )
+    slice_dict[file_data[1]][file_data[2]].append(
+        (file_data[5].split("{", 1)[1].split("}")[0])
+    )
+    slice_dict[file_data[1]][file_data[2]].append(
+        (file_data[6].split("{", 1)[1].split("}")[0])
+    )
+    slice_dict[file_data[1]][file_data[2]].append(
+        (file_data[7].split("{", 1)[1].rsplit("}", 1)[0])
+    )
 
+
+def match_slices(lines, files):
+    """
+    Generator that turns lines of srcslice output into (file, fields)
+    pairs, where file is the one of the sliced files the slice belongs
+    to.  Lines that aren't slices, or that belong to none of the files,
+    are dropped.
+    """
+    by_path = {os.path.normpath(os.path.abspath(file)): file for file in files}
+
+    for line in lines:
+        file_data = split_slice_line(line)
+        if file_data is None:
+            continue
+
+        if len(files) == 1:
+            file = files[0]
+        else:
+            file = by_path.get(os.path.normpath(os.path.abspath(file_data[0])))
+            if file is None:
+                continue
+        yield file, file_data
+
+
+class SliceError(Exception):
+    pass
+
+
+class SlicePipeline:
+    """
+    Runs srcml with its output connected straight to the input of
+    srcslice, so the srcML document is never held in memory or written to
+    disk.  Iterating over the pipeline yields the lines srcslice prints as
+    soon as they are produced.  SliceError is raised once the output has
+    been consumed if either tool failed or timed out.
+    """
+
+    def __init__(self, files, timeout=SLICE_TIMEOUT, text=None):
+        """
+        text: if given, srcml reads the contents of the (single) file from
+            its standard input instead of from disk
+        """
+        self.files = files
+        self.timeout = timeout
+        self.text = text
+        self.timed_out = False
+
+    def __iter__(self):
+        if self.text is None:
+            srcml_cmd = ["srcml"] + [f"{file}" for file in self.files] + ["--position"]
+        else:
+            file = self.files[0]
+            language = SRCML_LANGUAGES.get(os.path.splitext(file)[1].lower())
+            if language is None:
+                raise SliceError(f"srcML does not support {file}")
+            srcml_cmd = ["srcml", "-l", language, f"--filename={file}", "--position"]
+        # srcslice only takes a file name, so hand it the pipe.
+        srcslice_cmd = [src_slice_path, "/dev/stdin"]
+
+        try:
+            srcml = subprocess.Popen(
+                srcml_cmd,
+                stdin=subprocess.DEVNULL if self.text is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            raise SliceError(f"Unable to run {srcml_cmd}: {e}")
+
+        if self.text is not None:
+            def feed():
+                try:
+                    srcml.stdin.write(self.text.encode("utf-8", errors="surrogateescape"))
+                    srcml.stdin.close()
+                except OSError:
+                    pass
+            writer = threading.Thread(target=feed)
+            writer.start()
+
+        try:
+            srcslice = subprocess.Popen(
+                srcslice_cmd,
+                stdin=srcml.stdout,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            srcml.kill()
+            srcml.wait()
+            if self.text is not None:
+                writer.join()
+            raise SliceError(f"Unable to run {srcslice_cmd}: {e}")
+
+        # Only srcslice should hold the read end of the pipe, so that
+        # srcml gets SIGPIPE if srcslice goes away.
+        srcml.stdout.close()
+
+        # The tools are timed from here until both have exited, below.
+        span = trace.span("srcml | srcslice", "process", files=len(self.files))
+        span.__enter__()
+
+        # Drain stderr on the side so neither tool blocks on a full pipe.
+        errors = {srcml: [], srcslice: []}
+        readers = []
+        for process in errors:
+            reader = threading.Thread(
+                target=lambda p=process: errors[p].append(p.stderr.read())
+            )
+            reader.start()
+            readers.append(reader)
+
+        def kill():
+            self.timed_out = True
+            print( f"Timeout waiting for {srcml_cmd} | {srcslice_cmd} to exit." )
+            for process in errors:
+                process.kill()
+
+        timer = threading.Timer(self.timeout, kill)
+        timer.start()
+        try:
+            with io.TextIOWrapper(srcslice.stdout, encoding="utf-8", errors="replace") as out:
+                for line in out:
+                    yield line.rstrip("\n")
         finally:
-            os.remove(path)
+            timer.cancel()
+            for process in errors:
+                if process.poll() is None and self.timed_out:
+                    process.kill()
+                process.wait()
+            for reader in readers:
+                reader.join()
+            if self.text is not None:
+                writer.join()
+            span.__exit__(None, None, None)
+
+        if self.timed_out:
+            raise SliceError(f"Timeout waiting for {srcml_cmd} | {srcslice_cmd} to exit.")
+
+        srcml_err = b"".join(errors[srcml])
+        # Remove the "Time is: ...." line from the error output.
+        srcslice_err = re.sub(b'Time is: [0-9.]*\n', b'', b"".join(errors[srcslice]))
+
+        if srcml.returncode != 0 or srcml_err:
+            raise SliceError(srcml_err.decode("utf-8", errors="replace"))
+        if srcslice.returncode != 0 or srcslice_err:
+            raise SliceError(srcslice_err.decode("utf-8", errors="replace"))
+
+
+def iter_slices(files, text=None):
+    """
+    Generator that slices the files and yields (file, fields) pairs as
+    srcslice produces them, so the first functions are available before
+    the whole of the input has been sliced.  Raises SliceError if the
+    tools fail.
+    """
+    timeout = SLICE_TIMEOUT + SLICE_TIMEOUT_PER_FILE * (len(files) - 1)
+    return match_slices(SlicePipeline(files, timeout, text=text), files)
+
+
+def slice_files(files, text=None):
+    """
+    Converts all of the files to a single srcML archive and runs srcslice
+    over it.  Returns a dictionary mapping each file to its slices, or
+    None if srcml or srcslice failed.  If text is given, it is sliced as
+    the contents of the one file in files.
+    """
+    slice_dicts = {file: {} for file in files}
+    with trace.span("slice_files", files=len(files)):
+        try:
+            for file, file_data in iter_slices(files, text=text):
+                add_slice(slice_dicts[file], file_data)
+        except SliceError:
+            return None
+    return slice_dicts
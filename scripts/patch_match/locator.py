@@ -0,0 +1,218 @@
+import scripts.patch_match.similarity as similarity
+import scripts.trace as trace
+
+
+# A window is accepted if its lines are at least this similar to the
+# lines looked for, once weighted and with the distance taken off.
+MIN_SCORE = 0.5
+# Lines less similar than this aren't paired up at all, the same as
+# test_match.LEVENSHTEIN_RATIO.
+MIN_LINE_RATIO = 0.8
+# How much being far from where the hunk is expected counts against a
+# window: up to PROXIMITY_WEIGHT, reached at distance lines away.
+PROXIMITY_WEIGHT = 0.1
+DEFAULT_DISTANCE = 1000
+# A window is this many lines longer than the lines looked for, to allow
+# for lines added since (the same as test_match.PATCH_LENGTH_BUFFER).
+EXTRA_LINES = 10
+# A line looked for is only paired with the lines of the window up to
+# this many lines above or below where it would be if nothing had
+# changed.
+BAND = EXTRA_LINES
+# Only the windows suggested by the most anchors are scored.
+MAX_CANDIDATES = 50
+# If no anchor gives a good enough window, every window up to this many
+# lines either side of where the hunk is expected is scored, but no more
+# than SCAN_LINES lines in all for each line looked for.
+SCAN_DISTANCE = 200
+SCAN_LINES = 2000
+# Long lines say more about where the hunk is than short ones, up to a
+# point.
+MAX_WEIGHT = 80
+
+
+class _Window:
+    """
+    Scores windows of a file against the (stripped) lines of a hunk.
+    Blank lines of the hunk are left out, and the similarities of the
+    lines to the lines of the windows are worked out together, before
+    the windows are scored (see prepare()).
+    """
+
+    def __init__(self, search_lines, source):
+        self.source = source
+        self.length = len(search_lines)
+        # (index in search_lines, line, weight) of the lines that count.
+        self.lines = [
+            (i, line, min(len(line), MAX_WEIGHT))
+            for i, line in enumerate(search_lines) if line
+        ]
+        self.total = sum(weight for _, _, weight in self.lines)
+        # ratios[k][file line]: the similarity of lines[k] to a (stripped)
+        # line of the file.
+        self.ratios = [{} for line in self.lines]
+        # How many windows were scored, for the trace.
+        self.scored = 0
+
+    def prepare(self, starts):
+        """
+        Works out the similarities needed to score the windows starting
+        at starts that haven't been worked out yet.
+        """
+        if not self.lines:
+            return
+        stripped = self.source.stripped
+        known = self.ratios[0]
+        columns = set()
+        for start in starts:
+            columns.update(stripped[start:start + self.length + EXTRA_LINES])
+        columns = [line for line in columns if line not in known]
+        if not columns:
+            return
+
+        rows = similarity.matrix([line for _, line, _ in self.lines], columns)
+        for ratios, row in zip(self.ratios, rows):
+            ratios.update(zip(columns, row))
+
+    def similarity(self, k, j):
+        ratio = self.ratios[k][self.source.stripped[j]]
+        return ratio if ratio >= MIN_LINE_RATIO else 0
+
+    def score(self, start):
+        """
+        Pairs the lines looked for with the lines of the window starting
+        at start, in order, so that the weighted similarity of the pairs
+        is as high as it can be.  Returns that (from 0 to 1) and where the
+        hunk starts according to the first pair, the start of the window
+        if nothing pairs up.
+
+        A line is only paired with the lines up to BAND lines away from
+        where it is in the hunk, so only that band of the table below is
+        worked out line by line.
+        """
+        self.scored += 1
+        end = min(start + self.length + EXTRA_LINES, len(self.source))
+        count = len(self.lines)
+        width = end - start
+        stripped = self.source.stripped
+
+        # best[k][j]: the best score for lines[k:] and the file lines
+        # start + j up to end.
+        best = [None] * count + [[0.0] * (width + 1)]
+        for k in range(count - 1, -1, -1):
+            offset, _, weight = self.lines[k]
+            ratios = self.ratios[k]
+            below = best[k + 1]
+            # Right of the band, line k can only be left out.
+            row = list(below)
+            lo = max(offset - BAND, 0)
+            hi = min(offset + BAND, width - 1)
+            for j in range(hi, lo - 1, -1):
+                value = max(below[j], row[j + 1])
+                ratio = ratios[stripped[start + j]]
+                if ratio >= MIN_LINE_RATIO:
+                    value = max(value, below[j + 1] + weight * ratio)
+                row[j] = value
+            # Left of it, only lines of the file can be.
+            if 0 < lo <= hi:
+                row[:lo] = [row[lo]] * lo
+            best[k] = row
+
+        # The first pair on the way to the best score.
+        k = j = 0
+        first = start
+        while k < count and j < width:
+            ratio = self.similarity(k, start + j) if abs(j - self.lines[k][0]) <= BAND else 0
+            if ratio and best[k][j] == best[k + 1][j + 1] + self.lines[k][2] * ratio:
+                first = max(start + j - self.lines[k][0], start)
+                break
+            if best[k][j] == best[k + 1][j]:
+                k += 1
+            else:
+                j += 1
+
+        return best[0][0] / self.total, first
+
+
+@trace.traced("locate")
+def candidates(search_lines, source, line_number, distance=DEFAULT_DISTANCE, k=1):
+    """
+    Finds where search_lines (the lines of a hunk, without their line
+    endings) could be in source, a SourceFile, allowing for lines that
+    have changed, been added or removed.  line_number (counting from 1)
+    is where the hunk is expected to start, and matches further away
+    from it score less, the more so the closer they are to distance lines
+    away.
+
+    Returns up to k (line number counting from 1, score) pairs, best
+    first, for places that don't overlap each other and score at least
+    MIN_SCORE.
+
+    Rather than searching the text character by character, lines that
+    are found unchanged in the file (anchors) each suggest where the hunk
+    starts.  The windows suggested the most, weighted by how rare the
+    anchor is, are all scored once, and only if none is good enough are
+    the windows around line_number scored instead.
+    """
+    window = _Window([line.strip() for line in search_lines], source)
+    if not window.total or not len(source):
+        return []
+
+    expected = min(max(line_number - 1, 0), len(source) - 1)
+    distance = max(distance, 1)
+
+    def ranked(starts):
+        # The best score for each place the windows say the hunk starts.
+        window.prepare(starts)
+        scores = {}
+        for start in starts:
+            value, first = window.score(start)
+            value -= PROXIMITY_WEIGHT * min(abs(first - expected) / distance, 1)
+            if value >= MIN_SCORE and value > scores.get(first, -1):
+                scores[first] = value
+        # Ties go to the closest match, and then to the one below.
+        return sorted(scores, key=lambda first: (
+            -scores[first], abs(first - expected), first < expected
+        )), scores
+
+    votes = {}
+    for i, line, weight in window.lines:
+        positions = source.positions(line)
+        for position in positions:
+            start = max(position - i, 0)
+            votes[start] = votes.get(start, 0) + weight / len(positions)
+
+    starts = sorted(votes, key=lambda start: (-votes[start], abs(start - expected)))
+    starts = set(starts[:MAX_CANDIDATES])
+    starts.add(expected)
+
+    order, scores = ranked(starts)
+    if not order:
+        scan = min(SCAN_DISTANCE, SCAN_LINES // len(window.lines))
+        order, scores = ranked(range(
+            max(expected - scan, 0),
+            min(expected + scan, len(source) - 1) + 1,
+        ))
+
+    # A place that overlaps a better one is the same match, give or take
+    # a line or two.
+    overlap = max(window.length // 2, 1)
+    found = []
+    for first in order:
+        if len(found) == k:
+            break
+        if all(abs(first - other) >= overlap for other, _ in found):
+            found.append((first, scores[first]))
+
+    trace.count("windows scored", window.scored)
+    return [(first + 1, value) for first, value in found]
+
+
+def locate(search_lines, source, line_number, distance=DEFAULT_DISTANCE):
+    """
+    Returns the line number (counting from 1) of the best place for
+    search_lines in source (see candidates()), or -1 if nothing is
+    similar enough.
+    """
+    found = candidates(search_lines, source, line_number, distance)
+    return found[0][0] if found else -1
@@ -0,0 +1,42 @@
+from rapidfuzz import process
+from rapidfuzz.distance import Indel
+
+import scripts.trace as trace
+
+# numpy is optional; without it every row of the matrix is worked out
+# with its own call instead of the whole matrix at once.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def matrix(rows, columns):
+    """
+    Returns ratios where ratios[i][j] is Levenshtein.ratio(rows[i],
+    columns[j]), worked out in C rather than one pair at a time.  Rows
+    that are the same string are only worked out once.
+    """
+    if not rows:
+        return []
+    if not columns:
+        return [[] for row in rows]
+
+    unique = list(dict.fromkeys(rows))
+    trace.count("levenshtein", len(unique) * len(columns))
+    if numpy is not None:
+        scores = process.cdist(
+            unique, columns, scorer=Indel.normalized_similarity, dtype=numpy.float64
+        ).tolist()
+    else:
+        scores = []
+        for row in unique:
+            ratios = [0.0] * len(columns)
+            for column, ratio, index in process.extract(
+                row, columns, scorer=Indel.normalized_similarity, limit=None
+            ):
+                ratios[index] = ratio
+            scores.append(ratios)
+
+    by_row = dict(zip(unique, scores))
+    return [by_row[row] for row in rows]
@@ -1,5 +1,11 @@
+import os
+import functools
 import diff_match_patch as dmp_module
 import scripts.patch_apply.patchParser as parse
+import scripts.overlay as overlay
+import scripts.trace as trace
+import scripts.patch_match.locator as locator
+import scripts.patch_match.similarity as similarity
 import Levenshtein
 from pygments.lexers import (
     CLexer,
@@ -20,6 +26,10 @@ does not always contain the entire patch, so our matched code is the section fro
 """
 PATCH_LENGTH_BUFFER = 10
 
+# How many of the places the locator finds for a hunk find_diffs compares
+# the hunk with.
+MATCH_CANDIDATES = 3
+
 
 class Retry:
     def __init__(self, retry_times, retry_interval):
@@ -79,6 +89,8 @@ class Diff:
         context_diffs=[],
         additional_lines=[],
         function_for_patch="",
+        match_count=0,
+        candidates=[],
     ):
 
         self.match_status = match_status
@@ -88,6 +100,10 @@ class Diff:
         self.context_diffs = context_diffs
         self.additional_lines = additional_lines
         self.function_for_patch = function_for_patch
+        # The number of lines of the patch found in the file, and the
+        # (line number, score) of every place the patch may be at.
+        self.match_count = match_count
+        self.candidates = candidates
 
 
 """
@@ -102,25 +118,117 @@ def calculate_plaintext_diff(patch_line, file_line):
     return diff_tokens
 
 
-def calculate_language_diff(patch_line, file_line, file_name):
+@functools.lru_cache(maxsize=None)
+def _lexer_for_name(name):
     try:
-        lexer = get_lexer_for_filename(file_name)
+        # Newlines are kept so that lines lexed together stay lined up
+        # with the text.
+        lexer = get_lexer_for_filename(name, stripnl=False)
         language = Diff.LineDiff.LanguageSpecificDiff.lexer_to_language[type(lexer)]
     except:
-        language = Language.NOT_SUPPORTED
+        return None, Language.NOT_SUPPORTED
+    return lexer, language
+
+
+def lexer_for_filename(file_name):
+    """
+    Returns the pygments lexer for the file and its language, or (None,
+    Language.NOT_SUPPORTED).  Finding the lexer means going through all of
+    them, so it is only done once for each file name.
+    """
+    return _lexer_for_name(os.path.basename(file_name))
+
+
+def tokenise_lines(lexer, lines):
+    """
+    Lexes lines (without their line endings) as one text, and returns the
+    tokens of each line.  A token that spans lines is split up between
+    them, and the newline ending each line stays with the token it was
+    part of, the same as when the line is lexed on its own.
+    """
+    tokens = [[] for line in lines]
+    row = 0
+    for token_type, value in lexer.get_tokens("\n".join(lines)):
+        parts = value.split("\n")
+        for part in parts[:-1]:
+            if row < len(tokens):
+                tokens[row].append((token_type, part + "\n"))
+            row += 1
+        if parts[-1] and row < len(tokens):
+            tokens[row].append((token_type, parts[-1]))
+    return tokens
+
+
+class WindowTokens:
+    """
+    The tokens of the lines of a hunk and of the lines of the file it was
+    matched to.  The lines the hunk expects to find, the lines it leaves
+    behind and the lines of the file are each lexed once, when the first
+    token is asked for, rather than line by line.
+    """
+
+    def __init__(self, file_name, patch_lines, file_lines):
+        self.file_name = file_name
+        self.lexer, self.language = lexer_for_filename(file_name)
+        self.patch_lines = patch_lines
+        self.file_lines = file_lines
+        self.patch_tokens = None
+        self.file_tokens = None
+
+    def _lex(self):
+        # The lines before the patch, then the lines added by it.
+        self.patch_tokens = [None] * len(self.patch_lines)
+        for kinds in (
+            (natureOfChange.CONTEXT, natureOfChange.REMOVED),
+            (natureOfChange.CONTEXT, natureOfChange.ADDED),
+        ):
+            indexes = [
+                idx for idx, line in enumerate(self.patch_lines) if line[0] in kinds
+            ]
+            lexed = tokenise_lines(
+                self.lexer, [self.patch_lines[idx][1].strip() for idx in indexes]
+            )
+            for idx, line_tokens in zip(indexes, lexed):
+                if self.patch_tokens[idx] is None:
+                    self.patch_tokens[idx] = line_tokens
+
+        self.file_tokens = tokenise_lines(
+            self.lexer, [line.strip() for line in self.file_lines]
+        )
+
+    def diff(self, patch_idx, file_idx):
+        """
+        Returns the LanguageSpecificDiff of line patch_idx of the hunk and
+        line file_idx of the window.
+        """
+        if self.language == Language.NOT_SUPPORTED:
+            return Diff.LineDiff.LanguageSpecificDiff()
+        if self.file_tokens is None:
+            self._lex()
+
+        return calculate_language_diff(
+            self.patch_lines[patch_idx][1].strip(),
+            self.file_lines[file_idx].strip(),
+            self.file_name,
+            patch_tokens=self.patch_tokens[patch_idx],
+            file_tokens=self.file_tokens[file_idx],
+        )
+
+
+def calculate_language_diff(patch_line, file_line, file_name, patch_tokens=None, file_tokens=None):
+    """
+    patch_tokens and file_tokens are the tokens of the lines if they have
+    already been lexed (see WindowTokens).
+    """
+    lexer, language = lexer_for_filename(file_name)
 
     if language == Language.NOT_SUPPORTED:
         return Diff.LineDiff.LanguageSpecificDiff()
 
-    patch_tokens = []
-    token_stream = lexer.get_tokens(patch_line)
-    for token in token_stream:
-        patch_tokens.append(token)
-
-    file_tokens = []
-    token_stream = lexer.get_tokens(file_line)
-    for token in token_stream:
-        file_tokens.append(token)
+    if patch_tokens is None:
+        patch_tokens = list(lexer.get_tokens(patch_line))
+    if file_tokens is None:
+        file_tokens = list(lexer.get_tokens(file_line))
 
     diff_tokens = list(set(patch_tokens) - set(file_tokens))
 
@@ -132,136 +240,26 @@ def calculate_language_diff(patch_line, file_line, file_name):
     )
 
 
-# Returns line number of match location, returns -1 if no match
-def fuzzy_search(search_lines, file_name, patch_line_number, retry_obj=None):
-    search_pattern = "\n".join(search_lines)
-    file_lines = []
-    cur_char = 0
-    search_location = -1
-    cur_line = 1
-    line_to_char_dict = {}
-
-    with open(file_name) as f:
-        for line in f:
-            line_to_char_dict[cur_line] = cur_char
-            cur_line += 1
-            cur_char += len(line)
-            file_lines.append(line)
-
-        if patch_line_number in line_to_char_dict:
-            search_location = line_to_char_dict[patch_line_number]
-        else:
-            search_location = cur_char
-
-    file_str = "".join(file_lines)
-
-    # Use retry_interval as inital interval, if not found, use default 1000 * 0.8 = 800
-    best_threshold = 0.01
-    high_threshold = 0.2
-    default_distance = dmp.Match_Distance
-    default_threshold = dmp.Match_Threshold
-    distance = default_threshold * default_distance
+def search_distance(retry_obj=None):
+    """
+    Matches as far away as the retries of retry_obj would have looked
+    are only slightly worse than ones close to where the patch expects.
+    """
     if retry_obj:
-        end_line = retry_obj.retry_interval + patch_line_number
-        if end_line in line_to_char_dict:
-            distance = line_to_char_dict[end_line]
-
-    # First look for a best similar match:
-    dmp.Match_Threshold = best_threshold 
-    dmp.Match_Distance = distance /best_threshold 
-    char_match_loc = dmp.match_main(file_str, search_pattern, search_location)
-    # Then look for a highly similar match:
-    if char_match_loc == -1:
-        dmp.Match_Threshold = high_threshold
-        dmp.Match_Distance = distance / high_threshold
-        char_match_loc = dmp.match_main(file_str, search_pattern, search_location)
-
-    # no highly similar found, do a default fuzzy match
-    if char_match_loc == -1:
-        dmp.Match_Threshold = default_threshold
-        dmp.Match_distance = default_distance
-        char_match_loc = dmp.match_main(file_str, search_pattern, search_location)
-
-    # no match found in the initial place. Retry:
-    if char_match_loc == -1 and retry_obj:
-        overlap_line = 5
-        distance = retry_obj.retry_interval + overlap_line
-        for i in range(1, retry_obj.retry_times + 1):
-            above_start_line = patch_line_number - i * retry_obj.retry_interval
-            below_start_line = patch_line_number + i * retry_obj.retry_interval - overlap_line
-            search_above_res = -1
-            search_below_res = -1
-            if above_start_line not in line_to_char_dict and below_start_line not in line_to_char_dict:
-                break
+        return retry_obj.retry_times * retry_obj.retry_interval
+    return locator.DEFAULT_DISTANCE
 
-            # Search for a best similar match in both interval: 99%
-            dmp.Match_Threshold = best_threshold 
-            dmp.Match_Distance = distance / dmp.Match_Threshold
-            if above_start_line in line_to_char_dict:
-                search_above_res = dmp.match_main(
-                    file_str, search_pattern, line_to_char_dict[above_start_line]
-                )
 
-            # Search the second interval:
-            if below_start_line in line_to_char_dict:
-                search_below_res = dmp.match_main(
-                    file_str, search_pattern, line_to_char_dict[below_start_line]
-                )
-            
-            if search_above_res == -1 and search_below_res == -1:
-                # no best similar match, do highly similar match for 80%
-                dmp.Match_Threshold = high_threshold 
-                dmp.Match_Distance = distance / dmp.Match_Threshold
-                if above_start_line in line_to_char_dict:
-                    search_above_res = dmp.match_main(
-                        file_str, search_pattern, line_to_char_dict[above_start_line]
-                    )
-                if below_start_line in line_to_char_dict:
-                    search_below_res = dmp.match_main(
-                        file_str, search_pattern, line_to_char_dict[below_start_line]
-                    )
-            elif search_above_res == -1 or search_below_res == -1:
-                # we found exactly one highly similar match, return that one
-                char_match_loc = search_above_res if search_above_res != -1 else search_below_res
-                break
-
-            if search_above_res == -1 and search_below_res == -1:
-                # no highly similar match, do default threshold fuzzy match 50%
-                dmp.Match_Threshold = default_threshold
-                dmp.Match_Distance = distance / dmp.Match_Threshold
-                if above_start_line in line_to_char_dict:
-                    search_above_res = dmp.match_main(
-                        file_str, search_pattern, line_to_char_dict[above_start_line]
-                    )
-                if below_start_line in line_to_char_dict:
-                    search_below_res = dmp.match_main(
-                        file_str, search_pattern, line_to_char_dict[below_start_line]
-                    )
-            elif search_above_res == -1 or search_below_res == -1:
-                # we found exactly one highly similar match, return that one
-                char_match_loc = search_above_res if search_above_res != -1 else search_below_res
-                break
-
-            if search_above_res != -1 and search_below_res != -1:
-                # Found two highly similar match or two low similar match, calculate levenshtein ratio to decide
-                above_ratio = Levenshtein.ratio(search_lines, file_str[search_above_res:(search_above_res+len(search_lines)) ] )
-                below_ratio = Levenshtein.ratio(search_lines, file_str[search_below_res:(search_below_res+len(search_below_res)) ] )
-                char_match_loc = search_above_res if above_ratio > below_ratio else search_below_res
-                if above_ratio == below_ratio:
-                    # if same ratio, return the closer one to the start point. If still same, we prefer the below one
-                    char_match_loc = search_above_res if abs(search_location - search_above_res) < abs(search_below_res - search_location) else search_below_res 
-                break
-            elif search_above_res != -1 or search_below_res != -1:
-                # we found exactly one low similar match, return that one
-                char_match_loc = search_above_res if search_above_res != -1 else search_below_res
-                break
-
-            # We did not find any similar match in this interval. try again
-            
-    if char_match_loc != -1:
-        return file_str[: char_match_loc + 1].count("\n") + 1
-    else:
-        return -1
+# Returns line number of match location, returns -1 if no match
+@trace.traced("fuzzy_search")
+def fuzzy_search(search_lines, file_name, patch_line_number, retry_obj=None):
+    """
+    Finds search_lines in the file line by line (see locator.locate).
+    """
+    return locator.locate(
+        search_lines, overlay.read(file_name), patch_line_number,
+        search_distance(retry_obj)
+    )
 
 
 def get_file_with_patch(patch_lines):
@@ -317,10 +315,22 @@ def is_already_moved(patch_idx, patch_lines, file_idx, file_lines):
     return False
 
 
-def compare_nearby(patch_idx, patch_lines, file_idx, file_lines):
+def compare_nearby(patch_idx, patch_lines, file_idx, file_lines, ratios=None):
+    """
+    ratios, if given, is the similarity of every (stripped) patch line to
+    every (stripped) file line, as returned by similarity.matrix().
+    """
     above_res = True
     below_res = True
 
+    def ratio(cur_patch_idx, cur_file_idx):
+        if ratios is not None:
+            return ratios[cur_patch_idx][cur_file_idx]
+        trace.count("levenshtein")
+        return Levenshtein.ratio(
+            patch_lines[cur_patch_idx][1].strip(), file_lines[cur_file_idx].strip()
+        )
+
     cur_patch_idx = patch_idx - 1
     prev_non_removed = ""
     while cur_patch_idx >= 0:
@@ -328,6 +338,7 @@ def compare_nearby(patch_idx, patch_lines, file_idx, file_lines):
             prev_non_removed = patch_lines[cur_patch_idx][1].strip()
             break
         cur_patch_idx -= 1
+    prev_idx = cur_patch_idx
 
     cur_patch_idx = patch_idx + 1
     next_non_removed = ""
@@ -336,54 +347,71 @@ def compare_nearby(patch_idx, patch_lines, file_idx, file_lines):
             next_non_removed = patch_lines[cur_patch_idx][1].strip()
             break
         cur_patch_idx += 1
+    next_idx = cur_patch_idx
 
     if file_idx != 0:
         if len(prev_non_removed) != 0:
-            above_res = (
-                Levenshtein.ratio(prev_non_removed, file_lines[file_idx - 1].strip())
-                > LEVENSHTEIN_RATIO
-            )
+            above_res = ratio(prev_idx, file_idx - 1) > LEVENSHTEIN_RATIO
     if file_idx < len(file_lines) - 1:
         if len(next_non_removed) != 0:
-            below_res = (
-                Levenshtein.ratio(next_non_removed, file_lines[file_idx + 1].strip())
-                > LEVENSHTEIN_RATIO
-            )
+            below_res = ratio(next_idx, file_idx + 1) > LEVENSHTEIN_RATIO
 
     return above_res and below_res
 
 
 # Returns an object containing information about the difference between a file and a patch
+@trace.traced("find_diffs")
 def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
-    dmp.Match_Distance = match_distance
+    # match_distance was the distance (in characters) of the old bitap
+    # search and is no longer used.
     function_for_patch, patch_lines = patch_obj._lines[0][1], patch_obj._lines[1:]
     line_number = patch_obj._newStart
+    source = overlay.read(file_name)
+    distance = search_distance(retry_obj)
 
     search_lines_with_type = get_file_without_patch(patch_lines)
-    search_lines_without_type = [line[1] for line in search_lines_with_type]
-
-    match_start_line = fuzzy_search(
-        search_lines_without_type, file_name, line_number, retry_obj
+    found = locator.candidates(
+        [line[1] for line in search_lines_with_type], source, line_number,
+        distance, MATCH_CANDIDATES
     )
 
-    if match_start_line == -1:
+    if not found:
         search_lines_with_type = get_file_with_patch(patch_lines)
-        search_lines_without_type = [line[1] for line in search_lines_with_type]
-        match_start_line = fuzzy_search(
-            search_lines_without_type, file_name, line_number, retry_obj
+        found = locator.candidates(
+            [line[1] for line in search_lines_with_type], source, line_number,
+            distance, MATCH_CANDIDATES
         )
 
-    if match_start_line == -1:
+    if not found:
         return Diff(MatchStatus.NO_MATCH)
 
-    with open(file_name) as f:
-        file_lines = f.readlines()[
-            match_start_line
-            - 1 : match_start_line
-            - 1
-            + len(search_lines_with_type)
-            + PATCH_LENGTH_BUFFER
-        ]
+    # The candidates are in the order the locator ranks them; a later one
+    # is only used if more of the lines of the patch are found there.
+    best = None
+    for match_start_line, score in found:
+        with trace.span("diff_at", line=match_start_line):
+            diff = diff_at(
+                patch_lines, function_for_patch, file_name, source,
+                match_start_line, len(search_lines_with_type)
+            )
+        if best is None or diff.match_count > best.match_count:
+            best = diff
+    best.candidates = found
+    return best
+
+
+def diff_at(patch_lines, function_for_patch, file_name, source, match_start_line, search_length):
+    """
+    Compares the lines of the patch with the lines of the file starting
+    at match_start_line.
+    """
+    file_lines = source.lines[
+        match_start_line
+        - 1 : match_start_line
+        - 1
+        + search_length
+        + PATCH_LENGTH_BUFFER
+    ]
     removed_diffs = []
     added_diffs = []
     context_diffs = []
@@ -400,7 +428,17 @@ def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
             added_lines.append(line[1].strip())
     added_lines = set(added_lines)
 
+    # The similarity of every line of the patch to every line of the file,
+    # all at once.
+    ratios = similarity.matrix(
+        [line[1].strip() for line in patch_lines],
+        [line.strip() for line in file_lines],
+    )
+
+    tokens = WindowTokens(file_name, patch_lines, file_lines)
+
     matched_file_lines = set()
+    match_count = 0
     for idx, patch_line in enumerate(patch_lines):
         stripped_patch_line = patch_line[1].strip()
         if len(stripped_patch_line) == 0:
@@ -411,10 +449,10 @@ def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
         # For each line in the patch, search over all lines in the file to find a match.
         for file_idx in range(len(file_lines)):
             file_line = file_lines[file_idx]
-            cur_ratio = Levenshtein.ratio(file_line.strip(), stripped_patch_line)
+            cur_ratio = ratios[idx][file_idx]
             if cur_ratio >= max_ratio:
                 if cur_ratio == max_ratio and not compare_nearby(
-                    idx, patch_lines, file_idx, file_lines
+                    idx, patch_lines, file_idx, file_lines, ratios
                 ):
                     continue
                 max_ratio = cur_ratio
@@ -422,6 +460,7 @@ def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
                 matched_file_idx = file_idx
         if max_ratio == 1 and patch_line[0] != natureOfChange.REMOVED:
             matched_file_lines.add(max_ratio_file_line.strip())
+            match_count += 1
         elif max_ratio > LEVENSHTEIN_RATIO:
             # Attempt at trying to filter out moved lines
             if (
@@ -432,14 +471,13 @@ def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
                 continue
 
             matched_file_lines.add(max_ratio_file_line.strip())
+            match_count += 1
 
             plaintext_diff = calculate_plaintext_diff(
                 stripped_patch_line, max_ratio_file_line.strip()
             )
 
-            language_specific_diff = calculate_language_diff(
-                stripped_patch_line, max_ratio_file_line.strip(), file_name
-            )
+            language_specific_diff = tokens.diff(idx, matched_file_idx)
 
             line_diff_obj = Diff.LineDiff(
                 patch_line=stripped_patch_line,
@@ -484,6 +522,7 @@ def find_diffs(patch_obj, file_name, retry_obj=None, match_distance=3000):
         context_diffs=context_diffs,
         additional_lines=additional_lines,
         function_for_patch=function_for_patch,
+        match_count=match_count,
     )
 
 
@@ -0,0 +1,218 @@
+import os
+import shutil
+import tempfile
+
+import scripts.trace as trace
+
+
+class SourceFile:
+    """
+    The contents of a source file, read and normalised once so that
+    everything looking at the file during a run can share it.
+
+    lines: the lines of the file, each with its trailing newline (the
+        last line may not have one).  Line endings are normalised to
+        "\n" the same way reading a file in text mode does.
+    stripped: each line with the surrounding whitespace removed
+    offsets: offsets[i] is the character offset in text where line i
+        (counting from 0) starts.  offsets[len(lines)] is the length of
+        the text.
+    encoding: the encoding the file was decoded with
+    has_cr: True if the file on disk had "\r" line endings, which are
+        lost when the lines are normalised
+    """
+
+    def __init__(self, path, lines, encoding="utf-8", stamp=None, stripped=None):
+        self.path = path
+        self.lines = lines
+        if stripped is None:
+            stripped = [line.strip() for line in lines]
+        self.stripped = stripped
+        self.encoding = encoding
+        self.stamp = stamp
+        self.has_cr = False
+
+        self._offsets = None
+        self._text = None
+        self._index = None
+        self._nonblank = None
+
+    @classmethod
+    def read(cls, path):
+        stamp = file_stamp(path)
+        with open(path, "rb") as fileObj:
+            data = fileObj.read()
+        trace.count("bytes read", len(data))
+
+        try:
+            text = data.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            # latin-1 can decode anything, and encodes back to the same
+            # bytes when the file is written out again.
+            text = data.decode("latin-1")
+            encoding = "latin-1"
+
+        source = cls(path, split_lines(text), encoding=encoding, stamp=stamp)
+        source.has_cr = "\r" in text
+        return source
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._offsets = [0] * (len(self.lines) + 1)
+            offset = 0
+            for i, line in enumerate(self.lines):
+                offset += len(line)
+                self._offsets[i + 1] = offset
+        return self._offsets
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.lines)
+        return self._text
+
+    def __len__(self):
+        return len(self.lines)
+
+    def has_line(self, line_number):
+        """
+        True if line_number (counting from 1) is a line in the file.
+        """
+        return 1 <= line_number <= len(self.lines)
+
+    def offset(self, line_number):
+        """
+        Returns the character offset of the start of line_number
+        (counting from 1).
+        """
+        return self.offsets[line_number - 1]
+
+    def positions(self, stripped_line):
+        """
+        Returns the (sorted) indexes of the lines that are equal to
+        stripped_line once stripped.  The index is built the first time
+        it is needed.
+        """
+        if self._index is None:
+            self._index = {}
+            for i, line in enumerate(self.stripped):
+                self._index.setdefault(line, []).append(i)
+        return self._index.get(stripped_line, [])
+
+    @property
+    def nonblank(self):
+        """
+        nonblank[i] is the number of lines before line i (counting from 0)
+        that aren't blank.
+        """
+        if self._nonblank is None:
+            self._nonblank = [0] * (len(self.lines) + 1)
+            count = 0
+            for i, line in enumerate(self.stripped):
+                if line:
+                    count += 1
+                self._nonblank[i + 1] = count
+        return self._nonblank
+
+    def content(self, start=0, end=None):
+        """
+        Returns the lines of the file (or the lines from start up to end,
+        counting from 0) without their line endings.
+        """
+        return [
+            line[:-1] if line.endswith("\n") else line
+            for line in self.lines[start:end]
+        ]
+
+
+def split_lines(text):
+    """
+    Splits text into lines, keeping the newline at the end of each line.
+    Unlike str.splitlines() only "\n" ends a line, which is how iterating
+    over a file object behaves.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    parts = text.split("\n")
+    lines = [part + "\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+# Every SourceFile read during the run, by absolute path.
+_files = {}
+
+
+def get(path):
+    """
+    Returns the SourceFile for path, reading it only if it hasn't been
+    read yet or has changed on disk since.
+    """
+    path = os.path.abspath(path)
+    source = _files.get(path)
+    if source is not None:
+        try:
+            if source.stamp == file_stamp(path):
+                return source
+        except OSError:
+            pass
+
+    source = SourceFile.read(path)
+    _files[path] = source
+    return source
+
+
+def write(path, lines, encoding=None):
+    """
+    Writes lines (each ending with a newline) to path, and updates the
+    cached SourceFile to match without reading the file back.  The lines
+    are written to a temporary file in the same directory which is then
+    renamed over path, so the file is never left half written.
+    """
+    path = os.path.abspath(path)
+    if encoding is None:
+        source = _files.get(path)
+        encoding = source.encoding if source is not None else "utf-8"
+
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + name + ".")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as fileObj:
+            fileObj.writelines(lines)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            # mkstemp() only lets the owner read the file.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stored(path, lines, encoding)
+
+
+def stored(path, lines, encoding):
+    """
+    Records that lines were just written to path by someone else.
+    """
+    path = os.path.abspath(path)
+    _files[path] = SourceFile(path, lines, encoding=encoding, stamp=file_stamp(path))
+
+
+def invalidate(path):
+    _files.pop(os.path.abspath(path), None)
+
+
+def clear():
+    _files.clear()
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import functools
+import threading
+
+
+class Span:
+    """
+    Times a stage of a run, from when it is entered to when it is left.
+    args are shown with the span in the trace; more can be added with
+    set() once they are known.
+    """
+
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.events.append((
+            self.name, self.category, self.start, end - self.start,
+            os.getpid(), threading.get_ident(), self.args,
+        ))
+
+
+class _NoSpan:
+    """
+    Stands in for a Span when nothing is being traced.
+    """
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_no_span = _NoSpan()
+
+
+class Tracer:
+    """
+    Collects the spans and counters of a run.  events are (name, category,
+    start, duration, pid, tid, args) with the times in nanoseconds from
+    time.perf_counter_ns().
+    """
+
+    def __init__(self):
+        self.events = []
+        self.counters = {}
+
+    def span(self, name, category="stage", **args):
+        return Span(self, name, category, args)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def export(self):
+        """
+        Returns the events and counters, to be merge()d into the tracer
+        of another process.
+        """
+        return self.events, self.counters
+
+    def merge(self, exported):
+        events, counters = exported
+        self.events.extend(events)
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def chrome(self):
+        """
+        Returns the run in the Chrome trace event format, to be loaded
+        into chrome://tracing or Perfetto.
+        """
+        origin = min((event[2] for event in self.events), default=0)
+        events = [
+            {
+                "name": name, "cat": category, "ph": "X",
+                "ts": (start - origin) / 1000, "dur": duration / 1000,
+                "pid": pid, "tid": tid, "args": args,
+            }
+            for name, category, start, duration, pid, tid, args in self.events
+        ]
+        end = max((event[2] + event[3] for event in self.events), default=origin)
+        if self.counters:
+            events.append({
+                "name": "counters", "ph": "C", "ts": (end - origin) / 1000,
+                "pid": os.getpid(), "tid": 0, "args": dict(self.counters),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w") as fileObj:
+            json.dump(self.chrome(), fileObj)
+
+    def stats(self):
+        """
+        Returns (category, name, count, total, longest) for the spans with
+        the same category and name, with the times in seconds, the longest
+        total first.
+        """
+        totals = {}
+        for name, category, start, duration, pid, tid, args in self.events:
+            key = (category, name)
+            count, total, longest = totals.get(key, (0, 0, 0))
+            totals[key] = (count + 1, total + duration, max(longest, duration))
+        rows = [
+            (category, name, count, total / 1e9, longest / 1e9)
+            for (category, name), (count, total, longest) in totals.items()
+        ]
+        return sorted(rows, key=lambda row: -row[3])
+
+    def format_stats(self):
+        lines = ["%-8s %-28s %8s %12s %12s %12s" % (
+            "kind", "stage", "count", "total ms", "mean ms", "max ms")]
+        for category, name, count, total, longest in self.stats():
+            lines.append("%-8s %-28s %8d %12.2f %12.2f %12.2f" % (
+                category, name, count, total * 1000, total * 1000 / count, longest * 1000))
+        for name in sorted(self.counters):
+            lines.append("%-8s %-28s %8d" % ("counter", name, self.counters[name]))
+        return "\n".join(lines) + "\n"
+
+
+# The Tracer of the run, or None if nothing is being traced.
+_tracer = None
+
+
+def enable():
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def current():
+    return _tracer
+
+
+def span(name, category="stage", **args):
+    """
+    Returns a Span timing the stage name, to be used in a with statement.
+    Does nothing if tracing isn't enabled.
+    """
+    if _tracer is None:
+        return _no_span
+    return Span(_tracer, name, category, args)
+
+
+def count(name, amount=1):
+    """
+    Adds amount to the counter name, if tracing is enabled.
+    """
+    if _tracer is not None:
+        _tracer.count(name, amount)
+
+
+def traced(name, category="stage"):
+    """
+    Decorator that times every call of the function as a span called
+    name, if tracing is enabled.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with Span(_tracer, name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
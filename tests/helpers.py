@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.patch_apply.file_index as file_index
+import scripts.patch_apply.content_index as content_index
+from scripts.cache import DiskCache
+
+
+def git(*args, cwd=None):
+    """
+    Runs git in cwd (by default the current directory), and fails if git
+    does.
+    """
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                   cwd=cwd, check=True, capture_output=True)
+
+
+class ScratchRepo:
+    """
+    Mixin for the test cases that work in a directory of their own.
+    setUp() changes into an empty directory (self.repo, which is only a
+    git repository once git("init") has been run), with a DiskCache for
+    the indexes next to it (self.cache), and tearDown() goes back and
+    removes them.  The indexes of the repository are cleared on the way
+    in and out.
+    """
+
+    def setUp(self):
+        self.oldcwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self.tmpdir.name, "repo")
+        os.makedirs(self.repo)
+        os.chdir(self.repo)
+        self.cache = DiskCache(os.path.join(self.tmpdir.name, "cache"), 1024 * 1024)
+        file_index.clear()
+        content_index.clear()
+
+    def tearDown(self):
+        file_index.clear()
+        content_index.clear()
+        os.chdir(self.oldcwd)
+        self.tmpdir.cleanup()
@@ -3,13 +3,13 @@
 touch result.txt
 chmod +w result.txt
 for path in ../patches/*; do
-    git -C ./../../msm-3.10 reset --hard
     cd ./../../msm-3.10
     echo $path 
     echo $path >> ../vulnerableforks/integration_testing/result.txt
     echo "---------111--------------" >> ../vulnerableforks/integration_testing/result.txt
-    python3 ../vulnerableforks/scripts/patch_apply/apply.py ../vulnerableforks/integration_testing/$path >> ../vulnerableforks/integration_testing/result.txt
-    git diff >> ../vulnerableforks/integration_testing/result.txt
+    # The changes are only made in memory and printed, so the tree doesn't
+    # have to be reset between patches.
+    python3 ../vulnerableforks/scripts/patch_apply/apply.py --dry-run --show-diff ../vulnerableforks/integration_testing/$path >> ../vulnerableforks/integration_testing/result.txt
     echo "*****-------------------*-*-*------------------------" >> ../vulnerableforks/integration_testing/result.txt
     echo "------------------------*-*-*------------------------" >> ../vulnerableforks/integration_testing/result.txt
     cd ../vulnerableforks/integration_testing/
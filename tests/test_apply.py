@@ -4,12 +4,16 @@ import unittest
 import sys
 import os
 import re
+import json
+import tempfile
+import subprocess
 
 from io import StringIO
 from unittest.mock import patch
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".")))
 import scripts.patch_apply.apply as apply
+from helpers import git, ScratchRepo
 
 class TestApplied(unittest.TestCase):
     def setUp(self):
@@ -46,6 +50,112 @@ class TestApplied(unittest.TestCase):
             self.assertEqual( fakeOutput.getvalue().count('Examining patch:'),
                               numPatches )
 
+    def test_multiple_patches_jobs(self):
+        arguments = dict( pathToPatch='patches/clean',
+                          dry_run=True,
+                          reverse=False,
+                          verbose=0,
+        )
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            apply.main( **arguments )
+            expected = fakeOutput.getvalue()
+
+        # The same output, in the same order, when the patches are
+        # examined in parallel.
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            apply.main( jobs=3, **arguments )
+            self.assertEqual( fakeOutput.getvalue(), expected )
+
+    def test_jobs_needs_dry_run(self):
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            self.assertEqual( apply.main( pathToPatch='patches/clean',
+                                          dry_run=False,
+                                          jobs=2 ), 1 )
+            self.assertRegex( fakeOutput.getvalue(), 'only be used with --dry-run' )
+
+    def test_analyse_all(self):
+        import scripts.patch_apply.patchParser as parse
+        import scripts.patch_apply.parallel as parallel
+
+        def load():
+            # canApply() may change the hunks, so each run gets its own.
+            hunks = []
+            for name in sorted(os.listdir('patches/context')):
+                patch_file = parse.PatchFile(os.path.join('patches/context', name))
+                patch_file.getPatch()
+                hunks.extend((hunk, hunk.getFileName()) for hunk in patch_file.patches)
+            return hunks
+
+        def summary(results):
+            return [
+                (status, obj.status if obj else None,
+                 obj.diff_obj.match_start_line if obj and obj.diff_obj else None)
+                for _, status, obj in results
+            ]
+
+        # Analysing in parallel gives the same results in the same order.
+        expected = summary(apply.analyse_hunks(load()))
+        self.assertEqual( summary(parallel.analyse_all(load(), 2)), expected )
+
+    def test_batch(self):
+        with patch('sys.stdout', new=StringIO()) as fakeOutput, \
+             patch('sys.stderr', new=StringIO()) as fakeError:
+            apply.main( pathToPatch='patches/context/comment.patch',
+                        dry_run=False,
+                        reverse=False,
+                        verbose=0,
+                        batch='report-only',
+            )
+
+            # Only the records go to stdout.
+            records = [json.loads(line) for line in fakeOutput.getvalue().splitlines()]
+            self.assertEqual( len(records), 1 )
+            self.assertEqual( records[0]['status'], 'would_apply' )
+            self.assertEqual( records[0]['match_line'], 37 )
+            self.assertRegex( fakeError.getvalue(), 'Patch failed to apply with git apply' )
+
+    def test_batch_file_not_found(self):
+        # The files the hunk could be for are in the record.
+        with tempfile.TemporaryDirectory() as cache, \
+             patch.dict(os.environ, {"APPLYPLUS_CACHE_DIR": cache}), \
+             patch('sys.stdout', new=StringIO()) as fakeOutput, \
+             patch('sys.stderr', new=StringIO()):
+            apply.main( pathToPatch='patches/no-file.patch',
+                        dry_run=True,
+                        reverse=False,
+                        verbose=0,
+                        batch='report-only',
+            )
+
+        records = [json.loads(line) for line in fakeOutput.getvalue().splitlines()]
+        self.assertEqual( [record['status'] for record in records], ['file_not_found'] )
+        self.assertEqual( sorted(records[0]['candidates']),
+                          ['patches/test-modified.cpp', 'patches/test.cpp'] )
+
+    def test_lazy_imports(self):
+        # A patch that applies as it is doesn't need any of the modules
+        # used to analyse the ones that don't.
+        script = "\n".join([
+            "import sys, io, contextlib",
+            "sys.path.append(%r)" % os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+            "import scripts.patch_apply.apply as apply",
+            "output = io.StringIO()",
+            "with contextlib.redirect_stdout(output):",
+            "    apply.main(pathToPatch='patches/clean/add-pluses.patch', dry_run=True, reverse=False, verbose=0)",
+            "print(output.getvalue().strip())",
+            "print('\\n'.join(sys.modules))",
+        ])
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+        self.assertEqual( result.returncode, 0, result.stderr )
+
+        output, *modules = result.stdout.split("\n")
+        self.assertEqual( output, "Successfully applied" )
+        for heavy in ["pygments", "diff_match_patch", "Levenshtein", "rapidfuzz",
+                      "multiprocessing", "scripts.patch_match.test_match",
+                      "scripts.patch_context.context_changes",
+                      "scripts.patch_context.slice_and_parse"]:
+            self.assertNotIn( heavy, modules )
+
     def test_applied(self):
         with patch('sys.stdout', new=StringIO()) as fakeOutput:
             apply.main( pathToPatch='patches/applied/add-line.patch',
@@ -133,5 +243,69 @@ class TestApplied(unittest.TestCase):
             self.assertRegex( fakeOutput.getvalue(), 'cannot apply binary patch to ' )
             self.assertRegex( fakeOutput.getvalue(), r'Binary patch detected\.' )
 
+class TestWorktrees(ScratchRepo, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        git("init", "-q")
+        with open("tracked.c", "w") as fileObj:
+            fileObj.write("int a;\n")
+        git("add", "tracked.c")
+        git("commit", "-q", "-m", "tracked")
+
+    def test_jobs_untracked_file(self):
+        # The workers have to see files that git doesn't track yet.
+        with open("untracked.c", "w") as fileObj:
+            fileObj.write("int b;\nint c;\n")
+        os.mkdir("patches")
+        for name in ["1.patch", "2.patch"]:
+            with open(os.path.join("patches", name), "w") as fileObj:
+                fileObj.write("--- a/untracked.c\n+++ b/untracked.c\n@@ -1,2 +1,2 @@\n int b;\n-int c;\n+int d;\n")
+
+        arguments = dict( pathToPatch='patches',
+                          dry_run=True,
+                          reverse=False,
+                          verbose=0,
+        )
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            apply.main( **arguments )
+            expected = fakeOutput.getvalue()
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            apply.main( jobs=2, **arguments )
+            output = fakeOutput.getvalue()
+
+        self.assertEqual( expected.count("Successfully applied"), 2 )
+        self.assertEqual( output, expected )
+
+    def test_worktree_changed(self):
+        import scripts.patch_apply.parallel as parallel
+
+        with open("tracked.c", "w") as fileObj:
+            fileObj.write("int b;\n")
+        with open("untracked.c", "w") as fileObj:
+            fileObj.write("int c;\n")
+
+        with parallel.WorktreePool(1) as pool:
+            worktree = pool.worktrees[0]
+            tracked = os.path.join(worktree.path, "tracked.c")
+
+            # Ready as soon as the pool is.
+            with open(tracked) as fileObj:
+                self.assertEqual( fileObj.read(), "int b;\n" )
+            self.assertTrue( os.path.isfile(os.path.join(worktree.path, "untracked.c")) )
+            self.assertFalse( worktree.changed() )
+            self.assertTrue( worktree.changed({tracked}) )
+
+            # A file left behind by a patch.
+            with open(os.path.join(worktree.path, "tracked.c.rej"), "w") as fileObj:
+                fileObj.write("int d;\n")
+            self.assertTrue( worktree.changed() )
+            with open(tracked, "w") as fileObj:
+                fileObj.write("int d;\n")
+            worktree.reset()
+            self.assertFalse( worktree.changed() )
+            self.assertFalse( os.path.exists(os.path.join(worktree.path, "tracked.c.rej")) )
+            with open(tracked) as fileObj:
+                self.assertEqual( fileObj.read(), "int b;\n" )
+
 if __name__ == "__main__":
     unittest.main()
@@ -4,11 +4,12 @@ import unittest
 import sys
 import os
 import re
+import tempfile
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
 import scripts.patch_context.context_changes as context
 import scripts.patch_apply.patchParser as parse
-from scripts.enums import precheckStatus
+from scripts.enums import natureOfChange, precheckStatus
 
 def GenerateTestName(filename):
     if filename.endswith('.patch'):
@@ -73,16 +74,7 @@ class TestApplied(unittest.TestCase, metaclass=AppliedPatchTests):
     def tearDown(self):
         os.chdir(self.oldcwd)
 
-    errors = {
-        'test_remove_offset': {
-            'message': r'A context match was not found.',
-            'canApply': precheckStatus.ALREADY_APPLIED
-        },
-        'test_remove_offset_similar2': {
-            'message': r'A context match was not found.',
-            'canApply': precheckStatus.ALREADY_APPLIED
-        },
-    }
+    errors = {}
 
 class PatchTests(type):
     def __new__(mcls, name, bases, attrs):
@@ -163,5 +155,121 @@ class TestPatches(unittest.TestCase, metaclass=PatchTests):
         # There should only be one hunk in this file.
         self.assertEqual( len(patch_file.patches), 2 )
 
+    def test_iter_patches(self):
+        patch_file = parse.PatchFile("patches/clean/two-changes.patch")
+        hunks = list(patch_file.iterPatches())
+        patch_file.getPatch()
+        self.assertEqual( [hunk.getLinesChanged() for hunk in hunks],
+                          [hunk.getLinesChanged() for hunk in patch_file.patches] )
+        self.assertEqual( [hunk.getLines() for hunk in hunks],
+                          [hunk.getLines() for hunk in patch_file.patches] )
+
+    def test_iter_hunks_streams(self):
+        def lines():
+            yield "--- a/file.c\n"
+            yield "+++ b/file.c\n"
+            yield "@@ -1,2 +1,2 @@ main\n"
+            yield " int a;\n"
+            yield "-int b;\n"
+            yield "+int c;\n"
+            raise AssertionError("read past the first hunk")
+
+        hunk = next(parse.iterHunks(lines()))
+        self.assertEqual( hunk.getFileName(), "file.c" )
+        self.assertEqual( hunk.getLinesChanged(), (1, 2, 1, 2) )
+        self.assertEqual( bytes(hunk.getLines().kinds), b"  -+" )
+        self.assertEqual( list(hunk.getLines()), [
+            (natureOfChange.CONTEXT, "main"),
+            (natureOfChange.CONTEXT, "int a;"),
+            (natureOfChange.REMOVED, "int b;"),
+            (natureOfChange.ADDED, "int c;"),
+        ] )
+
+    def test_hunk_lines(self):
+        hunk = parse.Patch()
+        hunk.addLines(natureOfChange.CONTEXT, "")
+        hunk.addLines(natureOfChange.ADDED, "int a;")
+        lines = hunk.getLines()
+        self.assertEqual( len(lines), 2 )
+        self.assertEqual( lines[1], (natureOfChange.ADDED, "int a;") )
+        self.assertEqual( lines[1:], [(natureOfChange.ADDED, "int a;")] )
+
+        lines[1] = (natureOfChange.CONTEXT, "int a;")
+        self.assertEqual( hunk.getLines().kinds, bytearray(b"  ") )
+
+        hunk._lines = [(natureOfChange.REMOVED, "int b;")]
+        self.assertIsInstance( hunk.getLines(), parse.HunkLines )
+        self.assertEqual( hunk.getLines(), [(natureOfChange.REMOVED, "int b;")] )
+        self.assertRaises( AttributeError, setattr, hunk, "unknown", 1 )
+
+    def test_lines_changed(self):
+        hunk = parse.Patch()
+        for header, expected in [
+            ("@@ -1,2 +3,4 @@", (1, 2, 3, 4)),
+            ("@@ -1 +3,4 @@ int main()", (1, 1, 3, 4)),
+            ("@@ -1,2 +3 @@", (1, 2, 3, 1)),
+            ("@@ -1 +3 @@", (1, 1, 3, 1)),
+        ]:
+            hunk.setLinesChanged(header)
+            self.assertEqual( hunk.getLinesChanged(), expected )
+        self.assertRaises( ValueError, hunk.setLinesChanged, "@@ -a +b @@" )
+
+    def test_hunks_for(self):
+        # The removed "-- a comment" line mustn't be taken for a header.
+        text = (
+            "diff --git a/one.c b/one.c\n"
+            "--- a/one.c\n"
+            "+++ b/one.c\n"
+            "@@ -1,2 +1,2 @@\n"
+            "--- a comment\n"
+            "+int a;\n"
+            " int b;\n"
+            "@@ -10 +10 @@ main\n"
+            "-int c;\n"
+            "+int d;\n"
+            "diff --git a/two.c b/two.c\n"
+            "new file mode 100644\n"
+            "--- /dev/null\n"
+            "+++ b/two.c\n"
+            "@@ -0,0 +1 @@\n"
+            "+int e;\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "two-files.patch")
+            with open(path, "w") as fileObj:
+                fileObj.write(text)
+
+            patch_file = parse.PatchFile(path)
+            sections = patch_file.index()
+            self.assertEqual( [(section.fileName, section.isNewFile, section.headers) for section in sections], [
+                ("one.c", False, [(1, 2, 1, 2), (10, 1, 10, 1)]),
+                ("two.c", True, [(0, 0, 1, 1)]),
+            ] )
+
+            hunks = patch_file.hunksFor(lambda fileName: fileName == "two.c")
+            self.assertEqual( [type(hunk) for hunk in hunks], [parse.HunkHeader, parse.HunkHeader, parse.Patch] )
+            self.assertEqual( hunks[1].getLinesChanged(), (10, 1, 10, 1) )
+            self.assertIsNone( sections[0].patches )
+            self.assertTrue( hunks[2].isNewFile() )
+
+            # Parsing the rest gives the same hunks as parsing the whole file.
+            patch_file.getPatch()
+            self.assertIs( patch_file.patches[2], hunks[2] )
+            whole = list(parse.iterHunks(text.splitlines()))
+            self.assertEqual( [(hunk.getFileName(), hunk.getLinesChanged(), hunk.getLines()) for hunk in patch_file.patches],
+                              [(hunk.getFileName(), hunk.getLinesChanged(), hunk.getLines()) for hunk in whole] )
+
+    def test_hunks_for_unindexed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "crlf.patch")
+            with open(path, "wb") as fileObj:
+                fileObj.write(b"--- a/one.c\r\n+++ b/one.c\r\n@@ -1 +1 @@\r\n-int a;\r\n+int b;\r\n")
+
+            patch_file = parse.PatchFile(path)
+            self.assertIsNone( patch_file.index() )
+            hunks = patch_file.hunksFor(lambda fileName: False)
+            self.assertEqual( [type(hunk) for hunk in hunks], [parse.Patch] )
+            self.assertTrue( patch_file.parsed )
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+from benchmarks import bench, generate
+
+class TestBenchmarks(unittest.TestCase):
+    def test_generate(self):
+        # The same arguments always give the same inputs.
+        self.assertEqual( generate.case(1000, 30, 10, 2), generate.case(1000, 30, 10, 2) )
+        self.assertNotEqual( generate.c_file(100, 0), generate.c_file(100, 1) )
+
+        lines, patch = generate.case(1000, 3, drift=10)
+        self.assertEqual( len(lines), 1010 )
+        self.assertTrue( patch.startswith("--- a/bench.c\n+++ b/bench.c\n@@ -501,3 +501,3 @@\n") )
+        self.assertEqual( [line[0] for line in patch.splitlines()[3:]], [" ", "-", "+", " "] )
+
+    def test_run(self):
+        results = bench.run_benchmarks(quick=True, repeat=1, selected="apply")
+        self.assertEqual( sorted(results), [
+            "apply[drift=10,hunk=3,lines=1000]",
+            "can_apply[changed=0,drift=10,hunk=3,lines=1000]",
+        ] )
+        for result in results.values():
+            self.assertEqual( len(result["runs"]), 1 )
+
+    def test_compare(self):
+        baseline = {"a": {"median": 1.0}, "b": {"median": 1.0}, "c": {"skipped": "no srcml"}}
+        results = {"a": {"median": 1.2}, "b": {"median": 1.5}, "c": {"median": 9.0}, "d": {"median": 9.0}}
+        self.assertEqual( bench.compare(results, baseline, 0.25), [("b", 1.0, 1.5)] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.patch_apply.content_index as content_index
+from helpers import git, ScratchRepo
+
+def write(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fileObj:
+        fileObj.write("".join(line + "\n" for line in lines))
+
+def source(name, count=60):
+    return ["    int %s_value_%d = compute_%s(%d);" % (name, i, name, i) for i in range(count)]
+
+class TestContentIndex(ScratchRepo, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        git("init", "-q")
+        write("drivers/renamed.c", source("foo"))
+        write("drivers/other.c", source("bar"))
+        git("add", "-A")
+        git("commit", "-q", "-m", "commit")
+
+    def test_search(self):
+        index = content_index.ContentIndex(cache=self.cache)
+
+        # The lines of a hunk, one of them changed since.
+        lines = source("foo")[20:27]
+        lines[3] = "    int something_else = 0;"
+        lines = [content_index.normalise(line) for line in lines]
+        found = index.search(lines)
+        self.assertEqual( [path for path, containment in found], ["drivers/renamed.c"] )
+        self.assertAlmostEqual( found[0][1], 6 / 7 )
+
+        self.assertEqual( index.search([content_index.normalise("nothing like it")]), [] )
+        self.assertEqual( index.search([content_index.normalise("}")]), [] )
+
+        os.chdir("drivers")
+        self.assertEqual( index.search(lines)[0][0], "renamed.c" )
+
+    def test_patches(self):
+        # A patch for the file, and a copy of it with another extension,
+        # next to it.
+        lines = source("foo")[20:27]
+        write("drivers/renamed.patch",
+              ["--- a/drivers/renamed.c", "+++ b/drivers/renamed.c", "@@ -21,7 +21,7 @@"]
+              + [" " + line for line in lines])
+        write("drivers/renamed.txt", source("foo"))
+        index = content_index.ContentIndex(cache=self.cache)
+
+        lines = [content_index.normalise(line) for line in lines]
+        self.assertEqual( [path for path, containment in index.search(lines)],
+                          ["drivers/renamed.c", "drivers/renamed.txt"] )
+        self.assertEqual( [path for path, containment in index.search(lines, extension=".txt")],
+                          ["drivers/renamed.txt", "drivers/renamed.c"] )
+
+    def test_refresh(self):
+        index = content_index.ContentIndex(cache=self.cache)
+        lines = [content_index.normalise(line) for line in source("baz")[5:10]]
+        self.assertEqual( index.search(lines), [] )
+
+        write("drivers/new.c", source("baz"))
+        index.refresh()
+        self.assertEqual( index.search(lines)[0][0], "drivers/new.c" )
+
+        # Only the files that changed are read when the stored index is
+        # used again.
+        os.remove("drivers/other.c")
+        with patch.object(content_index, "_read", wraps=content_index._read) as read:
+            index = content_index.ContentIndex(cache=self.cache)
+        self.assertEqual( read.call_count, 0 )
+        self.assertEqual( sorted(index.files), ["drivers/new.c", "drivers/renamed.c"] )
+        self.assertEqual( index.search(lines)[0][0], "drivers/new.c" )
+
+    def test_larger_than_cache(self):
+        # The shards of the index are kept even though they don't fit.
+        self.cache.max_bytes = 1
+        write("include/header.h", source("baz"))
+        index = content_index.ContentIndex(cache=self.cache)
+        shards = set(index.shards.values())
+        self.assertEqual( len(shards), 2 )
+
+        lines = [content_index.normalise(line) for line in source("foo")[20:27]]
+        with patch.object(content_index, "_read", wraps=content_index._read) as read:
+            index = content_index.ContentIndex(cache=self.cache)
+            self.assertEqual( index.search(lines)[0][0], "drivers/renamed.c" )
+        # Only to check the file found.
+        self.assertEqual( read.call_count, 1 )
+
+        # Only the shard of the directory that changed is stored again,
+        # and the old one is what gets removed.
+        write("include/header.h", source("qux"))
+        with patch.object(content_index, "_read", wraps=content_index._read) as read:
+            index.refresh()
+        self.assertEqual( read.call_count, 1 )
+        self.assertIn( index.shards["drivers"], shards )
+        self.assertNotIn( index.shards["include"], shards )
+        self.assertIsNone( self.cache.get((shards - {index.shards["drivers"]}).pop()) )
+
+if __name__ == "__main__":
+    unittest.main()
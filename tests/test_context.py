@@ -7,8 +7,10 @@ import re
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
 import scripts.patch_context.context_changes as context
+import scripts.patch_context.slice_and_parse as slice
 import scripts.patch_apply.patchParser as parse
 from scripts.enums import precheckStatus
+from unittest.mock import patch
 
 def GenerateTestName(filename):
     if filename.endswith('.patch'):
@@ -110,5 +112,17 @@ class TestContext(unittest.TestCase, metaclass=ContextPatchTests):
     def tearDown(self):
         os.chdir(self.oldcwd)
 
+    def test_slicing_is_lazy(self):
+        # None of the rules that decide this patch need variable
+        # information, so srcml should never be run.
+        patch_file = parse.PatchFile("patches/context/function.patch")
+        patch_file.getPatch()
+
+        with patch.object(slice, "slice_files") as slice_files:
+            result = context.context_changes(patch_file.patches[0])
+            slice_files.assert_not_called()
+
+        self.assertRegex(result.messages, r'represents a function definition\.')
+
 if __name__ == "__main__":
     unittest.main()
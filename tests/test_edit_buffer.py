@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+from scripts.patch_apply.edit_buffer import EditBuffer
+
+class TestEditBuffer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "source.c")
+        with open(self.path, "w") as fileObj:
+            fileObj.write("".join("line %d\n" % i for i in range(1, 11)))
+        source_file.clear()
+
+    def tearDown(self):
+        source_file.clear()
+        self.tmpdir.cleanup()
+
+    def contents(self):
+        with open(self.path) as fileObj:
+            return fileObj.read().splitlines()
+
+    def test_replace(self):
+        buffer = EditBuffer(source_file.get(self.path))
+        buffer.replace(2, 1, ["new 3\n", "new 3b\n"])
+        buffer.replace(8, 2, [])
+        buffer.replace(0, 0, ["first\n"])
+
+        expected = ["first", "line 1", "line 2", "new 3", "new 3b",
+                    "line 4", "line 5", "line 6", "line 7", "line 10"]
+        self.assertEqual( [line.strip() for line in buffer.lines()], expected )
+        self.assertEqual( buffer.current.stripped, expected )
+        self.assertEqual( self.contents()[0], "line 1" )
+
+    def test_positions(self):
+        buffer = EditBuffer(source_file.get(self.path))
+        buffer.replace(2, 1, ["line 5\n", "new\n"])
+        buffer.replace(6, 1, [])
+        buffer.replace(0, 0, ["new\n"])
+
+        # The same as the index of the contents built from scratch.
+        current = buffer.current
+        expected = source_file.SourceFile(self.path, buffer.lines())
+        for line in ["line 1", "line 5", "line 6", "new", "line 3", "missing"]:
+            self.assertEqual( current.positions(line), expected.positions(line), line )
+        self.assertEqual( current.positions("line 5"), [3, 6] )
+
+        # The original file is left as it was.
+        self.assertEqual( source_file.get(self.path).positions("line 5"), [4] )
+
+    def test_write(self):
+        buffer = EditBuffer(source_file.get(self.path))
+        buffer.replace(0, 1, ["new 1\n"])
+        buffer.write()
+
+        self.assertEqual( self.contents()[0], "new 1" )
+        self.assertEqual( source_file.get(self.path).stripped[0], "new 1" )
+        self.assertFalse( buffer.isModified() )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+import scripts.overlay as overlay
+import scripts.patch_apply.patchParser as parse
+import scripts.patch_apply.fast_apply as fast_apply
+from scripts.enums import applyStatus
+
+SOURCE = "".join("line %d\n" % i for i in range(1, 11))
+
+CHANGE = """--- a/source.c
++++ b/source.c
+@@ -3,3 +3,3 @@
+ line 3
+-line 4
++changed 4
+ line 5
+"""
+
+NEW_FILE = """--- /dev/null
++++ b/new.c
+@@ -0,0 +1,2 @@
++int x;
++int y;
+"""
+
+class TestFastApply(unittest.TestCase):
+    def setUp(self):
+        self.oldcwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        with open("source.c", "w") as fileObj:
+            fileObj.write(SOURCE)
+        source_file.clear()
+        overlay.rollback()
+
+    def tearDown(self):
+        overlay.rollback()
+        source_file.clear()
+        os.chdir(self.oldcwd)
+        self.tmpdir.cleanup()
+
+    def run_patch(self, text, dry_run=False):
+        with open("change.patch", "w") as fileObj:
+            fileObj.write(text)
+        patch_file = parse.PatchFile("change.patch")
+        patch_file.runPatch(dry_run=dry_run)
+        return patch_file
+
+    def contents(self, name="source.c"):
+        with open(name) as fileObj:
+            return fileObj.read()
+
+    def test_apply(self):
+        patch_file = self.run_patch(CHANGE)
+
+        self.assertIsNotNone( patch_file.outcome )
+        self.assertTrue( patch_file.runSuccess )
+        self.assertEqual( self.contents(), SOURCE.replace("line 4\n", "changed 4\n") )
+
+        hunk = patch_file.outcome.files[0].hunks[0]
+        self.assertEqual( hunk.status, applyStatus.APPLIED )
+        self.assertEqual( hunk.line, 3 )
+        self.assertEqual( hunk.offset, 0 )
+
+    def test_offset(self):
+        with open("source.c", "w") as fileObj:
+            fileObj.write("first\nsecond\n" + SOURCE)
+
+        patch_file = self.run_patch(CHANGE)
+        self.assertTrue( patch_file.runSuccess )
+        self.assertEqual( patch_file.outcome.files[0].hunks[0].offset, 2 )
+
+    def test_dry_run(self):
+        patch_file = self.run_patch(CHANGE, dry_run=True)
+        self.assertTrue( patch_file.runSuccess )
+        self.assertEqual( self.contents(), SOURCE )
+
+    def test_does_not_apply(self):
+        patch_file = self.run_patch(CHANGE.replace("line 5", "line 6"))
+
+        self.assertFalse( patch_file.runSuccess )
+        self.assertEqual( patch_file.outcome.files[0].status, applyStatus.DOES_NOT_APPLY )
+        self.assertRegex( patch_file.runResult, "^error: source.c: patch does not apply" )
+        self.assertEqual( self.contents(), SOURCE )
+
+    def test_file_not_found(self):
+        patch_file = self.run_patch(CHANGE.replace("source.c", "missing.c"))
+        self.assertEqual( patch_file.outcome.files[0].status, applyStatus.FILE_NOT_FOUND )
+
+    def test_new_file(self):
+        patch_file = self.run_patch(NEW_FILE)
+        self.assertTrue( patch_file.runSuccess )
+        self.assertEqual( self.contents("new.c"), "int x;\nint y;\n" )
+
+        # It can't be created twice.
+        patch_file = self.run_patch(NEW_FILE)
+        self.assertEqual( patch_file.outcome.files[0].status, applyStatus.ALREADY_EXISTS )
+
+    def test_nothing_applied_on_failure(self):
+        # The first file would apply, but the second one doesn't.
+        patch_file = self.run_patch(CHANGE + NEW_FILE.replace("new.c", "source.c"))
+
+        self.assertFalse( patch_file.runSuccess )
+        self.assertEqual( self.contents(), SOURCE )
+
+    def test_unsupported(self):
+        patch_file = parse.PatchFile("change.patch")
+        with open("change.patch", "w") as fileObj:
+            fileObj.write(CHANGE + "\\ No newline at end of file\n")
+        self.assertIsNone( fast_apply.apply_patch_file(patch_file) )
+        self.assertEqual( overlay.current().modified(), [] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.patch_apply.file_index as file_index
+from helpers import git, ScratchRepo
+
+def touch(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as fileObj:
+        fileObj.write(path + "\n")
+
+class TestFileIndex(ScratchRepo, unittest.TestCase):
+    def commit(self, *paths):
+        for path in paths:
+            touch(path)
+        git("add", "-A")
+        git("commit", "-q", "-m", "commit")
+
+    def test_find(self):
+        git("init", "-q")
+        self.commit("drivers/net/eth.c", "drivers/net/wifi/eth.c", "lib/eth.c", "lib/other.c")
+
+        index = file_index.FileIndex(cache=self.cache)
+        self.assertEqual( index.find("drivers/eth/net/eth.c"),
+                          ["drivers/net/eth.c", "drivers/net/wifi/eth.c", "lib/eth.c"] )
+        self.assertEqual( index.find("old/wifi/eth.c")[0], "drivers/net/wifi/eth.c" )
+        self.assertEqual( index.find("missing.c"), [] )
+
+        # Only the files below the current directory, relative to it.
+        os.chdir("drivers")
+        self.assertEqual( index.find("net/eth.c"), ["net/eth.c", "net/wifi/eth.c"] )
+
+    def test_refresh(self):
+        git("init", "-q")
+        self.commit("a/one.c", "b/two.c")
+        index = file_index.FileIndex(cache=self.cache)
+
+        # Changes in the working tree.
+        touch("c/one.c")
+        os.remove("a/one.c")
+        index.refresh()
+        self.assertEqual( index.find("one.c"), ["c/one.c"] )
+
+        # New commits are picked up from the stored index.
+        self.commit("d/two.c")
+        stored = self.cache.get(index._key())
+        index = file_index.FileIndex(cache=self.cache)
+        self.assertNotEqual( stored["head"], index.head )
+        self.assertEqual( index.find("two.c"), ["b/two.c", "d/two.c"] )
+        self.assertEqual( index.find("one.c"), ["c/one.c"] )
+        self.assertEqual( self.cache.get(index._key())["files"],
+                          ["b/two.c", "c/one.c", "d/two.c"] )
+
+    def test_no_git(self):
+        os.environ["GIT_CEILING_DIRECTORIES"] = self.tmpdir.name
+        try:
+            touch("x/file.h")
+            touch("y/z/file.h")
+            index = file_index.FileIndex(cache=self.cache)
+        finally:
+            del os.environ["GIT_CEILING_DIRECTORIES"]
+        self.assertFalse( index.git )
+        self.assertEqual( index.find("z/file.h"), ["y/z/file.h", "x/file.h"] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+import scripts.overlay as overlay
+import scripts.patch_apply.patchParser as parse
+import scripts.patch_apply.git_reject as git_reject
+from scripts.enums import applyStatus
+
+SOURCE = "".join("line %d\n" % i for i in range(1, 21))
+
+# The first hunk applies, the second one doesn't since line 16 isn't
+# what the patch expects.
+PATCH = """--- a/source.c
++++ b/source.c
+@@ -3,3 +3,3 @@
+ line 3
+-line 4
++changed 4
+ line 5
+@@ -15,3 +15,3 @@
+ line 15
+-line 16 is different
++changed 16
+ line 17
+"""
+
+class TestGitReject(unittest.TestCase):
+    def setUp(self):
+        self.oldcwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        with open("source.c", "w") as fileObj:
+            fileObj.write(SOURCE)
+        with open("change.patch", "w") as fileObj:
+            fileObj.write(PATCH)
+        source_file.clear()
+        overlay.rollback()
+
+    def tearDown(self):
+        overlay.rollback()
+        source_file.clear()
+        os.chdir(self.oldcwd)
+        self.tmpdir.cleanup()
+
+    def check(self, patch_file, status):
+        patch_file.getPatch()
+        self.assertEqual( [status.get(hunk) for hunk in patch_file.patches],
+                          [applyStatus.APPLIED, applyStatus.DOES_NOT_APPLY] )
+
+        # Nothing was changed, and no .rej files were left behind.
+        with open("source.c") as fileObj:
+            self.assertEqual( fileObj.read(), SOURCE )
+        self.assertEqual( sorted(os.listdir(".")), ["change.patch", "source.c"] )
+
+    def test_hunk_status(self):
+        patch_file = parse.PatchFile("change.patch")
+        self.check( patch_file, git_reject.hunk_status(patch_file) )
+
+    def test_run_patch_with_git(self):
+        patch_file = parse.PatchFile("change.patch")
+        patch_file.runPatch(fast=False)
+        self.assertFalse( patch_file.runSuccess )
+        self.check( patch_file, patch_file.hunkStatus )
+
+    def test_run_patch(self):
+        patch_file = parse.PatchFile("change.patch")
+        patch_file.runPatch()
+        self.assertIsNotNone( patch_file.outcome )
+        self.check( patch_file, patch_file.hunkStatus )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.patch_match.test_match as tm
+from scripts.enums import Language, natureOfChange
+
+LINES = [
+    "int main( int argc, char ** argv ) {",
+    "",
+    "    // A comment.",
+    "    printf( \"%d\\n\", argc );",
+    "    /* Two",
+    "       lines */",
+    "}",
+]
+
+class TestLanguageDiff(unittest.TestCase):
+    def test_lexer(self):
+        lexer, language = tm.lexer_for_filename("dir/file.c")
+        self.assertEqual( language, Language.C )
+        self.assertIs( tm.lexer_for_filename("other/file.c")[0], lexer )
+        self.assertEqual( tm.lexer_for_filename("file.txt"), (None, Language.NOT_SUPPORTED) )
+
+    def test_tokenise_lines(self):
+        lexer, language = tm.lexer_for_filename("file.cpp")
+        lines = [line.strip() for line in LINES]
+        tokens = tm.tokenise_lines(lexer, lines)
+        self.assertEqual( len(tokens), len(lines) )
+
+        # The same as lexing the lines one at a time, other than for the
+        # lines inside the comment, which are only known to be a comment
+        # when lexed together.
+        for i in [0, 2, 3, 6]:
+            self.assertEqual( tokens[i], list(lexer.get_tokens(lines[i])) )
+        self.assertEqual( "".join(value for _, value in tokens[5]), "lines */\n" )
+        self.assertTrue( all("Comment" in str(token_type) for token_type, _ in tokens[5][:-1]) )
+
+    def test_window_tokens(self):
+        patch_lines = [
+            (natureOfChange.CONTEXT, LINES[0]),
+            (natureOfChange.REMOVED, "    printf( \"%d\\n\", argc );"),
+            (natureOfChange.ADDED, "    printf( \"%d\\n\", argc + 1 );"),
+        ]
+        file_lines = [line + "\n" for line in LINES]
+        tokens = tm.WindowTokens("file.cpp", patch_lines, file_lines)
+        for patch_idx, file_idx in [(0, 0), (1, 3), (2, 3)]:
+            diff = tokens.diff(patch_idx, file_idx)
+            expected = tm.calculate_language_diff(
+                patch_lines[patch_idx][1].strip(), LINES[file_idx].strip(), "file.cpp"
+            )
+            self.assertEqual( diff.patch_tokens, expected.patch_tokens )
+            self.assertEqual( diff.file_tokens, expected.file_tokens )
+            self.assertEqual( set(diff.diff_tokens), set(expected.diff_tokens) )
+
+        unsupported = tm.WindowTokens("file.txt", patch_lines, file_lines)
+        self.assertEqual( unsupported.diff(0, 0).language, Language.NOT_SUPPORTED )
+
+if __name__ == "__main__":
+    unittest.main()
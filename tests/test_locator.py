@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+import scripts.patch_match.locator as locator
+
+# Lines that aren't anything like each other.
+_random = random.Random(0)
+LINES = [
+    "    %s = %s(%d);\n" % (
+        "".join(_random.choice("abcdefghijklmnopqrstuvwxyz") for i in range(12)),
+        "".join(_random.choice("abcdefghijklmnopqrstuvwxyz") for i in range(12)),
+        i,
+    )
+    for i in range(500)
+]
+
+class TestLocator(unittest.TestCase):
+    def setUp(self):
+        self.source = source_file.SourceFile("test.c", list(LINES))
+
+    def hunk(self, start, count=7):
+        return [line.rstrip("\n") for line in LINES[start:start + count]]
+
+    def test_exact(self):
+        self.assertEqual( locator.locate(self.hunk(100), self.source, 100), 101 )
+        # Found far away from where it was expected.
+        self.assertEqual( locator.locate(self.hunk(400), self.source, 10), 401 )
+
+    def test_changed(self):
+        hunk = self.hunk(200)
+        hunk[0] = hunk[0].replace("(200)", "(0)")
+        hunk[3] = "    something else entirely;"
+        self.assertEqual( locator.locate(hunk, self.source, 190), 201 )
+
+    def test_lines_added(self):
+        # Lines added to the file in the middle of the hunk.
+        lines = list(LINES)
+        lines[302:302] = ["    added();\n"] * 3
+        source = source_file.SourceFile("test.c", lines)
+        self.assertEqual( locator.locate(self.hunk(300), source, 300), 301 )
+
+    def test_no_anchors(self):
+        # Every line has changed a little, so the windows around where
+        # the hunk is expected are scored.
+        hunk = [line.replace(");", ") ;") for line in self.hunk(250)]
+        self.assertEqual( locator.locate(hunk, self.source, 100), 251 )
+        # A long hunk only scores the windows close by.
+        hunk = [line.replace(");", ") ;") for line in self.hunk(250, 100)]
+        self.assertEqual( locator.locate(hunk, self.source, 240), 251 )
+        self.assertEqual( locator.locate(hunk, self.source, 100), -1 )
+
+    def test_candidates(self):
+        # The same code twice, as in two copies of a driver.
+        lines = list(LINES)
+        lines[400:407] = LINES[100:107]
+        source = source_file.SourceFile("test.c", lines)
+
+        found = locator.candidates(self.hunk(100), source, 380, k=3)
+        self.assertEqual( [line for line, score in found], [401, 101] )
+        self.assertGreater( found[0][1], found[1][1] )
+        self.assertEqual( locator.candidates(self.hunk(100), source, 380), found[:1] )
+
+    def test_no_match(self):
+        hunk = ["if (nothing) {", "    return like_it;", "}"]
+        self.assertEqual( locator.locate(hunk, self.source, 100), -1 )
+        self.assertEqual( locator.locate(["", "  "], self.source, 100), -1 )
+        self.assertEqual( locator.candidates(hunk, self.source, 100, k=3), [] )
+
+if __name__ == "__main__":
+    unittest.main()
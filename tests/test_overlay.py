@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+import scripts.overlay as overlay
+import scripts.patch_apply.patchParser as parse
+from scripts.enums import natureOfChange
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "source.c")
+        with open(self.path, "w") as fileObj:
+            fileObj.write("".join("line %d\n" % i for i in range(1, 11)))
+        source_file.clear()
+        overlay.rollback()
+
+    def tearDown(self):
+        overlay.rollback()
+        source_file.clear()
+        self.tmpdir.cleanup()
+
+    def contents(self, path=None):
+        with open(path or self.path) as fileObj:
+            return fileObj.read().splitlines()
+
+    def hunk(self, line):
+        hunk = parse.Patch()
+        hunk.addLines(natureOfChange.CONTEXT, "")
+        hunk.addLines(natureOfChange.CONTEXT, "line %d" % line)
+        hunk.addLines(natureOfChange.REMOVED, "line %d" % (line + 1))
+        hunk.addLines(natureOfChange.ADDED, "changed %d" % (line + 1))
+        hunk.addLines(natureOfChange.CONTEXT, "line %d" % (line + 2))
+        return hunk
+
+    def test_read_through(self):
+        overlay.edit(self.path).replace(0, 1, ["new 1\n"])
+
+        # Readers see the change, the disk doesn't.
+        self.assertEqual( overlay.read(self.path).stripped[0], "new 1" )
+        self.assertEqual( self.contents()[0], "line 1" )
+        self.assertTrue( overlay.isModified(self.path) )
+
+        overlay.commit()
+        self.assertEqual( self.contents()[0], "new 1" )
+        self.assertFalse( overlay.isModified(self.path) )
+
+    def test_rollback(self):
+        overlay.edit(self.path).replace(0, 10, [])
+        self.assertEqual( len(overlay.read(self.path)), 0 )
+
+        overlay.rollback()
+        self.assertEqual( len(overlay.read(self.path)), 10 )
+        self.assertEqual( len(self.contents()), 10 )
+
+    def test_create_and_remove(self):
+        new_path = os.path.join(self.tmpdir.name, "new.c")
+        overlay.current().create(new_path, ["int x;\n"])
+        overlay.current().remove(self.path)
+
+        self.assertTrue( overlay.isfile(new_path) )
+        self.assertFalse( overlay.exists(self.path) )
+        self.assertFalse( os.path.exists(new_path) )
+
+        diff = overlay.current().diff()
+        self.assertIn( "+int x;", diff )
+        self.assertIn( "-line 1", diff )
+
+        overlay.commit()
+        self.assertEqual( self.contents(new_path), ["int x;"] )
+        self.assertFalse( os.path.exists(self.path) )
+
+    def test_apply_buffered(self):
+        hunks = [self.hunk(2), self.hunk(7)]
+        for hunk in hunks:
+            self.assertTrue( hunk.Apply(self.path, buffered=True) )
+
+        # Nothing is written until the overlay is committed.
+        self.assertEqual( self.contents()[2], "line 3" )
+        self.assertEqual( overlay.read(self.path).stripped[2], "changed 3" )
+        overlay.commit()
+
+        contents = self.contents()
+        self.assertEqual( contents[2], "changed 3" )
+        self.assertEqual( contents[7], "changed 8" )
+        self.assertEqual( len(contents), 10 )
+
+    def test_later_hunks_see_earlier_ones(self):
+        first = self.hunk(2)
+        self.assertTrue( first.Apply(self.path, dry_run=True, buffered=True) )
+
+        # The same hunk no longer applies once the first copy is in the
+        # overlay, even though nothing was written.
+        second = self.hunk(2)
+        self.assertEqual( second.canApply(self.path), parse.precheckStatus.ALREADY_APPLIED )
+        self.assertEqual( self.contents()[2], "line 3" )
+
+    def test_dry_run(self):
+        self.assertTrue( self.hunk(2).Apply(self.path, dry_run=True) )
+        self.assertFalse( overlay.isModified(self.path) )
+        self.assertEqual( self.contents()[2], "line 3" )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import io
+import json
+import tempfile
+
+from io import StringIO
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".")))
+import scripts.source_file as source_file
+import scripts.overlay as overlay
+import scripts.patch_apply.series as series
+import scripts.patch_apply.apply as apply
+from helpers import git
+
+SOURCE = "a\nb\nc\n"
+
+# The second patch only applies once the first one has been.
+SERIES = """From 1111111111111111111111111111111111111111 Mon Sep 17 00:00:00 2001
+From: A U Thor <author@example.com>
+Subject: [PATCH 1/2] Change b
+ and more
+
+---
+ source.c | 2 +-
+ 1 file changed, 1 insertion(+), 1 deletion(-)
+
+diff --git a/source.c b/source.c
+--- a/source.c
++++ b/source.c
+@@ -1,3 +1,3 @@
+ a
+-b
++B
+ c
+--
+2.39.0
+
+From 2222222222222222222222222222222222222222 Mon Sep 17 00:00:00 2001
+From: A U Thor <author@example.com>
+Subject: =?UTF-8?q?[PATCH 2/2] Change =C3=A7?=
+
+---
+diff --git a/source.c b/source.c
+--- a/source.c
++++ b/source.c
+@@ -1,3 +1,3 @@
+ a
+ B
+-c
++ç
+--
+2.39.0
+"""
+
+class TestSeries(unittest.TestCase):
+    def setUp(self):
+        self.oldcwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        with open("source.c", "w") as fileObj:
+            fileObj.write(SOURCE)
+        with open("series.mbox", "w", encoding="utf-8") as fileObj:
+            fileObj.write(SERIES)
+        source_file.clear()
+        overlay.rollback()
+
+    def tearDown(self):
+        overlay.rollback()
+        source_file.clear()
+        os.chdir(self.oldcwd)
+        self.tmpdir.cleanup()
+
+    def test_iter_messages(self):
+        def lines():
+            for line in io.BytesIO(SERIES.encode("utf-8")):
+                yield line
+                if line.startswith(b"From 2222"):
+                    raise AssertionError("read past the start of the second message")
+
+        first = next(series.iter_messages(lines()))
+        self.assertEqual( series.subject(first), "[PATCH 1/2] Change b and more" )
+        self.assertEqual( first[-2:], [b"2.39.0\n", b"\n"] )
+
+        messages = list(series.iter_messages(io.BytesIO(SERIES.encode("utf-8"))))
+        self.assertEqual( len(messages), 2 )
+        self.assertEqual( series.subject(messages[1]), "[PATCH 2/2] Change ç" )
+
+        # A plain patch is a series of one.
+        self.assertEqual( len(list(series.iter_messages(io.BytesIO(b"--- a/x\n+++ b/x\n")))), 1 )
+
+    def test_directory_order(self):
+        os.mkdir("patches")
+        for name in ["0010-last.patch", "0002-second.patch", "0001-first.patch", "0002-second.patch~"]:
+            with open(os.path.join("patches", name), "w") as fileObj:
+                fileObj.write("Subject: [PATCH] %s\n\n" % name)
+
+        messages = list(series.iter_series("patches"))
+        self.assertEqual( [message.number for message in messages], [1, 2, 3] )
+        self.assertEqual( [message.subject for message in messages], [
+            "[PATCH] 0001-first.patch", "[PATCH] 0002-second.patch", "[PATCH] 0010-last.patch",
+        ] )
+
+    def test_apply_series(self):
+        records = StringIO()
+        with patch('sys.stdout', new=StringIO()) as fakeOutput:
+            apply.main( pathToPatch="series.mbox",
+                        series=True,
+                        dry_run=False,
+                        reverse=False,
+                        verbose=0,
+                        batch="never-apply",
+                        records=records,
+            )
+
+        self.assertRegex( fakeOutput.getvalue(), r"Examining patch 1: \[PATCH 1/2\] Change b and more" )
+        self.assertRegex( fakeOutput.getvalue(), r"Examining patch 2: \[PATCH 2/2\] Change ç" )
+        with open("source.c", encoding="utf-8") as fileObj:
+            self.assertEqual( fileObj.read(), "a\nB\nç\n" )
+        self.assertEqual( [json.loads(line)["patch"] for line in records.getvalue().splitlines()],
+                          ["series.mbox:1", "series.mbox:2"] )
+
+        # The patches were written to temporary files, now removed.
+        self.assertEqual( sorted(os.listdir(".")), ["series.mbox", "source.c"] )
+
+    def test_apply_series_moved_file(self):
+        # The first patch is for a file that has moved, and is applied to
+        # it where it is now; the second one is for the file where it is
+        # now, and only applies after the first one.
+        os.mkdir("moved")
+        os.rename("source.c", os.path.join("moved", "source.c"))
+        os.mkdir("patches")
+        with open(os.path.join("patches", "0001-first.patch"), "w") as fileObj:
+            fileObj.write("--- a/source.c\n+++ b/source.c\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n")
+        with open(os.path.join("patches", "0002-second.patch"), "w") as fileObj:
+            fileObj.write("--- a/moved/source.c\n+++ b/moved/source.c\n@@ -1,3 +1,3 @@\n a\n B\n-c\n+C\n")
+
+        applied = []
+        def record(pathToPatch, **kwargs):
+            applied.append(kwargs['series_files'])
+            return apply_patch(pathToPatch, **kwargs)
+
+        apply_patch = apply.apply
+        with patch('sys.stdout', new=StringIO()) as fakeOutput, \
+             patch('builtins.input', side_effect=lambda prompt: "0" if prompt.startswith("Select") else "Y"), \
+             patch.object(apply, 'apply', new=record):
+            # Pick the file found elsewhere when asked.
+            fakeOutput.isatty = lambda: True
+            apply.main( pathToPatch="patches",
+                        series=True,
+                        dry_run=False,
+                        reverse=False,
+                        verbose=0,
+                        try_all_subpatches=True,
+            )
+
+        with open(os.path.join("moved", "source.c")) as fileObj:
+            self.assertEqual( fileObj.read(), "a\nB\nC\n" )
+        self.assertEqual( applied[0], None )
+        self.assertEqual( applied[1], {"source.c", os.path.abspath(os.path.join("moved", "source.c"))} )
+
+    def test_moved_file_hunks(self):
+        # Every hunk of a file that has moved goes to where it is now,
+        # also when run from a directory below the top of the repository.
+        git("init", "-q")
+        os.makedirs(os.path.join("sub", "moved"))
+        with open(os.path.join("sub", "moved", "source.c"), "w") as fileObj:
+            fileObj.write("".join("line %d\n" % i for i in range(1, 31)))
+        os.chdir("sub")
+        with open("change.patch", "w") as fileObj:
+            fileObj.write("--- a/source.c\n+++ b/source.c\n"
+                          "@@ -2,3 +2,3 @@\n line 2\n-line 3\n+LINE 3\n line 4\n"
+                          "@@ -25,3 +25,3 @@\n line 25\n-line 26\n+LINE 26\n line 27\n")
+
+        with patch('sys.stdout', new=StringIO()) as fakeOutput, \
+             patch('builtins.input', side_effect=lambda prompt: "0" if prompt.startswith("Select") else "Y"):
+            # Pick the file found elsewhere when asked.
+            fakeOutput.isatty = lambda: True
+            apply.main( pathToPatch="change.patch",
+                        dry_run=True,
+                        reverse=False,
+                        verbose=0,
+            )
+
+        self.assertRegex( fakeOutput.getvalue(), r"moved/source.c:2 would have been successfully applied" )
+        self.assertRegex( fakeOutput.getvalue(), r"moved/source.c:25 would have been successfully applied" )
+        self.assertNotIn( "applied by git apply", fakeOutput.getvalue() )
+        self.assertEqual( fakeOutput.getvalue().count("Here are the locations"), 1 )
+
+    def test_keeps_other_files(self):
+        with open("other.c", "w") as fileObj:
+            fileObj.write(SOURCE)
+        with open("change.patch", "w") as fileObj:
+            fileObj.write("--- a/source.c\n+++ b/source.c\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n")
+
+        other = source_file.get("other.c")
+        source = source_file.get("source.c")
+        with patch('sys.stdout', new=StringIO()):
+            apply.apply( "change.patch", dry_run=True, reverse=False, verbose=0,
+                         series_files={"source.c"} )
+        self.assertIs( source_file.get("other.c"), other )
+        self.assertIsNot( source_file.get("source.c"), source )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import Levenshtein
+import scripts.patch_match.similarity as similarity
+
+ROWS = ["int a = 0;", "", "return a;", "int a = 0;", "}"]
+COLUMNS = ["int a = 1;", "return b;", "", "}", "while (1) {"]
+
+class TestSimilarity(unittest.TestCase):
+    def check(self):
+        ratios = similarity.matrix(ROWS, COLUMNS)
+        self.assertEqual( ratios, [
+            [Levenshtein.ratio(row, column) for column in COLUMNS] for row in ROWS
+        ] )
+        self.assertEqual( similarity.matrix([], COLUMNS), [] )
+        self.assertEqual( similarity.matrix(ROWS, []), [[]] * len(ROWS) )
+
+    def test_matrix(self):
+        self.check()
+
+    def test_matrix_without_numpy(self):
+        with patch.object(similarity, "numpy", None):
+            self.check()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import tempfile
+
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.patch_context.slice_and_parse as slice
+from scripts.cache import DiskCache
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        cache = DiskCache(self.tmpdir.name, 1024 * 1024)
+        self.assertIsNone( cache.get("missing") )
+
+        cache.put("key", {"func": {"var": ["a", "b"]}})
+        self.assertEqual( cache.get("key"), {"func": {"var": ["a", "b"]}} )
+
+    def test_evicts_least_recently_used(self):
+        cache = DiskCache(self.tmpdir.name, 1024 * 1024)
+        for key in ["one", "two", "three"]:
+            cache.put(key, "x" * 100)
+            time.sleep(0.01)
+
+        # Reading "one" makes "two" the least recently used entry.
+        cache.get("one")
+        cache.max_bytes = 2 * os.path.getsize(cache._path("one"))
+        cache.evict()
+
+        self.assertIsNotNone( cache.get("one") )
+        self.assertIsNone( cache.get("two") )
+        self.assertIsNotNone( cache.get("three") )
+
+class TestSliceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "source.c")
+        with open(self.source, "w") as fileObj:
+            fileObj.write("int main() { return 0; }\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_follows_content(self):
+        cache = slice.SliceCache(os.path.join(self.tmpdir.name, "cache"))
+        key = cache.key(self.source)
+        self.assertEqual( key, cache.key(self.source) )
+
+        with open(self.source, "a") as fileObj:
+            fileObj.write("\n")
+        self.assertNotEqual( key, cache.key(self.source) )
+
+    def test_hit_does_not_spawn(self):
+        cache = slice.SliceCache(os.path.join(self.tmpdir.name, "cache"))
+        expected = {"main": {"x": ["source.c", "main", "x", "1", "", "", "", ""]}}
+        cache.put(cache.key(self.source), expected)
+
+        with patch("subprocess.Popen") as popen:
+            result = slice.SliceParser(self.source, cache=cache).slice_parse()
+            popen.assert_not_called()
+
+        self.assertEqual( result, expected )
+
+class TestSliceBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = slice.SliceCache(os.path.join(self.tmpdir.name, "cache"))
+        self.sources = []
+        for name in ["one.c", "two.c"]:
+            source = os.path.join(self.tmpdir.name, name)
+            with open(source, "w") as fileObj:
+                fileObj.write("int %s() { return 0; }\n" % name[:-2])
+            self.sources.append(source)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_split_output(self):
+        output = "\n".join([
+            "%s,f,x,def{1},use{2},dvars{},pointers{},cfuncs{}" % self.sources[0],
+            "%s,g,y,def{3},use{4},dvars{},pointers{},cfuncs{}" % self.sources[1],
+            "Time is: 0.1",
+        ])
+        result = {source: {} for source in self.sources}
+        for source, file_data in slice.match_slices(output.splitlines(), self.sources):
+            slice.add_slice(result[source], file_data)
+
+        self.assertEqual( list(result[self.sources[0]].keys()), ["f"] )
+        self.assertEqual( result[self.sources[0]]["f"]["x"][3], "1" )
+        self.assertEqual( list(result[self.sources[1]].keys()), ["g"] )
+        self.assertEqual( result[self.sources[1]]["g"]["y"][4], "4" )
+
+    def test_one_run_for_all_files(self):
+        sliced = {source: {source: {}} for source in self.sources}
+        batch = slice.SliceBatch(cache=self.cache)
+        for source in self.sources:
+            batch.add(source)
+
+        with patch.object(slice, "slice_files", return_value=sliced) as slice_files, \
+             patch.object(self.cache, "evict", wraps=self.cache.evict) as evict:
+            for source in self.sources:
+                self.assertEqual( batch.get(source), {source: {}} )
+            slice_files.assert_called_once_with(self.sources)
+            # The cache is trimmed once for the batch, not once a file.
+            evict.assert_called_once_with()
+
+        # The results were cached, so a new batch doesn't slice anything.
+        batch = slice.SliceBatch(cache=self.cache)
+        with patch.object(slice, "slice_files") as slice_files:
+            self.assertEqual( batch.get(self.sources[1]), {self.sources[1]: {}} )
+            slice_files.assert_not_called()
+
+    def test_unsupported_file(self):
+        source = os.path.join(self.tmpdir.name, "notes.txt")
+        with open(source, "w") as fileObj:
+            fileObj.write("hello\n")
+
+        batch = slice.SliceBatch(cache=self.cache)
+        with patch.object(slice, "slice_files") as slice_files:
+            self.assertIsNone( batch.get(source) )
+            slice_files.assert_not_called()
+
+class TestSlicePipeline(unittest.TestCase):
+    """
+    Runs the pipeline with stand-ins for srcml and srcslice to check the
+    plumbing between them.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.bindir = os.path.join(self.tmpdir.name, "bin")
+        os.mkdir(self.bindir)
+
+        # "srcml" copies the input files (or its standard input when it is
+        # given the language), "srcslice" turns every line of its input
+        # into a slice.
+        self.write_tool(
+            "srcml",
+            'if [ "$1" = -l ]; then cat; else for f in "$@"; do [ "$f" = --position ] || cat "$f"; done; fi',
+        )
+        self.srcslice = self.write_tool(
+            "srcslice",
+            'while read -r f v; do echo "$f,func,$v,def{1},use{2},dvars{},pointers{},cfuncs{}"; done <"$1"',
+        )
+
+        self.source = os.path.join(self.tmpdir.name, "source.c")
+        with open(self.source, "w") as fileObj:
+            fileObj.write("%s a\n%s b\n" % (self.source, self.source))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_tool(self, name, script):
+        path = os.path.join(self.bindir, name)
+        with open(path, "w") as fileObj:
+            fileObj.write("#!/bin/sh\n" + script + "\n")
+        os.chmod(path, 0o755)
+        return path
+
+    def run_slice(self, text=None):
+        environ = dict(os.environ)
+        environ["PATH"] = self.bindir + os.pathsep + environ["PATH"]
+        with patch.dict(os.environ, environ), \
+             patch.object(slice, "src_slice_path", self.srcslice):
+            return slice.slice_files([self.source], text=text)
+
+    def test_pipeline(self):
+        result = self.run_slice()
+        self.assertEqual( list(result[self.source].keys()), ["func"] )
+        self.assertEqual( result[self.source]["func"]["b"][3], "1" )
+
+    def test_text(self):
+        # The contents given are sliced instead of the file on disk.
+        result = self.run_slice(text="%s c\n" % self.source)
+        self.assertEqual( list(result[self.source]["func"].keys()), ["c"] )
+
+    def test_failure(self):
+        self.write_tool("srcml", 'echo "srcml: broken" >&2; exit 1')
+        self.assertIsNone( self.run_slice() )
+
+if __name__ == "__main__":
+    unittest.main()
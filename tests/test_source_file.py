@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "."))
+import scripts.source_file as source_file
+
+class TestSourceFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "source.c")
+        with open(self.path, "wb") as fileObj:
+            fileObj.write(b"int a;\r\n  int b;  \nint c;")
+        source_file.clear()
+
+    def tearDown(self):
+        source_file.clear()
+        self.tmpdir.cleanup()
+
+    def test_read(self):
+        source = source_file.get(self.path)
+        self.assertEqual( source.lines, ["int a;\n", "  int b;  \n", "int c;"] )
+        self.assertEqual( source.stripped, ["int a;", "int b;", "int c;"] )
+        self.assertEqual( source.offsets, [0, 7, 18, 24] )
+        self.assertEqual( source.encoding, "utf-8" )
+
+    def test_index(self):
+        with open(self.path, "w") as fileObj:
+            fileObj.write("{\n  int a;\n\n}\n{\n}\n")
+        source = source_file.get(self.path)
+
+        self.assertEqual( source.positions("{"), [0, 4] )
+        self.assertEqual( source.positions("}"), [3, 5] )
+        self.assertEqual( source.positions("int b;"), [] )
+        self.assertEqual( source.nonblank, [0, 1, 2, 2, 3, 4, 5] )
+
+    def test_latin1(self):
+        with open(self.path, "wb") as fileObj:
+            fileObj.write(b"char *s = \"\xe9\";\n")
+        source = source_file.get(self.path)
+        self.assertEqual( source.encoding, "latin-1" )
+
+        source_file.write(self.path, source.lines)
+        with open(self.path, "rb") as fileObj:
+            self.assertEqual( fileObj.read(), b"char *s = \"\xe9\";\n" )
+
+    def test_read_once(self):
+        source = source_file.get(self.path)
+        with patch.object(source_file.SourceFile, "read") as read:
+            self.assertIs( source_file.get(self.path), source )
+            read.assert_not_called()
+
+    def test_write_updates_cache(self):
+        source_file.get(self.path)
+        source_file.write(self.path, ["int d;\n"])
+
+        with patch.object(source_file.SourceFile, "read") as read:
+            self.assertEqual( source_file.get(self.path).lines, ["int d;\n"] )
+            read.assert_not_called()
+
+        with open(self.path) as fileObj:
+            self.assertEqual( fileObj.read(), "int d;\n" )
+
+    def test_changed_on_disk(self):
+        source_file.get(self.path)
+        with open(self.path, "w") as fileObj:
+            fileObj.write("int e;\nint f;\n")
+
+        self.assertEqual( source_file.get(self.path).stripped, ["int e;", "int f;"] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+from io import StringIO
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".")))
+import scripts.trace as trace
+import scripts.patch_apply.apply as apply
+
+class TestTrace(unittest.TestCase):
+    def tearDown(self):
+        trace.disable()
+
+    def test_disabled(self):
+        self.assertIsNone( trace.current() )
+        with trace.span("stage") as span:
+            span.set(status="ok")
+        trace.count("counter")
+        self.assertIsNone( trace.current() )
+
+    def test_spans(self):
+        tracer = trace.enable()
+        with trace.span("outer", path="a.patch"):
+            for i in range(3):
+                with trace.span("inner") as span:
+                    span.set(index=i)
+            trace.count("bytes read", 10)
+            trace.count("bytes read", 5)
+
+        self.assertEqual( [event[0] for event in tracer.events], ["inner"] * 3 + ["outer"] )
+        self.assertEqual( tracer.counters, {"bytes read": 15} )
+        self.assertEqual( [row[:3] for row in tracer.stats()], [("stage", "outer", 1), ("stage", "inner", 3)] )
+
+        chrome = tracer.chrome()["traceEvents"]
+        self.assertEqual( chrome[0]["ph"], "X" )
+        self.assertEqual( chrome[0]["args"], {"index": 0} )
+        self.assertEqual( chrome[3]["args"], {"path": "a.patch"} )
+        self.assertLessEqual( chrome[3]["ts"], chrome[0]["ts"] )
+        self.assertEqual( chrome[-1]["ph"], "C" )
+        self.assertEqual( chrome[-1]["args"], {"bytes read": 15} )
+
+    def test_merge(self):
+        worker = trace.Tracer()
+        with worker.span("hunk"):
+            pass
+        worker.count("levenshtein", 3)
+
+        tracer = trace.Tracer()
+        tracer.count("levenshtein", 1)
+        tracer.merge(worker.export())
+        self.assertEqual( len(tracer.events), 1 )
+        self.assertEqual( tracer.counters, {"levenshtein": 4} )
+
+    def test_apply(self):
+        oldcwd = os.getcwd()
+        os.chdir(os.path.dirname(__file__))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            try:
+                with patch('sys.stdout', new=StringIO()), patch('sys.stderr', new=StringIO()) as stats:
+                    apply.main( pathToPatch='patches/changed/string.patch',
+                                dry_run=True,
+                                reverse=False,
+                                verbose=0,
+                                trace=path,
+                                stats=True,
+                    )
+            finally:
+                os.chdir(oldcwd)
+
+            with open(path) as fileObj:
+                events = json.load(fileObj)["traceEvents"]
+
+        self.assertIsNone( trace.current() )
+        names = {event["name"] for event in events}
+        for name in ["patch", "runPatch", "getPatch", "hunk", "canApply", "context_changes", "find_diffs"]:
+            self.assertIn( name, names )
+        hunks = [event for event in events if event["name"] == "hunk"]
+        self.assertEqual( hunks[0]["args"], {"hunk": "patches/test.cpp:20", "status": "NO_MATCH_FOUND"} )
+        self.assertGreater( events[-1]["args"]["levenshtein"], 0 )
+        self.assertRegex( stats.getvalue(), r"(?m)^stage +find_diffs +1 " )
+
+if __name__ == "__main__":
+    unittest.main()